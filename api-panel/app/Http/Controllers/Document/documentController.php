@@ -19,6 +19,12 @@ public function index(Request $request)
     {
         $search = $request->search;
         $documents = Document::where('name', 'LIKE', "%{$search}%")->with('typeDocument')->latest()->get();
+
+        // Las ingestas en curso se consultan al RAG para mostrar si terminaron o fallaron
+        foreach ($documents as $document) {
+            $this->refreshIngestStatus($document);
+        }
+
         return response()->json([
             'success' => true,
             'documents' => $documents
@@ -62,7 +68,9 @@ public function store(Request $request)
 
             return response()->json([
                 'success' => true,
-                'message' => 'Documento creado e ingresado correctamente',
+                'message' => $document->ingest_status === 'failed'
+                    ? 'Documento creado, pero no se pudo enviar a la ingesta'
+                    : 'Documento creado; la ingesta se procesa en segundo plano',
                 'document' => $document->load('typeDocument')
             ], 201);
 
@@ -81,6 +89,8 @@ public function show(string $id)
             return response()->json(['success' => false, 'message' => 'Documento no encontrado'], 404);
         }
 
+        $this->refreshIngestStatus($document);
+
         return response()->json(['success' => true, 'document' => $document]);
     }
 
@@ -168,9 +178,10 @@ private function ingestToRag(Document $document)
             // Por lo tanto, necesitamos pasarle solo el nombre del archivo
             $filename = basename($document->path);
             
-            $url = "http://rag-core:8000/ingest-pdf";
+            // La ingesta se encola en el RAG; el progreso se consulta en GET /ingest-jobs/{job_id}
+            $url = "http://rag-core:8000/ingest-jobs";
             
-            $response = Http::timeout(60)->post($url, [
+            $response = Http::timeout(15)->post($url, [
                 'pdf_path' => $filename,
                 'doc_id' => (string) $document->id,
                 'name' => (string) $document->name,
@@ -180,13 +191,60 @@ private function ingestToRag(Document $document)
                 'replace_existing' => true
             ]);
 
+            if ($response->successful()) {
+                \Log::info("Ingesta encolada en RAG", ['document_id' => $document->id, 'job_id' => $response->json('job_id')]);
+                $document->update([
+                    'ingest_job_id' => $response->json('job_id'),
+                    'ingest_status' => $response->json('status', 'queued'),
+                    'ingest_error' => null,
+                ]);
+            } else {
+                $document->update([
+                    'ingest_job_id' => null,
+                    'ingest_status' => 'failed',
+                    'ingest_error' => $response->json('detail') ?? "El RAG respondió {$response->status()}",
+                ]);
+            }
+
             return $response->successful();
         } catch (\Exception $e) {
             \Log::error("Error enviando a RAG: " . $e->getMessage());
+            $document->update([
+                'ingest_job_id' => null,
+                'ingest_status' => 'failed',
+                'ingest_error' => 'No se pudo contactar al RAG: ' . $e->getMessage(),
+            ]);
             return false;
         }
     }
 
+    /**
+     * Actualiza el estado de la ingesta consultando GET /ingest-jobs/{job_id} mientras siga en curso.
+     */
+    private function refreshIngestStatus(Document $document)
+    {
+        if (!$document->ingest_job_id || !in_array($document->ingest_status, ['queued', 'running'])) {
+            return;
+        }
+
+        try {
+            $response = Http::timeout(5)->get("http://rag-core:8000/ingest-jobs/" . $document->ingest_job_id);
+
+            if ($response->status() === 404) {
+                // El RAG ya no conserva el trabajo (INGEST_JOB_RETENTION_HOURS)
+                $document->update(['ingest_status' => 'failed', 'ingest_error' => 'Trabajo de ingesta no encontrado en el RAG']);
+            } elseif ($response->successful()) {
+                $document->update([
+                    'ingest_status' => $response->json('status'),
+                    'ingest_error' => $response->json('error'),
+                ]);
+            }
+        } catch (\Exception $e) {
+            // Si el RAG no responde se conserva el último estado conocido
+            \Log::warning("No se pudo consultar la ingesta del documento {$document->id}: " . $e->getMessage());
+        }
+    }
+
     private function deleteFromRag($doc_id)
     {
         try {
@@ -4,6 +4,7 @@
 
 use App\Models\Setting;
 use Illuminate\Http\Request;
+use Illuminate\Support\Facades\Http;
 use Illuminate\Support\Facades\Storage;
 
 class SettingController extends Controller
@@ -61,6 +62,15 @@ public function update(Request $request)
             $setting->qr_url = null;
         }
 
+        // El bot guarda la configuración de pago en caché: se invalida para que muestre los datos nuevos
+        try {
+            Http::timeout(3)
+                ->withHeaders(['X-Bot-Admin-Token' => env('BOT_ADMIN_TOKEN', '')])
+                ->delete(env('BOT_INTERNAL_URL', 'http://saas_legal_bot:8090') . "/admin/cache/catalog");
+        } catch (\Exception $e) {
+            \Log::warning("No se pudo invalidar la caché del bot: " . $e->getMessage());
+        }
+
         return response()->json([
             'message' => 'Configuración actualizada correctamente',
             'setting' => $setting
@@ -62,6 +62,9 @@ public function approve($id)
             'end_date' => $end->format('Y-m-d')
         ]);
 
+        // El bot guarda la suscripción en caché: se invalida para que la próxima consulta ya la vea activa
+        $this->evictBotCache($subscription);
+
         // Notificar al cliente vía Telegram
         $this->notifyClient($subscription);
 
@@ -79,6 +82,8 @@ public function cancel($id)
             'status' => 'cancelled'
         ]);
 
+        $this->evictBotCache($subscription);
+
         return response()->json([
             'message' => 'Suscripción cancelada'
         ]);
@@ -116,6 +121,26 @@ public function destroy(string $id)
         //
     }
 
+    private function evictBotCache($subscription)
+    {
+        $subscription->loadMissing('client');
+        $telegramId = $subscription->client->telegram_id;
+
+        if (!$telegramId) {
+            return;
+        }
+
+        // Si el bot no responde, su caché vence sola (SUSCRIPCION_CACHE_TTL)
+        try {
+            $url = env('BOT_INTERNAL_URL', 'http://saas_legal_bot:8090') . "/admin/cache/entitlements/" . $telegramId;
+            Http::timeout(3)
+                ->withHeaders(['X-Bot-Admin-Token' => env('BOT_ADMIN_TOKEN', '')])
+                ->delete($url);
+        } catch (\Exception $e) {
+            \Log::warning("No se pudo invalidar la caché del bot para {$telegramId}: " . $e->getMessage());
+        }
+    }
+
     private function notifyClient($subscription)
     {
         $subscription->load(['client', 'membership']);
@@ -17,7 +17,10 @@ class Document extends Model
         'path',
         'category_ids',
         'type_document_id',
-        'status'
+        'status',
+        'ingest_job_id',
+        'ingest_status',
+        'ingest_error'
     ];
 
     protected $casts = [
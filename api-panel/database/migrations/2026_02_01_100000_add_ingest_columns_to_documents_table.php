@@ -0,0 +1,31 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    /**
+     * Run the migrations.
+     */
+    public function up(): void
+    {
+        Schema::table('documents', function (Blueprint $table) {
+            // Trabajo de ingesta en el RAG: queued, running, done, failed
+            $table->string('ingest_job_id')->nullable()->after('status');
+            $table->string('ingest_status')->nullable()->after('ingest_job_id');
+            $table->text('ingest_error')->nullable()->after('ingest_status');
+        });
+    }
+
+    /**
+     * Reverse the migrations.
+     */
+    public function down(): void
+    {
+        Schema::table('documents', function (Blueprint $table) {
+            $table->dropColumn(['ingest_job_id', 'ingest_status', 'ingest_error']);
+        });
+    }
+};
@@ -0,0 +1,185 @@
+"""
+Prueba de carga de los clientes HTTP del bot: un cliente nuevo por mensaje (como hacían
+los handlers con `async with httpx.AsyncClient()`) contra los clientes compartidos de
+main.py (crear_cliente_http, conexiones keep-alive reutilizadas).
+
+Levanta un servidor falso que responde como Laravel y el RAG:
+  - GET  /api/bot/check-client/<id>  -> JSON con una suscripción activa
+  - POST /query/stream               -> Server-Sent Events (sources, tokens, done)
+
+y simula N usuarios concurrentes que hacen /consulta varias veces (check-client + stream
+del RAG, el mismo recorrido que `consultar`). Informa la latencia p50/p95/max por consulta
+y cuántas conexiones se abrieron contra el servidor.
+
+--handshake-ms agrega un retardo al aceptar cada conexión para simular el costo de
+establecerla (TCP/TLS a otro contenedor o host); con 0 se mide solo localhost.
+
+Uso (desde bot-telegram/):
+    python -m benchmarks.bench_http_clients --users 50 --messages 10 --handshake-ms 20
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import time
+
+import httpx
+
+# main.py lee la configuración al importarse
+os.environ.setdefault("LARAVEL_API_URL", "http://127.0.0.1/api")
+import main  # noqa: E402
+
+TOKENS = 20
+
+
+class ServidorFalso:
+    """Servidor HTTP/1.1 mínimo con keep-alive sobre asyncio streams"""
+
+    def __init__(self, handshake_ms: float, token_ms: float):
+        self.handshake = handshake_ms / 1000
+        self.token_delay = token_ms / 1000
+        self.conexiones = 0
+
+    async def iniciar(self) -> int:
+        self.server = await asyncio.start_server(self.atender, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def cerrar(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def atender(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.conexiones += 1
+        await asyncio.sleep(self.handshake)
+        try:
+            while True:
+                linea = await reader.readline()
+                if not linea:
+                    break
+                metodo, ruta, _ = linea.decode().split(" ", 2)
+                largo = 0
+                while (cabecera := await reader.readline()) not in (b"\r\n", b""):
+                    nombre, _, valor = cabecera.decode().partition(":")
+                    if nombre.lower() == "content-length":
+                        largo = int(valor)
+                if largo:
+                    await reader.readexactly(largo)
+
+                if metodo == "GET" and ruta.startswith("/api/bot/check-client/"):
+                    cuerpo = json.dumps({"exists": True, "current_subscription": {
+                        "id": 1, "status": "active", "categories": [{"id": 1}, {"id": 2}]}}).encode()
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                                 b"Content-Length: %d\r\n\r\n%s" % (len(cuerpo), cuerpo))
+                elif metodo == "POST" and ruta == "/query/stream":
+                    await self.responder_stream(writer)
+                else:
+                    writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def responder_stream(self, writer: asyncio.StreamWriter):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+
+        def evento(nombre: str, datos: dict):
+            texto = f"event: {nombre}\ndata: {json.dumps(datos)}\n\n".encode()
+            writer.write(b"%x\r\n%s\r\n" % (len(texto), texto))
+
+        evento("sources", {"sources": [], "num_contexts": 3})
+        for i in range(TOKENS):
+            evento("token", {"text": f"palabra{i} "})
+            await writer.drain()
+            await asyncio.sleep(self.token_delay)
+        evento("done", {"total_ms": 0})
+        writer.write(b"0\r\n\r\n")
+
+
+async def consulta(cliente_api, cliente_rag, telegram_id: int) -> float:
+    """Mismo recorrido que `consultar`: suscripción en Laravel y respuesta del RAG por streaming"""
+    started = time.perf_counter()
+    resp = await cliente_api.get(f"{main.API_URL}/bot/check-client/{telegram_id}")
+    sub = resp.json()["current_subscription"]
+    payload = {"question": "¿Qué dice el artículo 10?", "category_ids": [c["id"] for c in sub["categories"]],
+               "status": "active", "top_k": 10}
+
+    async def sin_progreso(_texto):
+        pass
+
+    resultado = await main.consultar_rag_stream(cliente_rag, payload, sin_progreso)
+    assert resultado is not None and resultado["answer"]
+    return (time.perf_counter() - started) * 1000
+
+
+async def usuario_cliente_nuevo(telegram_id: int, mensajes: int, latencias: list):
+    for _ in range(mensajes):
+        started = time.perf_counter()
+        async with httpx.AsyncClient() as client:
+            async with httpx.AsyncClient(timeout=main.TIMEOUT_RAG) as rag:
+                await consulta(client, rag, telegram_id)
+        latencias.append((time.perf_counter() - started) * 1000)
+
+
+async def usuario_cliente_compartido(telegram_id: int, mensajes: int, latencias: list):
+    for _ in range(mensajes):
+        latencias.append(await consulta(main.clientes_http["api"], main.clientes_http["rag"], telegram_id))
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def correr(modo: str, args) -> dict:
+    servidor = ServidorFalso(args.handshake_ms, args.token_ms)
+    port = await servidor.iniciar()
+    main.API_URL = f"http://127.0.0.1:{port}/api"
+    main.RAG_URL = f"http://127.0.0.1:{port}"
+
+    latencias: list[float] = []
+    started = time.perf_counter()
+    if modo == "compartido":
+        await main.iniciar_clientes_http(None)
+        usuario = usuario_cliente_compartido
+    else:
+        usuario = usuario_cliente_nuevo
+    await asyncio.gather(*(usuario(1000 + i, args.messages, latencias) for i in range(args.users)))
+    total = time.perf_counter() - started
+    if modo == "compartido":
+        await main.cerrar_clientes_http(None)
+    await servidor.cerrar()
+
+    return {
+        "consultas": len(latencias),
+        "conexiones": servidor.conexiones,
+        "p50_ms": statistics.median(latencias),
+        "p95_ms": percentile(latencias, 0.95),
+        "max_ms": max(latencias),
+        "consultas_s": len(latencias) / total,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="Usuarios concurrentes")
+    parser.add_argument("--messages", type=int, default=10, help="Consultas por usuario")
+    parser.add_argument("--handshake-ms", type=float, default=20.0, help="Retardo al abrir cada conexión")
+    parser.add_argument("--token-ms", type=float, default=2.0, help="Retardo entre tokens del stream")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(f"{args.users} usuarios x {args.messages} consultas, handshake {args.handshake_ms} ms, "
+          f"HTTP/2 disponible: {main.HTTP2_DISPONIBLE} (sobre http:// se usa HTTP/1.1)")
+    print(f"\n{'modo':22s} {'consultas':>9s} {'conexiones':>10s} {'p50 ms':>8s} {'p95 ms':>8s} {'max ms':>8s} {'cons/s':>8s}")
+    for modo, nombre in (("nuevo", "cliente por mensaje"), ("compartido", "clientes compartidos")):
+        r = asyncio.run(correr(modo, args))
+        print(f"{nombre:22s} {r['consultas']:9d} {r['conexiones']:10d} {r['p50_ms']:8.1f} {r['p95_ms']:8.1f} "
+              f"{r['max_ms']:8.1f} {r['consultas_s']:8.1f}")
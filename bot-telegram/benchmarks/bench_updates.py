@@ -0,0 +1,261 @@
+"""
+Benchmark de throughput del bot en modo webhook: procesamiento secuencial de las
+actualizaciones (de a una, como antes) contra ProcesadorPorUsuario (usuarios en paralelo,
+cada chat en orden).
+
+Levanta un servidor falso que hace de Bot API de Telegram (getMe, sendMessage,
+editMessageText...), de Laravel (check-client, memberships) y del RAG (/query/stream por
+SSE), con latencias configurables. Arma la aplicación real de main.py apuntando a ese
+servidor (TELEGRAM_API_URL, LARAVEL_API_URL, RAG_URL), levanta el servidor interno con la
+ruta del webhook y le envía las actualizaciones por HTTP, como lo haría Telegram.
+
+Las actualizaciones pueden ser:
+  - sintéticas (por defecto): cada usuario manda /start, /consulta <pregunta>, /planes y
+    "📊 Ver Detalles", en ese orden
+  - grabadas (--updates archivo.jsonl): un Update de la Bot API por línea, por ejemplo la
+    salida de getUpdates o lo que recibió el webhook
+
+Informa la latencia p50/p95 de las actualizaciones (desde el POST al webhook hasta que
+terminan sus manejadores), de las respuestas de /consulta (hasta la edición final del
+mensaje), el total de actualizaciones por segundo y si cada chat se procesó en orden.
+
+Uso (desde bot-telegram/):
+    python -m benchmarks.bench_updates --users 100 --api-ms 40 --rag-ms 800
+    python -m benchmarks.bench_updates --updates grabadas.jsonl
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import time
+from urllib.parse import parse_qs
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+TOKEN = "123456:BENCH"
+SECRETO = "bench-secreto"
+PUERTO_FALSO = int(os.getenv("BENCH_PUERTO_FALSO", "8787"))
+PUERTO_BOT = int(os.getenv("BENCH_PUERTO_BOT", "8788"))
+
+# main.py lee la configuración al importarse
+os.environ.update({
+    "TELEGRAM_TOKEN": TOKEN,
+    "TELEGRAM_API_URL": f"http://127.0.0.1:{PUERTO_FALSO}",
+    "LARAVEL_API_URL": f"http://127.0.0.1:{PUERTO_FALSO}/api",
+    "RAG_URL": f"http://127.0.0.1:{PUERTO_FALSO}",
+    "BOT_HTTP_HOST": "127.0.0.1",
+    "BOT_HTTP_PORT": str(PUERTO_BOT),
+    "WEBHOOK_SECRET": SECRETO,
+})
+import main  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import TypeHandler  # noqa: E402
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+class ServiciosFalsos:
+    """Bot API de Telegram, Laravel y RAG simulados en una sola app ASGI"""
+
+    def __init__(self, api_ms: float, rag_ms: float):
+        self.api_delay = api_ms / 1000
+        self.rag_delay = rag_ms / 1000
+        self.mensajes = 0
+        self.respuestas = {}  # chat_id -> instantes de las respuestas finales de /consulta
+        self.app = Starlette(routes=[
+            Route("/bot{token}/{metodo}", self.telegram, methods=["POST"]),
+            Route("/api/bot/check-client/{telegram_id:int}", self.check_client, methods=["GET"]),
+            Route("/api/bot/memberships", self.memberships, methods=["GET"]),
+            Route("/query/stream", self.query_stream, methods=["POST"]),
+        ])
+
+    async def telegram(self, request: Request):
+        metodo = request.path_params["metodo"]
+        if metodo == "getMe":
+            return JSONResponse({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Bench",
+                                                        "username": "bench_bot"}})
+        if not metodo.startswith(("send", "edit")):
+            return JSONResponse({"ok": True, "result": True})
+
+        datos = {}
+        if request.headers.get("content-type", "").startswith("application/x-www-form-urlencoded"):
+            datos = {k: v[0] for k, v in parse_qs((await request.body()).decode()).items()}
+        else:
+            await request.body()
+        chat_id = int(datos.get("chat_id", 0))
+        texto = datos.get("text", "")
+        if metodo == "editMessageText" and "Asesoría Legal AI" in texto and "✍️" not in texto:
+            self.respuestas.setdefault(chat_id, []).append(time.perf_counter())
+        self.mensajes += 1
+        return JSONResponse({"ok": True, "result": {
+            "message_id": self.mensajes, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "text": texto,
+        }})
+
+    async def check_client(self, request: Request):
+        await asyncio.sleep(self.api_delay)
+        return JSONResponse({"exists": True, "client": {"name": "Cliente"}, "current_subscription": {
+            "id": 1, "status": "active", "categories": [{"id": 1}],
+            "membership": {"name": "Profesional", "price": 100, "daily_limit": 50, "max_specialists": 2},
+        }})
+
+    async def memberships(self, request: Request):
+        await asyncio.sleep(self.api_delay)
+        return JSONResponse({"memberships": [{"id": 1, "name": "Profesional", "price": 100, "daily_limit": 50}]})
+
+    async def query_stream(self, request: Request):
+        await request.body()
+
+        async def eventos():
+            yield f"event: sources\ndata: {json.dumps({'sources': [], 'num_contexts': 3})}\n\n"
+            for i in range(10):
+                await asyncio.sleep(self.rag_delay / 10)
+                yield f"event: token\ndata: {json.dumps({'text': f'palabra{i} '})}\n\n"
+            yield f"event: done\ndata: {json.dumps({'total_ms': self.rag_delay * 1000})}\n\n"
+
+        return StreamingResponse(eventos(), media_type="text/event-stream")
+
+
+def actualizaciones_sinteticas(usuarios: int) -> list[dict]:
+    """Cada usuario: /start, /consulta, /planes y una respuesta dentro de la conversación"""
+    textos = ["/start", "/consulta ¿Qué dice el artículo {n} del código civil?", "/planes", "📊 Ver Detalles"]
+    updates, update_id = [], 1
+    for paso, texto in enumerate(textos):
+        for u in range(usuarios):
+            chat_id = 10_000 + u
+            mensaje = {
+                "message_id": paso + 1, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": f"Usuario{u}"},
+                "text": texto.format(n=u % 20 + 1),
+            }
+            if texto.startswith("/"):
+                comando = texto.split()[0]
+                mensaje["entities"] = [{"type": "bot_command", "offset": 0, "length": len(comando)}]
+            updates.append({"update_id": update_id, "message": mensaje})
+            update_id += 1
+    return updates
+
+
+def cargar_actualizaciones(ruta: str) -> list[dict]:
+    with open(ruta, encoding="utf-8") as f:
+        return [json.loads(linea) for linea in f if linea.strip()]
+
+
+def chat_de(update: dict) -> int:
+    for clave in ("message", "edited_message", "callback_query"):
+        if clave in update:
+            objeto = update[clave]
+            return (objeto.get("chat") or objeto.get("message", {}).get("chat") or objeto["from"])["id"]
+    return 0
+
+
+async def correr(concurrentes: int, updates: list[dict], falsos: ServiciosFalsos) -> dict:
+    falsos.respuestas.clear()
+    main.cache_suscripciones.invalidar()
+    main.cache_catalogo.invalidar()
+
+    app = main.crear_aplicacion(TOKEN, concurrentes)
+    enviados, procesados, orden = {}, {}, {}
+
+    async def registrar(update: Update, context):
+        procesados[update.update_id] = time.perf_counter()
+        orden.setdefault(update.effective_chat.id, []).append(update.update_id)
+
+    # Grupo posterior a los manejadores del bot: corre cuando ya terminaron
+    app.add_handler(TypeHandler(Update, registrar), group=1)
+
+    main.servidor_app.state.telegram = app
+    async with app:
+        await main.iniciar_clientes_http(app)
+        await main.iniciar_servidor_interno(app)
+        await app.start()
+        await asyncio.sleep(0.2)
+
+        inicio = time.perf_counter()
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PUERTO_BOT}",
+                                     headers={"X-Telegram-Bot-Api-Secret-Token": SECRETO},
+                                     limits=httpx.Limits(max_connections=50)) as webhook:
+            async def enviar(update):
+                enviados[update["update_id"]] = time.perf_counter()
+                resp = await webhook.post(main.WEBHOOK_PATH, json=update)
+                resp.raise_for_status()
+
+            # Se respeta el orden de llegada por chat, como lo entrega Telegram
+            for update in updates:
+                await enviar(update)
+            await app.update_queue.join()
+
+            consultas = sum(1 for u in updates if u.get("message", {}).get("text", "").startswith("/consulta"))
+            while sum(len(v) for v in falsos.respuestas.values()) < consultas and time.perf_counter() - inicio < 300:
+                await asyncio.sleep(0.05)
+        total = time.perf_counter() - inicio
+
+        await app.stop()
+        await main.cerrar_servidor_interno(app)
+        await main.cerrar_clientes_http(app)
+
+    latencias = [(procesados[i] - enviados[i]) * 1000 for i in procesados if i in enviados]
+    envio_consultas = {}
+    for u in updates:
+        if u.get("message", {}).get("text", "").startswith("/consulta"):
+            envio_consultas.setdefault(chat_de(u), []).append(enviados[u["update_id"]])
+    latencias_consulta = [(fin - envio) * 1000 for chat, fines in falsos.respuestas.items()
+                          for envio, fin in zip(envio_consultas.get(chat, []), fines)]
+    en_orden = all(ids == sorted(ids) for ids in orden.values())
+    return {
+        "updates": len(updates),
+        "p50_ms": statistics.median(latencias) if latencias else 0.0,
+        "p95_ms": percentile(latencias, 0.95),
+        "consulta_p50_ms": statistics.median(latencias_consulta) if latencias_consulta else 0.0,
+        "consulta_p95_ms": percentile(latencias_consulta, 0.95),
+        "updates_s": len(updates) / total,
+        "total_s": total,
+        "en_orden": en_orden,
+    }
+
+
+async def principal(args):
+    falsos = ServiciosFalsos(args.api_ms, args.rag_ms)
+    servidor = uvicorn.Server(uvicorn.Config(falsos.app, host="127.0.0.1", port=PUERTO_FALSO,
+                                             lifespan="off", log_level="warning"))
+    tarea = asyncio.create_task(servidor.serve())
+    await asyncio.sleep(0.3)
+
+    updates = cargar_actualizaciones(args.updates) if args.updates else actualizaciones_sinteticas(args.users)
+    print(f"{len(updates)} actualizaciones, API {args.api_ms} ms, RAG {args.rag_ms} ms")
+    print(f"\n{'modo':26s} {'p50 ms':>8s} {'p95 ms':>8s} {'cons p50':>9s} {'cons p95':>9s} {'upd/s':>7s} {'total s':>8s} orden")
+    for nombre, concurrentes in (("secuencial", 1), (f"por usuario ({args.concurrent})", args.concurrent)):
+        r = await correr(concurrentes, updates, falsos)
+        print(f"{nombre:26s} {r['p50_ms']:8.1f} {r['p95_ms']:8.1f} {r['consulta_p50_ms']:9.1f} "
+              f"{r['consulta_p95_ms']:9.1f} {r['updates_s']:7.1f} {r['total_s']:8.2f} {'ok' if r['en_orden'] else 'ERROR'}")
+
+    servidor.should_exit = True
+    await tarea
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100, help="Usuarios de las actualizaciones sintéticas")
+    parser.add_argument("--updates", default=None, help="JSONL con actualizaciones grabadas")
+    parser.add_argument("--concurrent", type=int, default=64, help="ACTUALIZACIONES_CONCURRENTES a probar")
+    parser.add_argument("--api-ms", type=float, default=40.0, help="Latencia de cada llamada a Laravel")
+    parser.add_argument("--rag-ms", type=float, default=800.0, help="Duración de cada respuesta del RAG")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    asyncio.run(principal(args))
@@ -0,0 +1,173 @@
+# ==============================================================================
+# CACHÉS EN MEMORIA DEL BOT
+# ==============================================================================
+# Datos de Laravel que el bot consulta muy seguido y que cambian poco. Viven en el
+# proceso del bot (se pierden al reiniciar) y se invalidan explícitamente cuando el
+# propio bot o Laravel cambian el dato.
+# ==============================================================================
+
+import os
+import time
+import asyncio
+import logging
+
+
+class CacheSuscripciones:
+    """
+    Respuesta de /bot/check-client (cliente, suscripción y categorías) por telegram_id.
+
+    /consulta la usa para no ir a Laravel antes de cada pregunta. Cada entrada vive
+    SUSCRIPCION_CACHE_TTL segundos; el bot la borra después de registrar, suscribir,
+    guardar categorías o subir el voucher, y Laravel puede borrarla al aprobar o cancelar
+    (DELETE /admin/cache/entitlements/{telegram_id} del servidor interno).
+
+    Cada invalidación sube la generación del usuario. Quien va a Laravel lee generacion()
+    antes de la petición y la pasa a guardar(): si mientras tanto se invalidó, la respuesta
+    (quizás anterior al cambio) no se guarda, así una cancelación no vuelve a quedar en caché
+    como suscripción activa.
+    """
+
+    def __init__(self, ttl: float = None, max_entradas: int = None):
+        self.ttl = ttl if ttl is not None else float(os.getenv("SUSCRIPCION_CACHE_TTL", "300"))
+        self.max_entradas = max_entradas or int(os.getenv("SUSCRIPCION_CACHE_MAX_ENTRADAS", "10000"))
+        self.entradas = {}  # telegram_id -> (expira, datos)
+        self.secuencia = 0  # crece en cada invalidación
+        self.generaciones = {}  # telegram_id -> secuencia de su última invalidación
+        self.piso = 0  # generación de los usuarios que no están en generaciones
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0, "stale_skipped": 0}
+
+    def obtener(self, telegram_id: int):
+        """Datos vigentes del usuario o None si no están (o vencieron)."""
+        entrada = self.entradas.get(telegram_id)
+        if entrada is None or entrada[0] < time.monotonic():
+            self.entradas.pop(telegram_id, None)
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return entrada[1]
+
+    def generacion(self, telegram_id: int) -> int:
+        return self.generaciones.get(telegram_id, self.piso)
+
+    def guardar(self, telegram_id: int, datos: dict, generacion: int = None):
+        """generacion: la de antes de pedir los datos; si cambió, se descartan."""
+        if self.ttl <= 0:
+            return
+        if generacion is not None and generacion != self.generacion(telegram_id):
+            self.stats["stale_skipped"] += 1
+            return
+        if len(self.entradas) >= self.max_entradas:
+            self.purgar_vencidas()
+            if len(self.entradas) >= self.max_entradas:
+                # Se descarta la más antigua (los dict conservan el orden de inserción)
+                self.entradas.pop(next(iter(self.entradas)))
+        self.entradas.pop(telegram_id, None)
+        self.entradas[telegram_id] = (time.monotonic() + self.ttl, datos)
+
+    def invalidar(self, telegram_id: int = None) -> int:
+        """Borra la entrada de un usuario (o todas si no se indica) y devuelve cuántas se borraron."""
+        self.secuencia += 1
+        if telegram_id is None:
+            borradas = len(self.entradas)
+            self.entradas.clear()
+            self.generaciones.clear()
+            self.piso = self.secuencia
+        else:
+            borradas = 1 if self.entradas.pop(telegram_id, None) is not None else 0
+            self.generaciones.pop(telegram_id, None)
+            self.generaciones[telegram_id] = self.secuencia
+            if len(self.generaciones) > self.max_entradas:
+                # Se olvida la más antigua subiendo el piso: los que leyeron antes no guardan
+                mas_antigua = next(iter(self.generaciones))
+                self.piso = max(self.piso, self.generaciones.pop(mas_antigua))
+        self.stats["invalidations"] += borradas
+        if borradas:
+            logging.info(f"Caché de suscripciones: {borradas} entrada(s) invalidada(s) ({telegram_id or 'todas'})")
+        return borradas
+
+    def purgar_vencidas(self):
+        ahora = time.monotonic()
+        for telegram_id in [t for t, (expira, _) in self.entradas.items() if expira < ahora]:
+            del self.entradas[telegram_id]
+
+    def get_stats(self) -> dict:
+        consultas = self.stats["hits"] + self.stats["misses"]
+        return {
+            "ttl_seconds": self.ttl,
+            "entries": len(self.entradas),
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / consultas, 3) if consultas else None,
+        }
+
+
+class CacheCatalogo:
+    """
+    Datos de catálogo de la API (membresías, categorías, configuración de pago) con
+    stale-while-revalidate: durante CATALOGO_CACHE_TTL segundos se responde desde la caché;
+    después se sigue respondiendo con la copia vieja (hasta CATALOGO_CACHE_MAX_STALE) mientras
+    se refresca en segundo plano, así ningún usuario espera a Laravel por datos que casi no
+    cambian. Si el refresco falla se conserva la copia anterior.
+    """
+
+    def __init__(self, ttl: float = None, max_stale: float = None):
+        self.ttl = ttl if ttl is not None else float(os.getenv("CATALOGO_CACHE_TTL", "60"))
+        self.max_stale = max_stale if max_stale is not None else float(os.getenv("CATALOGO_CACHE_MAX_STALE", "86400"))
+        self.entradas = {}  # clave -> (obtenido, datos)
+        self.cargas = {}  # clave -> asyncio.Task en curso (una sola carga por clave)
+        self.stats = {"hits": 0, "stale": 0, "misses": 0, "refreshes": 0, "errors": 0}
+
+    async def obtener(self, clave: str, cargar):
+        """Devuelve los datos de la clave; cargar() es la corrutina que los trae de la API."""
+        entrada = self.entradas.get(clave)
+        if entrada is not None:
+            edad = time.monotonic() - entrada[0]
+            if edad < self.ttl:
+                self.stats["hits"] += 1
+                return entrada[1]
+            if edad < self.max_stale:
+                self.stats["stale"] += 1
+                self._cargar(clave, cargar)
+                return entrada[1]
+        self.stats["misses"] += 1
+        return await asyncio.shield(self._cargar(clave, cargar))
+
+    def _cargar(self, clave: str, cargar) -> asyncio.Task:
+        tarea = self.cargas.get(clave)
+        if tarea is None:
+            tarea = asyncio.create_task(self._refrescar(clave, cargar))
+            self.cargas[clave] = tarea
+        return tarea
+
+    async def _refrescar(self, clave: str, cargar):
+        try:
+            datos = await cargar()
+            self.entradas[clave] = (time.monotonic(), datos)
+            self.stats["refreshes"] += 1
+            return datos
+        except Exception as e:
+            self.stats["errors"] += 1
+            logging.warning(f"No se pudo refrescar {clave}: {e}")
+            if clave in self.entradas:
+                # Se sigue sirviendo la copia anterior
+                return self.entradas[clave][1]
+            raise
+        finally:
+            del self.cargas[clave]
+
+    def invalidar(self, clave: str = None) -> int:
+        """Borra una clave (o todas) para que la próxima lectura vaya a la API."""
+        if clave is None:
+            borradas = len(self.entradas)
+            self.entradas.clear()
+        else:
+            borradas = 1 if self.entradas.pop(clave, None) is not None else 0
+        return borradas
+
+    def get_stats(self) -> dict:
+        ahora = time.monotonic()
+        return {
+            "ttl_seconds": self.ttl,
+            "max_stale_seconds": self.max_stale,
+            "entries": {clave: round(ahora - obtenido, 1) for clave, (obtenido, _) in self.entradas.items()},
+            **self.stats,
+        }
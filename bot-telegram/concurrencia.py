@@ -0,0 +1,201 @@
+# ==============================================================================
+# CONCURRENCIA DEL BOT
+# ==============================================================================
+# - ProcesadorPorUsuario: procesa en paralelo las actualizaciones de distintos
+#   usuarios, pero las de un mismo chat de a una y en orden de llegada.
+# - ControlConsultas: cada /consulta ocupa al RAG varios segundos; limita cuántas
+#   corren a la vez (por usuario y en total, según la capacidad de rag-core) y hace
+#   que las preguntas idénticas en curso compartan una sola llamada al RAG.
+# ==============================================================================
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class ColaLlena(Exception):
+    """El usuario ya tiene el máximo de consultas en curso y en espera."""
+
+
+class ProcesadorPorUsuario(BaseUpdateProcessor):
+    """
+    Update processor de PTB (ApplicationBuilder.concurrent_updates) que atiende hasta
+    max_concurrent_updates actualizaciones a la vez, con un candado por chat: los mensajes
+    de un mismo usuario se procesan en orden, como espera ConversationHandler para pasar
+    de un estado al siguiente, y un usuario lento no frena a los demás.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self.candados = {}  # chat_id -> [asyncio.Lock, actualizaciones pendientes]
+
+    @staticmethod
+    def clave(update) -> int:
+        if isinstance(update, Update):
+            if update.effective_chat is not None:
+                return update.effective_chat.id
+            if update.effective_user is not None:
+                return update.effective_user.id
+        return None
+
+    async def process_update(self, update, coroutine):
+        clave = self.clave(update)
+        if clave is None:
+            return await super().process_update(update, coroutine)
+
+        # El candado se toma antes que el semáforo global: las actualizaciones que esperan
+        # el turno de su chat no ocupan lugares de los demás usuarios
+        entrada = self.candados.setdefault(clave, [asyncio.Lock(), 0])
+        entrada[1] += 1
+        try:
+            async with entrada[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entrada[1] -= 1
+            if entrada[1] == 0:
+                del self.candados[clave]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return round(valores[min(len(valores) - 1, int(len(valores) * p))], 1) if valores else None
+
+
+class ControlConsultas:
+    """
+    - Por usuario: CONSULTAS_POR_USUARIO consultas en curso; las siguientes esperan su turno
+      en orden, hasta CONSULTAS_EN_COLA_POR_USUARIO (más allá se rechazan con ColaLlena).
+    - Singleflight: si ya hay una consulta en curso con la misma pregunta y las mismas
+      categorías, la nueva espera ese resultado en lugar de llamar de nuevo al RAG.
+    - Global: como máximo RAG_MAX_CONCURRENCIA llamadas al RAG a la vez (workers de rag-core).
+
+    Registra la profundidad de las colas y los tiempos de espera (get_stats).
+    """
+
+    def __init__(self, por_usuario: int = None, en_cola_por_usuario: int = None, max_rag: int = None):
+        self.por_usuario = por_usuario or int(os.getenv("CONSULTAS_POR_USUARIO", "1"))
+        self.en_cola_por_usuario = en_cola_por_usuario if en_cola_por_usuario is not None else int(
+            os.getenv("CONSULTAS_EN_COLA_POR_USUARIO", "3"))
+        self.max_rag = max_rag or int(os.getenv("RAG_MAX_CONCURRENCIA", "8"))
+        self.usuarios = {}  # telegram_id -> {"semaforo", "esperando", "activas"}
+        self.semaforo_rag = asyncio.Semaphore(self.max_rag)
+        self.esperando_rag = 0
+        self.en_curso = {}  # clave -> {"tarea", "oyentes"}
+        self.esperas_usuario = deque(maxlen=1000)  # ms esperando turno (últimas consultas)
+        self.esperas_rag = deque(maxlen=1000)  # ms esperando lugar en el RAG
+        self.stats = {"queries": 0, "rejected": 0, "coalesced": 0, "rag_calls": 0,
+                      "max_user_queue": 0, "max_rag_queue": 0}
+
+    @asynccontextmanager
+    async def turno(self, telegram_id: int):
+        """Espera el turno del usuario; lanza ColaLlena si ya tiene demasiadas consultas pendientes."""
+        usuario = self.usuarios.get(telegram_id)
+        if usuario is None:
+            usuario = {"semaforo": asyncio.Semaphore(self.por_usuario), "esperando": 0, "activas": 0}
+            self.usuarios[telegram_id] = usuario
+        if usuario["semaforo"].locked() and usuario["esperando"] >= self.en_cola_por_usuario:
+            self.stats["rejected"] += 1
+            raise ColaLlena()
+
+        self.stats["queries"] += 1
+        usuario["activas"] += 1
+        usuario["esperando"] += 1
+        if usuario["semaforo"].locked():
+            self.stats["max_user_queue"] = max(self.stats["max_user_queue"], usuario["esperando"])
+        inicio = time.perf_counter()
+        try:
+            # si se cancela mientras espera, "esperando" también tiene que bajar
+            try:
+                await usuario["semaforo"].acquire()
+            finally:
+                usuario["esperando"] -= 1
+            try:
+                self.esperas_usuario.append((time.perf_counter() - inicio) * 1000)
+                yield
+            finally:
+                usuario["semaforo"].release()
+        finally:
+            usuario["activas"] -= 1
+            if usuario["activas"] == 0:
+                del self.usuarios[telegram_id]
+
+    def esperando_turno(self, telegram_id: int) -> bool:
+        """True si la próxima consulta del usuario tendría que esperar."""
+        usuario = self.usuarios.get(telegram_id)
+        return usuario is not None and usuario["semaforo"].locked()
+
+    async def ejecutar(self, pregunta: str, category_ids, consultar, on_progress=None):
+        """
+        Devuelve el resultado de consultar(on_progress) compartiéndolo con las consultas
+        idénticas en curso. on_progress recibe el texto parcial de la llamada compartida.
+        """
+        clave = (" ".join(pregunta.lower().split()), tuple(sorted(category_ids)))
+        vuelo = self.en_curso.get(clave)
+        if vuelo is not None:
+            self.stats["coalesced"] += 1
+        else:
+            vuelo = {"oyentes": []}
+            vuelo["tarea"] = asyncio.create_task(self._llamar_rag(clave, vuelo, consultar))
+            self.en_curso[clave] = vuelo
+        if on_progress is not None:
+            vuelo["oyentes"].append(on_progress)
+        try:
+            # shield: si se cancela una de las consultas, la llamada sigue para las demás
+            return await asyncio.shield(vuelo["tarea"])
+        finally:
+            if on_progress in vuelo["oyentes"]:
+                vuelo["oyentes"].remove(on_progress)
+
+    async def _llamar_rag(self, clave, vuelo, consultar):
+        async def avisar(texto_parcial):
+            for oyente in list(vuelo["oyentes"]):
+                await oyente(texto_parcial)
+
+        try:
+            self.esperando_rag += 1
+            self.stats["max_rag_queue"] = max(self.stats["max_rag_queue"], self.esperando_rag)
+            inicio = time.perf_counter()
+            try:
+                await self.semaforo_rag.acquire()
+            finally:
+                self.esperando_rag -= 1
+            espera = (time.perf_counter() - inicio) * 1000
+            self.esperas_rag.append(espera)
+            if espera > 1000:
+                logging.info(f"Consulta esperó {espera:.0f} ms por un lugar en el RAG")
+            try:
+                self.stats["rag_calls"] += 1
+                return await consultar(avisar)
+            finally:
+                self.semaforo_rag.release()
+        finally:
+            del self.en_curso[clave]
+
+    def get_stats(self) -> dict:
+        return {
+            "per_user_limit": self.por_usuario,
+            "per_user_queue_limit": self.en_cola_por_usuario,
+            "rag_concurrency": self.max_rag,
+            "users_active": len(self.usuarios),
+            "user_queue_depth": sum(u["esperando"] for u in self.usuarios.values()),
+            "distinct_in_flight": len(self.en_curso),
+            "rag_queue_depth": self.esperando_rag,
+            **self.stats,
+            "user_wait_ms": {"p50": percentil(self.esperas_usuario, 0.5), "p95": percentil(self.esperas_usuario, 0.95)},
+            "rag_wait_ms": {"p50": percentil(self.esperas_rag, 0.5), "p95": percentil(self.esperas_rag, 0.95)},
+        }
@@ -8,10 +8,19 @@
 # ==============================================================================
 
 import os
+import hmac
+import json
 import logging
+import functools
 import httpx
 import asyncio
+import contextlib
+import uvicorn
 from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import (
     ApplicationBuilder,
@@ -21,6 +30,9 @@ from telegram.ext import (
     ContextTypes,
     ConversationHandler
 )
+from telegram.error import TelegramError
+from caches import CacheCatalogo, CacheSuscripciones
+from concurrencia import ColaLlena, ControlConsultas, ProcesadorPorUsuario
 
 # ------------------------------------------------------------------------------
 # 1. CONFIGURACIÓN Y VARIABLES DE ENTORNO
@@ -40,6 +52,45 @@ RAG_URL = os.getenv("RAG_URL", "http://rag-core:8000")
 # Sticker enviado al iniciar el bot para una experiencia más visual
 STICKER_BIENVENIDA = "assets/img/sticker_animado_final.webm"
 
+# Clientes HTTP: conexiones por servicio, conexiones keep-alive y tiempo que se conservan abiertas
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+
+# Timeouts por tipo de ruta
+TIMEOUT_API = httpx.Timeout(10.0, connect=5.0)       # consultas y registros en Laravel
+TIMEOUT_ARCHIVOS = httpx.Timeout(60.0, connect=5.0)  # subida del voucher y descarga del QR
+TIMEOUT_RAG = httpx.Timeout(30.0, connect=10.0)      # /query/stream: la lectura aplica entre fragmentos
+
+# HTTP/2 (varias peticiones sobre una misma conexión) si está instalado httpx[http2];
+# se negocia por TLS, así que con URLs http:// se sigue usando HTTP/1.1 con keep-alive
+try:
+    import h2  # noqa: F401
+    HTTP2_DISPONIBLE = True
+except ImportError:
+    HTTP2_DISPONIBLE = False
+
+# Servidor HTTP interno (estadísticas e invalidación de cachés desde Laravel); puerto 0 = desactivado
+BOT_HTTP_HOST = os.getenv("BOT_HTTP_HOST", "0.0.0.0")
+BOT_HTTP_PORT = int(os.getenv("BOT_HTTP_PORT", "8090"))
+# Token compartido con Laravel: las rutas /admin exigen la cabecera X-Bot-Admin-Token
+# (vacío = las rutas /admin responden 401 siempre)
+BOT_ADMIN_TOKEN = os.getenv("BOT_ADMIN_TOKEN", "")
+
+# Modo de recepción: "polling" (desarrollo) o "webhook" (producción, Telegram envía las
+# actualizaciones al servidor HTTP en WEBHOOK_PATH; WEBHOOK_URL es la URL pública con TLS y
+# WEBHOOK_SECRET, obligatorio en ese modo, se verifica en cada actualización)
+BOT_MODO = os.getenv("BOT_MODO", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Actualizaciones procesadas a la vez (las de un mismo chat siempre en orden); 1 = de a una
+ACTUALIZACIONES_CONCURRENTES = int(os.getenv("ACTUALIZACIONES_CONCURRENTES", "64"))
+
+# Servidor de la Bot API alternativo (local o de pruebas); vacío = api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
 # Definición de Estados para la Máquina de Estados (ConversationHandler)
 (
     BOTONES_INICIO, 
@@ -54,6 +105,109 @@ STICKER_BIENVENIDA = "assets/img/sticker_animado_final.webm"
     ESPERANDO_VOUCHER 
 ) = range(10)
 
+# ------------------------------------------------------------------------------
+# CLIENTES HTTP COMPARTIDOS
+# ------------------------------------------------------------------------------
+# Un cliente por servicio (API de Laravel y RAG) para toda la aplicación: las conexiones
+# quedan abiertas y se reutilizan entre mensajes y usuarios en lugar de abrir una nueva
+# (handshake TCP/TLS) en cada handler. Se crean en post_init y se cierran al apagar el bot.
+
+clientes_http = {}
+
+def crear_cliente_http(timeout: httpx.Timeout) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        http2=HTTP2_DISPONIBLE,
+    )
+
+async def iniciar_clientes_http(application):
+    """post_init: abre los clientes de la API de Laravel y del RAG."""
+    clientes_http["api"] = crear_cliente_http(TIMEOUT_API)
+    clientes_http["rag"] = crear_cliente_http(TIMEOUT_RAG)
+    logging.info(f"Clientes HTTP listos (HTTP/2: {'sí' if HTTP2_DISPONIBLE else 'no'})")
+
+async def cerrar_clientes_http(application):
+    """post_shutdown: cierra las conexiones abiertas."""
+    for cliente in clientes_http.values():
+        await cliente.aclose()
+    clientes_http.clear()
+
+# ------------------------------------------------------------------------------
+# CACHÉ DE SUSCRIPCIONES
+# ------------------------------------------------------------------------------
+# /consulta necesita la suscripción y las categorías del usuario en cada pregunta; se
+# guardan por telegram_id para no ir a Laravel cada vez (ver caches.CacheSuscripciones).
+
+cache_suscripciones = CacheSuscripciones()
+
+async def consultar_cliente(telegram_id, usar_cache=False):
+    """
+    Devuelve la respuesta de /bot/check-client. Con usar_cache=True se usa la copia en
+    caché si está vigente; siempre que se va a Laravel la respuesta se guarda en la caché.
+    """
+    if usar_cache:
+        datos = cache_suscripciones.obtener(telegram_id)
+        if datos is not None:
+            return datos
+
+    # Si Laravel invalida al usuario mientras se espera la respuesta, esta no se guarda
+    generacion = cache_suscripciones.generacion(telegram_id)
+    response = await clientes_http["api"].get(f"{API_URL}/bot/check-client/{telegram_id}")
+    datos = response.json()
+    if response.status_code == 200:
+        cache_suscripciones.guardar(telegram_id, datos, generacion)
+    return datos
+
+# ------------------------------------------------------------------------------
+# CACHÉ DE CATÁLOGO (MEMBRESÍAS, CATEGORÍAS, CONFIGURACIÓN DE PAGO)
+# ------------------------------------------------------------------------------
+# Estos datos casi nunca cambian: se sirven desde memoria y se refrescan en segundo
+# plano (ver caches.CacheCatalogo). El QR de pago se sube a Telegram una sola vez y
+# después se reenvía por su file_id, sin volver a descargar ni enviar la imagen.
+
+cache_catalogo = CacheCatalogo()
+qr_file_ids = {}  # qr_url -> file_id de Telegram (un QR nuevo tiene otra URL)
+
+async def obtener_catalogo(ruta):
+    """GET {API_URL}{ruta} a través de la caché de catálogo."""
+    async def cargar():
+        response = await clientes_http["api"].get(f"{API_URL}{ruta}")
+        response.raise_for_status()
+        return response.json()
+    return await cache_catalogo.obtener(ruta, cargar)
+
+async def enviar_qr_pago(update: Update, qr_url, caption, reply_markup):
+    """Envía el QR de pago reutilizando su file_id; solo la primera vez se descarga y se sube."""
+    file_id = qr_file_ids.get(qr_url)
+    if file_id:
+        try:
+            await update.message.reply_photo(photo=file_id, caption=caption, parse_mode="HTML", reply_markup=reply_markup)
+            return True
+        except TelegramError as e:
+            logging.warning(f"file_id del QR no válido, se vuelve a subir: {e}")
+            qr_file_ids.pop(qr_url, None)
+
+    # Ajuste de URL para entornos Docker
+    url_descarga = qr_url
+    if "localhost" in url_descarga or "127.0.0.1" in url_descarga:
+        url_descarga = url_descarga.replace("localhost", "saas_legal_api").replace("127.0.0.1", "saas_legal_api")
+
+    qr_resp = await clientes_http["api"].get(url_descarga, timeout=TIMEOUT_ARCHIVOS)
+    if qr_resp.status_code != 200:
+        return False
+    from io import BytesIO
+    photo = BytesIO(qr_resp.content)
+    photo.name = "qr_pago.png"
+    mensaje = await update.message.reply_photo(photo=photo, caption=caption, parse_mode="HTML", reply_markup=reply_markup)
+    if mensaje.photo:
+        qr_file_ids[qr_url] = mensaje.photo[-1].file_id
+    return True
+
 # ------------------------------------------------------------------------------
 # 2. FUNCIONES DE REGISTRO (FLUJO INICIAL)
 # ------------------------------------------------------------------------------
@@ -91,40 +245,38 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Consulta a la API para verificar cliente
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{API_URL}/bot/check-client/{telegram_id}")
-            data = response.json()
-
-            if data.get('exists'):
-                client_data = data['client']
-                subscription = data.get('current_subscription')
-                
-                msg = (
-                    f"✅ <b>Acceso Concedido</b>\n\n"
-                    f"Bienvenido de nuevo, <b>{client_data['name']}</b>.\n"
-                )
-                if subscription:
-                    msg += f"📋 Membresía: <code>{subscription['membership']['name']}</code>\n"
-                    msg += f"📅 Estado: <b>{subscription['status']}</b>"
-                else:
-                    msg += "\n⚠️ No tienes una membresía activa.\nUsa /planes para ver las opciones disponibles."
-                
-                await update.message.reply_text(msg, parse_mode="HTML")
-                return ConversationHandler.END
+        data = await consultar_cliente(telegram_id)
+
+        if data.get('exists'):
+            client_data = data['client']
+            subscription = data.get('current_subscription')
+            
+            msg = (
+                f"✅ <b>Acceso Concedido</b>\n\n"
+                f"Bienvenido de nuevo, <b>{client_data['name']}</b>.\n"
+            )
+            if subscription:
+                msg += f"📋 Membresía: <code>{subscription['membership']['name']}</code>\n"
+                msg += f"📅 Estado: <b>{subscription['status']}</b>"
             else:
-                # Usuario no registrado
-                reply_keyboard = [['📝 Iniciar Registro', '❌ Cancelar']]
-                await update.message.reply_text(
-                    "👋 <b>¡Hola! Un gusto saludarte.</b>\n\n"
-                    "Parece que es tu primera vez por aquí. Para brindarte asesoría legal personalizada, necesitamos completar un registro rápido.\n\n"
-                    "¿Deseas registrarte ahora?",
-                    parse_mode="HTML",
-                    reply_markup=ReplyKeyboardMarkup(
-                        reply_keyboard, one_time_keyboard=True, resize_keyboard=True
-                    ),
-                )
-                return BOTONES_INICIO
-                
+                msg += "\n⚠️ No tienes una membresía activa.\nUsa /planes para ver las opciones disponibles."
+            
+            await update.message.reply_text(msg, parse_mode="HTML")
+            return ConversationHandler.END
+        else:
+            # Usuario no registrado
+            reply_keyboard = [['📝 Iniciar Registro', '❌ Cancelar']]
+            await update.message.reply_text(
+                "👋 <b>¡Hola! Un gusto saludarte.</b>\n\n"
+                "Parece que es tu primera vez por aquí. Para brindarte asesoría legal personalizada, necesitamos completar un registro rápido.\n\n"
+                "¿Deseas registrarte ahora?",
+                parse_mode="HTML",
+                reply_markup=ReplyKeyboardMarkup(
+                    reply_keyboard, one_time_keyboard=True, resize_keyboard=True
+                ),
+            )
+            return BOTONES_INICIO
+            
     except Exception as e:
         logging.error(f"Error en start: {e}")
         await update.message.reply_text("❌ Error al conectar con el servidor central.", parse_mode="HTML")
@@ -189,12 +341,13 @@ async def finalizar_registro(update: Update, context: ContextTypes.DEFAULT_TYPE)
             "client_type": context.user_data['client_type']
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{API_URL}/bot/register-client", json=datos_cliente)
-            if response.status_code == 200:
-                await update.message.reply_text("🎉 <b>¡Cuenta creada!</b>\n\nUsa /planes para elegir tu membresía.", parse_mode="HTML")
-            else:
-                await update.message.reply_text("❌ No pudimos guardar tus datos.", parse_mode="HTML")
+        client = clientes_http["api"]
+        response = await client.post(f"{API_URL}/bot/register-client", json=datos_cliente)
+        cache_suscripciones.invalidar(update.effective_user.id)
+        if response.status_code == 200:
+            await update.message.reply_text("🎉 <b>¡Cuenta creada!</b>\n\nUsa /planes para elegir tu membresía.", parse_mode="HTML")
+        else:
+            await update.message.reply_text("❌ No pudimos guardar tus datos.", parse_mode="HTML")
     except Exception as e:
         logging.error(f"Error en registro: {e}")
         await update.message.reply_text("❌ Error de comunicación.", parse_mode="HTML")
@@ -213,50 +366,47 @@ async def mostrar_planes(update: Update, context: ContextTypes.DEFAULT_TYPE):
     telegram_id = update.effective_user.id
     
     try:
-        async with httpx.AsyncClient() as client:
-            check_response = await client.get(f"{API_URL}/bot/check-client/{telegram_id}")
-            check_data = check_response.json()
-            
-            if not check_data.get('exists'):
-                await update.message.reply_text("⚠️ Primero debes registrarte (/start).", parse_mode="HTML")
-                return ConversationHandler.END
-            
-            current_sub = check_data.get('current_subscription')
+        check_data = await consultar_cliente(telegram_id)
+        
+        if not check_data.get('exists'):
+            await update.message.reply_text("⚠️ Primero debes registrarte (/start).", parse_mode="HTML")
+            return ConversationHandler.END
+        
+        current_sub = check_data.get('current_subscription')
+        
+        # Si tiene una suscripción pendiente o activa, mostramos gestión
+        if current_sub:
+            plan_name = current_sub['membership']['name']
+            plan_price = current_sub['membership']['price']
+            status = current_sub['status']
+            context.user_data['current_subscription'] = current_sub
             
-            # Si tiene una suscripción pendiente o activa, mostramos gestión
-            if current_sub:
-                plan_name = current_sub['membership']['name']
-                plan_price = current_sub['membership']['price']
-                status = current_sub['status']
-                context.user_data['current_subscription'] = current_sub
-                
-                if status == 'pending_payment':
-                    msg = (f"💳 <b>Suscripción Pendiente</b>\n\nPlan: <b>{plan_name}</b>\n"
-                           f"💰 Precio: <code>{plan_price} BOB</code>\n🔴 Estado: <b>Pendiente de Pago</b>\n\n"
-                           f"¿Qué deseas hacer?")
-                    keyboard = [['💳 Pagar Ahora'], ['🔄 Cambiar Plan'], ['❌ Cancelar Suscripción']]
-                elif status == 'active':
-                    msg = (f"✅ <b>Suscripción Activa</b>\n\nTu plan <b>{plan_name}</b> está activo.\n"
-                           f"💰 Precio: <code>{plan_price} BOB</code>\n\n¿Qué deseas hacer?")
-                    keyboard = [['📊 Ver Detalles'], ['❌ Cancelar Suscripción']]
-                else:
-                    return await mostrar_lista_planes(update, context, client)
-                
-                await update.message.reply_text(msg, parse_mode="HTML", 
-                    reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True))
-                return GESTION_SUSCRIPCION
+            if status == 'pending_payment':
+                msg = (f"💳 <b>Suscripción Pendiente</b>\n\nPlan: <b>{plan_name}</b>\n"
+                       f"💰 Precio: <code>{plan_price} BOB</code>\n🔴 Estado: <b>Pendiente de Pago</b>\n\n"
+                       f"¿Qué deseas hacer?")
+                keyboard = [['💳 Pagar Ahora'], ['🔄 Cambiar Plan'], ['❌ Cancelar Suscripción']]
+            elif status == 'active':
+                msg = (f"✅ <b>Suscripción Activa</b>\n\nTu plan <b>{plan_name}</b> está activo.\n"
+                       f"💰 Precio: <code>{plan_price} BOB</code>\n\n¿Qué deseas hacer?")
+                keyboard = [['📊 Ver Detalles'], ['❌ Cancelar Suscripción']]
             else:
-                # No tiene suscripción, mostrar lista de planes
-                return await mostrar_lista_planes(update, context, client)
+                return await mostrar_lista_planes(update, context)
+            
+            await update.message.reply_text(msg, parse_mode="HTML", 
+                reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True))
+            return GESTION_SUSCRIPCION
+        else:
+            # No tiene suscripción, mostrar lista de planes
+            return await mostrar_lista_planes(update, context)
     except Exception as e:
         logging.error(f"Error en mostrar_planes: {e}")
         await update.message.reply_text("❌ Error de servidor.", parse_mode="HTML")
         return ConversationHandler.END
 
-async def mostrar_lista_planes(update: Update, context: ContextTypes.DEFAULT_TYPE, client):
+async def mostrar_lista_planes(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Obtiene y despliega las membresías activas desde la API."""
-    response = await client.get(f"{API_URL}/bot/memberships")
-    data = response.json()
+    data = await obtener_catalogo("/bot/memberships")
     memberships = data.get('memberships', [])
     
     context.user_data['memberships'] = memberships
@@ -293,25 +443,23 @@ async def procesar_seleccion_plan(update: Update, context: ContextTypes.DEFAULT_
     context.user_data['selected_categories'] = []
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{API_URL}/bot/categories")
-            categories = response.json().get('categories', [])
-            context.user_data['available_categories'] = categories
-            
-            # --- Lógica Especial para Estudiantes ---
-            if "Estudiante" in plan['name']:
-                est_cat = next((c for c in categories if "Estudiante" in c['name']), None)
-                if est_cat:
-                    context.user_data['selected_categories'] = [est_cat['id']]
-                    await update.message.reply_text("📚 <b>Plan Estudiante:</b> Se ha asignado automáticamente la categoría Estudiante.", parse_mode="HTML")
-                    return await finalizar_suscripcion_con_categorias(update, context)
-                else:
-                    await update.message.reply_text("❌ Error: Categoría Estudiante no encontrada.")
-                    return ConversationHandler.END
-
-            # --- Flujo Secuencial para Profesionales/Particulares ---
-            context.user_data['selection_step'] = 1
-            return await pedir_siguiente_categoria(update, context)
+        categories = (await obtener_catalogo("/bot/categories")).get('categories', [])
+        context.user_data['available_categories'] = categories
+        
+        # --- Lógica Especial para Estudiantes ---
+        if "Estudiante" in plan['name']:
+            est_cat = next((c for c in categories if "Estudiante" in c['name']), None)
+            if est_cat:
+                context.user_data['selected_categories'] = [est_cat['id']]
+                await update.message.reply_text("📚 <b>Plan Estudiante:</b> Se ha asignado automáticamente la categoría Estudiante.", parse_mode="HTML")
+                return await finalizar_suscripcion_con_categorias(update, context)
+            else:
+                await update.message.reply_text("❌ Error: Categoría Estudiante no encontrada.")
+                return ConversationHandler.END
+
+        # --- Flujo Secuencial para Profesionales/Particulares ---
+        context.user_data['selection_step'] = 1
+        return await pedir_siguiente_categoria(update, context)
     except Exception as e:
         logging.error(f"Error: {e}")
         await update.message.reply_text("❌ Error de comunicación.")
@@ -367,23 +515,25 @@ async def finalizar_suscripcion_con_categorias(update: Update, context: ContextT
     await update.message.reply_text("⏳ <b>Procesando su suscripción...</b>", parse_mode="HTML", reply_markup=ReplyKeyboardRemove())
 
     try:
-        async with httpx.AsyncClient() as client:
-            # 1. Crear registro de suscripción
-            sub_resp = await client.post(f"{API_URL}/bot/subscribe", json={"telegram_id": telegram_id, "membership_id": plan['id']})
-            if sub_resp.status_code != 200:
-                return await update.message.reply_text("❌ Error al iniciar suscripción.")
-
-            subscription = sub_resp.json().get('subscription')
-            
-            # 2. Asociar categorías a la suscripción
-            cat_resp = await client.post(f"{API_URL}/bot/set-categories", 
-                json={"subscription_id": subscription['id'], "category_ids": categories})
-            
-            if cat_resp.status_code == 200:
-                await update.message.reply_text(f"🎉 <b>¡Registro Exitoso!</b>\n\nPlan: <b>{plan['name']}</b>.\n"
-                    "Estado: <b>Pendiente de Pago</b>.\n\nUsa /planes para ver opciones de pago.", parse_mode="HTML")
-            else:
-                await update.message.reply_text("❌ Error al guardar especialidades.")
+        client = clientes_http["api"]
+        # 1. Crear registro de suscripción
+        sub_resp = await client.post(f"{API_URL}/bot/subscribe", json={"telegram_id": telegram_id, "membership_id": plan['id']})
+        cache_suscripciones.invalidar(telegram_id)
+        if sub_resp.status_code != 200:
+            return await update.message.reply_text("❌ Error al iniciar suscripción.")
+
+        subscription = sub_resp.json().get('subscription')
+        
+        # 2. Asociar categorías a la suscripción
+        cat_resp = await client.post(f"{API_URL}/bot/set-categories", 
+            json={"subscription_id": subscription['id'], "category_ids": categories})
+        cache_suscripciones.invalidar(telegram_id)
+        
+        if cat_resp.status_code == 200:
+            await update.message.reply_text(f"🎉 <b>¡Registro Exitoso!</b>\n\nPlan: <b>{plan['name']}</b>.\n"
+                "Estado: <b>Pendiente de Pago</b>.\n\nUsa /planes para ver opciones de pago.", parse_mode="HTML")
+        else:
+            await update.message.reply_text("❌ Error al guardar especialidades.")
     except Exception as e:
         logging.error(f"Error crítico: {e}")
         await update.message.reply_text("❌ Error de comunicación central.")
@@ -403,37 +553,25 @@ async def manejar_gestion_suscripcion(update: Update, context: ContextTypes.DEFA
     if opcion == '💳 Pagar Ahora':
         # Muestra datos bancarios y el código QR de pago obtenido del administrador
         try:
-            async with httpx.AsyncClient() as client:
-                resp = await client.get(f"{API_URL}/bot/settings")
-                settings = resp.json()
-                
-                msg = (f"💳 <b>Datos de Pago</b>\n\n👤 <b>Contacto:</b> {settings['contact_name']}\n"
-                       f"🏦 <b>Datos Bancarios:</b>\n{settings['bank_details']}\n\n"
-                       f"📱 <b>Soporte:</b> {settings['telegram_user']}\n\n"
-                       "Escanea el siguiente QR para realizar el pago:")
-                
-                reply_markup = ReplyKeyboardMarkup([['✅ Pago Realizado'], ['❌ Volver']], one_time_keyboard=True, resize_keyboard=True)
-
-                qr_url = settings.get('qr_url')
-                if qr_url:
-                    # Ajuste de URL para entornos Docker
-                    if "localhost" in qr_url or "127.0.0.1" in qr_url:
-                        qr_url = qr_url.replace("localhost", "saas_legal_api").replace("127.0.0.1", "saas_legal_api")
-                    
-                    try:
-                        qr_resp = await client.get(qr_url)
-                        if qr_resp.status_code == 200:
-                            from io import BytesIO
-                            photo = BytesIO(qr_resp.content)
-                            photo.name = "qr_pago.png"
-                            await update.message.reply_photo(photo=photo, caption=msg, parse_mode="HTML", reply_markup=reply_markup)
-                        else:
-                            await update.message.reply_text(msg + "\n⚠️ QR no disponible.", parse_mode="HTML", reply_markup=reply_markup)
-                    except:
-                        await update.message.reply_text(msg + "\n⚠️ Error cargando QR.", parse_mode="HTML", reply_markup=reply_markup)
-                else:
-                    await update.message.reply_text(msg, parse_mode="HTML", reply_markup=reply_markup)
-                return GESTION_SUSCRIPCION
+            settings = await obtener_catalogo("/bot/settings")
+            
+            msg = (f"💳 <b>Datos de Pago</b>\n\n👤 <b>Contacto:</b> {settings['contact_name']}\n"
+                   f"🏦 <b>Datos Bancarios:</b>\n{settings['bank_details']}\n\n"
+                   f"📱 <b>Soporte:</b> {settings['telegram_user']}\n\n"
+                   "Escanea el siguiente QR para realizar el pago:")
+            
+            reply_markup = ReplyKeyboardMarkup([['✅ Pago Realizado'], ['❌ Volver']], one_time_keyboard=True, resize_keyboard=True)
+
+            qr_url = settings.get('qr_url')
+            if qr_url:
+                try:
+                    if not await enviar_qr_pago(update, qr_url, msg, reply_markup):
+                        await update.message.reply_text(msg + "\n⚠️ QR no disponible.", parse_mode="HTML", reply_markup=reply_markup)
+                except:
+                    await update.message.reply_text(msg + "\n⚠️ Error cargando QR.", parse_mode="HTML", reply_markup=reply_markup)
+            else:
+                await update.message.reply_text(msg, parse_mode="HTML", reply_markup=reply_markup)
+            return GESTION_SUSCRIPCION
         except:
             await update.message.reply_text("❌ Error al obtener datos de pago.")
             return ConversationHandler.END
@@ -475,30 +613,31 @@ async def manejar_envio_voucher(update: Update, context: ContextTypes.DEFAULT_TY
     await update.message.reply_text("⏳ <b>Subiendo comprobante...</b>", parse_mode="HTML")
 
     try:
-        async with httpx.AsyncClient() as client:
-            # Subida a Laravel
-            files = {'voucher': ('voucher.jpg', bytes(photo_bytes), 'image/jpeg')}
-            resp = await client.post(f"{API_URL}/bot/upload-voucher", data={'subscription_id': current_sub['id']}, files=files)
-            
-            if resp.status_code != 200:
-                return await update.message.reply_text("❌ Error al subir el voucher.")
-
-            # Notificación al Administrador
-            resp_settings = await client.get(f"{API_URL}/bot/settings")
-            settings = resp_settings.json()
-            admin_id = settings.get('admin_telegram_id')
-
-            if admin_id:
-                msg_admin = (f"🔔 <b>¡Nuevo Voucher!</b>\n\n👤 <b>Cliente:</b> {update.effective_user.first_name}\n"
-                             f"📦 <b>Plan:</b> {current_sub['membership']['name']}\n🆔 <b>ID:</b> <code>{telegram_id}</code>")
-                try:
-                    from io import BytesIO
-                    await context.bot.send_photo(chat_id=admin_id, photo=BytesIO(photo_bytes), caption=msg_admin, parse_mode="HTML")
-                except:
-                    logging.error("No se pudo notificar al admin.")
-
-            await update.message.reply_text("✅ <b>Comprobante Recibido.</b>\nVerificaremos tu pago a la brevedad.", parse_mode="HTML")
-            return ConversationHandler.END
+        client = clientes_http["api"]
+        # Subida a Laravel
+        files = {'voucher': ('voucher.jpg', bytes(photo_bytes), 'image/jpeg')}
+        resp = await client.post(f"{API_URL}/bot/upload-voucher", data={'subscription_id': current_sub['id']}, files=files,
+                                 timeout=TIMEOUT_ARCHIVOS)
+        cache_suscripciones.invalidar(telegram_id)
+        
+        if resp.status_code != 200:
+            return await update.message.reply_text("❌ Error al subir el voucher.")
+
+        # Notificación al Administrador
+        settings = await obtener_catalogo("/bot/settings")
+        admin_id = settings.get('admin_telegram_id')
+
+        if admin_id:
+            msg_admin = (f"🔔 <b>¡Nuevo Voucher!</b>\n\n👤 <b>Cliente:</b> {update.effective_user.first_name}\n"
+                         f"📦 <b>Plan:</b> {current_sub['membership']['name']}\n🆔 <b>ID:</b> <code>{telegram_id}</code>")
+            try:
+                from io import BytesIO
+                await context.bot.send_photo(chat_id=admin_id, photo=BytesIO(photo_bytes), caption=msg_admin, parse_mode="HTML")
+            except:
+                logging.error("No se pudo notificar al admin.")
+
+        await update.message.reply_text("✅ <b>Comprobante Recibido.</b>\nVerificaremos tu pago a la brevedad.", parse_mode="HTML")
+        return ConversationHandler.END
     except:
         await update.message.reply_text("❌ Error de comunicación.")
         return ESPERANDO_VOUCHER
@@ -508,6 +647,53 @@ async def cancelar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Acción cancelada. 👋", parse_mode="HTML", reply_markup=ReplyKeyboardRemove())
     return ConversationHandler.END
 
+# Intervalo mínimo entre ediciones del mensaje (Telegram limita la frecuencia de edición)
+INTERVALO_EDICION_STREAM = 1.5
+
+async def consultar_rag_stream(client, payload, on_progress):
+    """
+    Llama a /query/stream del RAG y procesa los Server-Sent Events.
+    Invoca on_progress(texto_parcial) como máximo cada INTERVALO_EDICION_STREAM segundos.
+    Devuelve un dict con answer, sources, num_contexts y metrics, o None si el RAG falló.
+    """
+    resultado = {"answer": "", "sources": [], "num_contexts": 0, "metrics": None}
+    ultima_edicion = asyncio.get_running_loop().time()
+    evento = None
+
+    async with client.stream("POST", f"{RAG_URL}/query/stream", json=payload) as resp:
+        if resp.status_code != 200:
+            await resp.aread()
+            logging.error(f"Error RAG: {resp.status_code} - {resp.text}")
+            return None
+
+        async for linea in resp.aiter_lines():
+            if linea.startswith("event:"):
+                evento = linea[len("event:"):].strip()
+                continue
+            if not linea.startswith("data:"):
+                continue
+            datos = json.loads(linea[len("data:"):])
+
+            if evento == "sources":
+                resultado["sources"] = datos.get("sources", [])
+                resultado["num_contexts"] = datos.get("num_contexts", 0)
+            elif evento == "token":
+                resultado["answer"] += datos.get("text", "")
+                ahora = asyncio.get_running_loop().time()
+                if ahora - ultima_edicion >= INTERVALO_EDICION_STREAM:
+                    ultima_edicion = ahora
+                    await on_progress(resultado["answer"])
+            elif evento == "done":
+                resultado["metrics"] = datos
+            elif evento == "error":
+                logging.error(f"Error RAG (stream): {datos.get('detail')}")
+                return None
+
+    resultado["answer"] = resultado["answer"].strip()
+    return resultado
+
+control_consultas = ControlConsultas()
+
 async def consultar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Comando /consulta <pregunta>.
@@ -520,46 +706,69 @@ async def consultar(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❓ <b>¿Qué deseas consultar?</b>\nUsa: <code>/consulta tu pregunta aquí</code>", parse_mode="HTML")
         return
 
-    await update.message.reply_text("🔍 <b>Consultando inteligencia legal...</b>", parse_mode="HTML")
+    # Si el usuario ya tiene una consulta en curso, esta espera su turno (ver concurrencia.py)
+    en_espera = control_consultas.esperando_turno(telegram_id)
+    texto_estado = "⏳ <b>Tu consulta anterior sigue en curso.</b> Esta se responderá a continuación." if en_espera \
+        else "🔍 <b>Consultando inteligencia legal...</b>"
+    mensaje_estado = await update.message.reply_text(texto_estado, parse_mode="HTML")
 
     try:
-        async with httpx.AsyncClient() as client:
-            # 1. Verificar suscripción y categorías permitidas
-            resp_client = await client.get(f"{API_URL}/bot/check-client/{telegram_id}")
-            data_client = resp_client.json()
-
-            if not data_client.get('exists') or not data_client.get('current_subscription'):
-                await update.message.reply_text("⚠️ Necesitas una suscripción activa para realizar consultas legal. Usa /planes.", parse_mode="HTML")
-                return
-
-            sub = data_client['current_subscription']
-            if sub['status'] != 'active':
-                await update.message.reply_text(f"⚠️ Tu suscripción está <b>{sub['status']}</b>. Debes estar activo para consultar.", parse_mode="HTML")
-                return
-
-            # Obtener IDs de categorías permitidas para este usuario (desde la tabla pivote de su suscripción)
-            category_ids = [c['id'] for c in sub.get('categories', [])]
-            logging.info(f"Consulta de {telegram_id} - Pregunta: '{pregunta}' - Categorías: {category_ids}")
-
-            # 2. Llamar al servicio RAG
-            payload = {
-                "question": pregunta,
-                "category_ids": category_ids,
-                "status": "active",
-                "top_k": 10
-            }
-
-            resp_rag = await client.post(f"{RAG_URL}/query", json=payload, timeout=30.0)
+        async with control_consultas.turno(telegram_id):
+            if en_espera:
+                await mensaje_estado.edit_text("🔍 <b>Consultando inteligencia legal...</b>", parse_mode="HTML")
+            await responder_consulta(update, telegram_id, pregunta, mensaje_estado)
+    except ColaLlena:
+        await mensaje_estado.edit_text("⚠️ Ya tienes varias consultas pendientes. Espera a que terminen para enviar otra.",
+                                       parse_mode="HTML")
+
+async def responder_consulta(update: Update, telegram_id, pregunta, mensaje_estado):
+    """Verifica la suscripción, consulta al RAG y edita mensaje_estado con la respuesta."""
+    try:
+        # 1. Verificar suscripción y categorías permitidas (en caché por SUSCRIPCION_CACHE_TTL segundos)
+        data_client = await consultar_cliente(telegram_id, usar_cache=True)
+
+        if not data_client.get('exists') or not data_client.get('current_subscription'):
+            await update.message.reply_text("⚠️ Necesitas una suscripción activa para realizar consultas legal. Usa /planes.", parse_mode="HTML")
+            return
+
+        sub = data_client['current_subscription']
+        if sub['status'] != 'active':
+            await update.message.reply_text(f"⚠️ Tu suscripción está <b>{sub['status']}</b>. Debes estar activo para consultar.", parse_mode="HTML")
+            return
+
+        # Obtener IDs de categorías permitidas para este usuario (desde la tabla pivote de su suscripción)
+        category_ids = [c['id'] for c in sub.get('categories', [])]
+        logging.info(f"Consulta de {telegram_id} - Pregunta: '{pregunta}' - Categorías: {category_ids}")
+
+        # 2. Llamar al servicio RAG
+        payload = {
+            "question": pregunta,
+            "category_ids": category_ids,
+            "status": "active",
+            "top_k": 10
+        }
+
+        # La respuesta llega por streaming (SSE): el mensaje "Consultando..." se va
+        # editando con el texto parcial en lugar de esperar la respuesta completa.
+        async def mostrar_parcial(texto_parcial):
+            try:
+                await mensaje_estado.edit_text(f"⚖️ <b>Asesoría Legal AI:</b>\n\n{texto_parcial} ✍️", parse_mode="HTML")
+            except Exception as e:
+                logging.warning(f"No se pudo actualizar el mensaje parcial: {e}")
+
+        async def llamar_rag(on_progress):
+            return await consultar_rag_stream(clientes_http["rag"], payload, on_progress)
+
+        # Una pregunta idéntica (mismas categorías) que ya está en curso comparte esa llamada
+        resultado = await control_consultas.ejecutar(pregunta, category_ids, llamar_rag, mostrar_parcial)
+
+        if resultado is not None:
+            logging.info(f"Respuesta RAG recibida. Contextos encontrados: {resultado.get('num_contexts')} - Métricas: {resultado.get('metrics')}")
+            answer = resultado.get('answer') or "No pude encontrar una respuesta clara."
             
-            if resp_rag.status_code == 200:
-                data_rag = resp_rag.json()
-                logging.info(f"Respuesta RAG recibida. Contextos encontrados: {data_rag.get('num_contexts')}")
-                answer = data_rag.get('answer', "No pude encontrar una respuesta clara.")
-                
-                await update.message.reply_text(f"⚖️ <b>Asesoría Legal AI:</b>\n\n{answer}", parse_mode="HTML")
-            else:
-                logging.error(f"Error RAG: {resp_rag.status_code} - {resp_rag.text}")
-                await update.message.reply_text("❌ El cerebro de la IA no respondió. Por favor, intenta más tarde.", parse_mode="HTML")
+            await mensaje_estado.edit_text(f"⚖️ <b>Asesoría Legal AI:</b>\n\n{answer}", parse_mode="HTML")
+        else:
+            await mensaje_estado.edit_text("❌ El cerebro de la IA no respondió. Por favor, intenta más tarde.", parse_mode="HTML")
 
     except Exception as e:
         logging.error(f"Error en consulta RAG: {e}")
@@ -569,13 +778,157 @@ async def consultar(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # 5. INICIALIZACIÓN DEL BOT
 # ------------------------------------------------------------------------------
 
-if __name__ == '__main__':
-    if not TOKEN:
-        logging.error("TELEGRAM_TOKEN no encontrado en .env")
-        exit(1)
+# ------------------------------------------------------------------------------
+# SERVIDOR HTTP INTERNO
+# ------------------------------------------------------------------------------
+# Pequeña app ASGI (Starlette + uvicorn) que corre en el mismo event loop que el bot.
+# Las rutas /admin solo deben ser accesibles desde la red interna de docker (Laravel la
+# llama al aprobar o cancelar una suscripción para que el cambio se vea en la siguiente
+# /consulta) y además exigen el token BOT_ADMIN_TOKEN en la cabecera X-Bot-Admin-Token.
+# En modo webhook también recibe las actualizaciones de Telegram: el proxy público solo
+# debe reenviar WEBHOOK_PATH.
+
+def requiere_token_admin(manejador):
+    """Rechaza (401) las peticiones sin la cabecera X-Bot-Admin-Token correcta."""
+    @functools.wraps(manejador)
+    async def verificar(request: Request):
+        token = request.headers.get("X-Bot-Admin-Token", "")
+        if not BOT_ADMIN_TOKEN or not hmac.compare_digest(token.encode(), BOT_ADMIN_TOKEN.encode()):
+            return JSONResponse({"detail": "No autorizado"}, status_code=401)
+        return await manejador(request)
+    return verificar
+
+async def recibir_webhook(request: Request):
+    """Encola la actualización y responde enseguida; la procesa el update processor."""
+    aplicacion = getattr(request.app.state, "telegram", None)
+    if aplicacion is None:
+        return JSONResponse({"detail": "El bot no está en modo webhook"}, status_code=404)
+    secreto = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not WEBHOOK_SECRET or not hmac.compare_digest(secreto.encode(), WEBHOOK_SECRET.encode()):
+        return JSONResponse({"detail": "Token secreto inválido"}, status_code=403)
+    try:
+        datos = await request.json()
+    except json.JSONDecodeError:
+        return JSONResponse({"detail": "Cuerpo JSON inválido"}, status_code=400)
+    if not isinstance(datos, dict):
+        return JSONResponse({"detail": "Se esperaba un objeto Update"}, status_code=400)
+    await aplicacion.update_queue.put(Update.de_json(datos, aplicacion.bot))
+    return JSONResponse({"ok": True})
+
+@requiere_token_admin
+async def estadisticas_cache(request: Request):
+    return JSONResponse({
+        "entitlements": cache_suscripciones.get_stats(),
+        "catalog": {**cache_catalogo.get_stats(), "qr_file_ids": len(qr_file_ids)},
+    })
+
+@requiere_token_admin
+async def invalidar_suscripcion(request: Request):
+    telegram_id = request.path_params.get("telegram_id")
+    borradas = cache_suscripciones.invalidar(telegram_id)
+    return JSONResponse({"invalidated": borradas})
+
+@requiere_token_admin
+async def estadisticas_consultas(request: Request):
+    return JSONResponse(control_consultas.get_stats())
+
+@requiere_token_admin
+async def invalidar_catalogo(request: Request):
+    # El file_id del QR se conserva: un QR nuevo llega con otra qr_url
+    borradas = cache_catalogo.invalidar()
+    return JSONResponse({"invalidated": borradas})
+
+servidor_app = Starlette(routes=[
+    Route("/admin/cache/stats", estadisticas_cache, methods=["GET"]),
+    Route("/admin/cache/entitlements", invalidar_suscripcion, methods=["DELETE"]),
+    Route("/admin/cache/entitlements/{telegram_id:int}", invalidar_suscripcion, methods=["DELETE"]),
+    Route("/admin/cache/catalog", invalidar_catalogo, methods=["DELETE"]),
+    Route("/admin/consultas/stats", estadisticas_consultas, methods=["GET"]),
+    Route(WEBHOOK_PATH, recibir_webhook, methods=["POST"]),
+])
+
+class ServidorInterno(uvicorn.Server):
+    def capture_signals(self):
+        # Las señales (Ctrl+C, SIGTERM) las maneja run_polling; uvicorn no debe reemplazarlas
+        return contextlib.nullcontext()
+
+servidor_interno = {}
+
+def config_servidor():
+    return uvicorn.Config(servidor_app, host=BOT_HTTP_HOST, port=BOT_HTTP_PORT, lifespan="off", log_level="warning")
+
+async def iniciar_servidor_interno(application):
+    # En modo webhook el mismo servidor lo levanta ejecutar_webhook, que además recibe las actualizaciones
+    if not BOT_HTTP_PORT or BOT_MODO == "webhook":
+        return
+    servidor = ServidorInterno(config_servidor())
+    servidor_interno["servidor"] = servidor
+    servidor_interno["tarea"] = asyncio.create_task(servidor.serve())
+    logging.info(f"Servidor interno escuchando en {BOT_HTTP_HOST}:{BOT_HTTP_PORT}")
+
+async def cerrar_servidor_interno(application):
+    if servidor_interno:
+        servidor_interno["servidor"].should_exit = True
+        await servidor_interno["tarea"]
+        servidor_interno.clear()
+
+async def al_iniciar(application):
+    """post_init: clientes HTTP y servidor interno."""
+    await iniciar_clientes_http(application)
+    if BOT_HTTP_PORT and not BOT_ADMIN_TOKEN:
+        logging.warning("BOT_ADMIN_TOKEN vacío: las rutas /admin del servidor interno rechazan todas las peticiones")
+    await iniciar_servidor_interno(application)
+
+async def al_apagar(application):
+    """post_shutdown: libera lo creado en al_iniciar."""
+    await cerrar_servidor_interno(application)
+    await cerrar_clientes_http(application)
+
+async def ejecutar_webhook(app):
+    """
+    Modo webhook: el servidor HTTP (uvicorn) recibe las actualizaciones en WEBHOOK_PATH y las
+    pone en la cola de la aplicación. Corre hasta Ctrl+C / SIGTERM, que maneja uvicorn.
+    Sigue el mismo ciclo que run_polling: initialize, post_init, start ... stop, shutdown, post_shutdown.
+    """
+    servidor_app.state.telegram = app
+    await app.initialize()
+    try:
+        if app.post_init:
+            await app.post_init(app)
+        if WEBHOOK_URL:
+            await app.bot.set_webhook(
+                url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=min(100, max(ACTUALIZACIONES_CONCURRENTES, 1)),
+            )
+        else:
+            logging.warning("WEBHOOK_URL vacío: no se registra el webhook en Telegram")
+        await app.start()
+        logging.info(f"Webhook escuchando en {BOT_HTTP_HOST}:{BOT_HTTP_PORT}{WEBHOOK_PATH}")
+        await uvicorn.Server(config_servidor()).serve()
+    finally:
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+def crear_aplicacion(token=TOKEN, concurrentes=ACTUALIZACIONES_CONCURRENTES):
+    """Construye la aplicación de PTB con todos los manejadores."""
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .post_init(al_iniciar)
+        .post_shutdown(al_apagar)
+    )
+    if concurrentes > 1:
+        # Distintos usuarios en paralelo, cada conversación en orden (ver concurrencia.py)
+        builder = builder.concurrent_updates(ProcesadorPorUsuario(concurrentes))
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL.rstrip('/')}/bot").base_file_url(f"{TELEGRAM_API_URL.rstrip('/')}/file/bot")
+    app = builder.build()
 
-    app = ApplicationBuilder().token(TOKEN).build()
-    
     # Manejador para el Flujo de Registro
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
@@ -604,8 +957,31 @@ if __name__ == '__main__':
 
     app.add_handler(conv_handler)
     app.add_handler(planes_handler)
-    app.add_handler(CommandHandler("consulta", consultar))
-    
+    # block=False: cada /consulta corre como tarea aparte y no frena los mensajes de los demás
+    # usuarios; la concurrencia la limita control_consultas
+    app.add_handler(CommandHandler("consulta", consultar, block=False))
+
+    return app
+
+if __name__ == '__main__':
+    if not TOKEN:
+        logging.error("TELEGRAM_TOKEN no encontrado en .env")
+        exit(1)
+
+    app = crear_aplicacion()
+
+    if BOT_MODO == "webhook":
+        if not BOT_HTTP_PORT:
+            logging.error("El modo webhook necesita BOT_HTTP_PORT")
+            exit(1)
+        if not WEBHOOK_SECRET:
+            # Sin secreto cualquiera que llegue a WEBHOOK_PATH podría inyectar actualizaciones
+            logging.error("El modo webhook necesita WEBHOOK_SECRET (p. ej. openssl rand -hex 32)")
+            exit(1)
+        logging.info("Iniciando Bot (webhook)...")
+        asyncio.run(ejecutar_webhook(app))
+        exit(0)
+
     # Soporte para entornos asíncronos
     try:
         asyncio.get_event_loop()
@@ -0,0 +1,245 @@
+# caché de respuestas del RAG para preguntas repetidas
+import asyncio
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# clave usada para invalidar todas las entradas (p. ej. al borrar la colección)
+ALL_DOCS = "*"
+
+# cada cuánto (segundos) un worker relee las invalidaciones registradas por los demás
+INVALIDATION_SYNC_SECONDS = 1.0
+
+
+def normalize_question(question: str) -> str:
+    """Minúsculas, sin tildes, sin signos de puntuación y con espacios simples"""
+    text = unicodedata.normalize("NFKD", question.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def cache_dir() -> Path:
+    path = Path(os.getenv("CACHE_DIR", ".cache"))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+class AnswerCache:
+    """
+    Caché LRU con TTL de respuestas de /query.
+
+    - Acierto exacto: pregunta normalizada + filtros (category_ids, doc_id, status, area, top_k).
+    - Acierto semántico: misma combinación de filtros y similitud coseno del embedding de la
+      pregunta >= similarity. Se exige además que los números de la pregunta coincidan, para
+      que "artículo 10" nunca responda a "artículo 11".
+
+    Cada worker de gunicorn tiene su propia caché en memoria; las invalidaciones por doc_id se
+    registran también en un SQLite compartido (CACHE_DIR) para que los demás workers descarten
+    las respuestas que dependan de un documento re-ingestado o eliminado.
+
+    Las búsquedas no tocan SQLite: consultan una copia en memoria de las invalidaciones que
+    refresh() actualiza en un hilo (asyncio.to_thread) cada INVALIDATION_SYNC_SECONDS. Las
+    invalidaciones de otro worker se ven, como mucho, con ese retraso; las del propio worker
+    de inmediato.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        similarity: Optional[float] = None,
+        db_path: Optional[str] = None,
+    ):
+        self.max_entries = max_entries or int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+        self.ttl_seconds = ttl_seconds or float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+        self.similarity = similarity or float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+        self.db_path = db_path or str(cache_dir() / "answer_cache_invalidations.sqlite")
+        self.entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "invalidated": 0, "evicted": 0}
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_pid: Optional[int] = None
+        self.invalidations: Dict[str, float] = {}  # doc_id -> última invalidación conocida
+        self._synced_until = 0.0  # mayor ts leído de SQLite
+        self._synced_at = float("-inf")  # time.monotonic() del último refresco
+        self._sync_task: Optional[asyncio.Task] = None
+
+    # --------------------------------------------------------------------------
+    # Registro compartido de invalidaciones
+    # --------------------------------------------------------------------------
+
+    def _conn(self) -> sqlite3.Connection:
+        # La conexión no debe cruzar un fork
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.db_path, timeout=5, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS invalidations (doc_id TEXT PRIMARY KEY, ts REAL NOT NULL)"
+            )
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _read_invalidations(self, since: float) -> List[tuple]:
+        return self._conn().execute(
+            "SELECT doc_id, ts FROM invalidations WHERE ts >= ?", (since,)
+        ).fetchall()
+
+    def _write_invalidations(self, doc_ids: List[str], ts: float) -> None:
+        self._conn().executemany(
+            "INSERT INTO invalidations (doc_id, ts) VALUES (?, ?) "
+            "ON CONFLICT(doc_id) DO UPDATE SET ts = excluded.ts",
+            [(doc_id, ts) for doc_id in doc_ids],
+        )
+
+    def _remember(self, rows) -> None:
+        for doc_id, ts in rows:
+            if ts > self.invalidations.get(doc_id, 0.0):
+                self.invalidations[doc_id] = ts
+
+    async def refresh(self) -> None:
+        """Trae (en un hilo) las invalidaciones nuevas de los demás workers, como mucho cada INVALIDATION_SYNC_SECONDS"""
+        if time.monotonic() - self._synced_at < INVALIDATION_SYNC_SECONDS:
+            return
+        if self._sync_task is None:
+            self._sync_task = asyncio.create_task(self._sync())
+        await asyncio.shield(self._sync_task)
+
+    async def _sync(self) -> None:
+        try:
+            rows = await asyncio.to_thread(self._read_invalidations, self._synced_until)
+            self._remember(rows)
+            self._synced_until = max([self._synced_until] + [ts for _, ts in rows])
+        except sqlite3.Error as e:
+            # se sigue con la copia anterior; se reintenta en el próximo refresco
+            logger.warning(f"No se pudieron leer las invalidaciones de la caché: {e}")
+        finally:
+            self._synced_at = time.monotonic()
+            self._sync_task = None
+
+    def _invalidated_since(self, doc_ids: List[str], created_at: float) -> bool:
+        latest = max((self.invalidations.get(d, 0.0) for d in list(doc_ids) + [ALL_DOCS]), default=0.0)
+        return latest >= created_at
+
+    # --------------------------------------------------------------------------
+    # Lectura / escritura
+    # --------------------------------------------------------------------------
+
+    @staticmethod
+    def filter_key(category_ids, doc_id, status, area, top_k) -> str:
+        cats = ",".join(str(c) for c in sorted(set(category_ids or [])))
+        return f"cats={cats}|doc={doc_id or ''}|status={status or ''}|area={area or ''}|k={top_k}"
+
+    def _valid(self, key: str, entry: Dict) -> bool:
+        now = time.time()
+        if now - entry["created_at"] > self.ttl_seconds or self._invalidated_since(entry["doc_ids"], entry["created_at"]):
+            self.entries.pop(key, None)
+            self.stats["invalidated"] += 1
+            return False
+        return True
+
+    def get_exact(self, question: str, filter_key: str) -> Optional[Dict]:
+        key = f"{filter_key}|q={normalize_question(question)}"
+        entry = self.entries.get(key)
+        if entry is None or not self._valid(key, entry):
+            return None
+        self.entries.move_to_end(key)
+        self.stats["exact_hits"] += 1
+        return entry["response"]
+
+    def get_similar(self, question: str, query_vec: List[float], filter_key: str) -> Optional[Dict]:
+        numbers = set(re.findall(r"\d+", question))
+        vec = np.asarray(query_vec, dtype=np.float32)
+        vec /= np.linalg.norm(vec) or 1.0
+
+        candidates = []
+        for key, entry in self.entries.items():
+            if entry["filter_key"] != filter_key or entry["numbers"] != numbers or entry["vector"] is None:
+                continue
+            score = float(np.dot(entry["vector"], vec))
+            if score >= self.similarity:
+                candidates.append((score, key))
+
+        # de la más parecida a la menos; las vencidas o invalidadas se descartan y se sigue con la siguiente
+        for score, key in sorted(candidates, reverse=True):
+            if not self._valid(key, self.entries[key]):
+                continue
+            self.entries.move_to_end(key)
+            self.stats["semantic_hits"] += 1
+            logger.info(f"Caché semántica: similitud {score:.3f}")
+            return self.entries[key]["response"]
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, question: str, query_vec: Optional[List[float]], filter_key: str, response: Dict,
+            started_at: Optional[float] = None) -> None:
+        """
+        started_at es la hora (time.time()) en que empezó la consulta que produjo la respuesta:
+        los contextos se leyeron después, así que una invalidación posterior a ese momento la
+        descarta aunque la respuesta se guarde más tarde.
+        """
+        # sin query_vec (respuesta sin embedding de la pregunta) la entrada solo sirve por pregunta exacta
+        vec = None
+        if query_vec is not None:
+            vec = np.asarray(query_vec, dtype=np.float32)
+            vec /= np.linalg.norm(vec) or 1.0
+        key = f"{filter_key}|q={normalize_question(question)}"
+        self.entries[key] = {
+            "filter_key": filter_key,
+            "numbers": set(re.findall(r"\d+", question)),
+            "vector": vec,
+            "doc_ids": list(response.get("doc_ids", [])),
+            "created_at": started_at if started_at is not None else time.time(),
+            "response": response,
+        }
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evicted"] += 1
+
+    # --------------------------------------------------------------------------
+    # Invalidación
+    # --------------------------------------------------------------------------
+
+    async def invalidate_docs(self, doc_ids: List[str]) -> int:
+        """Descarta las respuestas que usaron alguno de estos documentos (en todos los workers)"""
+        now = time.time()
+        targets = {str(d) for d in doc_ids}
+        self._remember((doc_id, now) for doc_id in targets)
+        stale = [
+            key for key, entry in self.entries.items()
+            if ALL_DOCS in targets or targets.intersection(entry["doc_ids"])
+        ]
+        for key in stale:
+            del self.entries[key]
+        self.stats["invalidated"] += len(stale)
+        await asyncio.to_thread(self._write_invalidations, list(targets), now)
+        return len(stale)
+
+    async def invalidate_all(self) -> int:
+        return await self.invalidate_docs([ALL_DOCS])
+
+    def get_stats(self) -> Dict:
+        hits = self.stats["exact_hits"] + self.stats["semantic_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            "pid": os.getpid(),
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "similarity_threshold": self.similarity,
+            "hit_ratio": round(hits / lookups, 4) if lookups else None,
+            **self.stats,
+        }
@@ -0,0 +1,85 @@
+"""
+Verificación y benchmark del borrado de documentos grandes contra Qdrant en modo local
+(en memoria, sin servidor).
+
+Carga un documento con más de 10.000 puntos (más otro documento que no debe tocarse) y compara:
+  - legacy: scroll con limit=10000 y borrado por lista de IDs (comportamiento anterior)
+  - filter: QdrantStorage.delete_document (count exacto + borrado en el servidor por filtro)
+
+Termina con código 1 si quedan puntos del documento o si se borró algo del otro documento.
+
+Uso (desde rag-core/):
+    python -m benchmarks.bench_delete_document --points 12000
+"""
+import argparse
+import logging
+import sys
+import time
+import uuid
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.models import FieldCondition, Filter, MatchValue
+
+from vector_db import QdrantStorage
+
+DIM = 8
+
+
+class LocalStorage(QdrantStorage):
+    """QdrantStorage sobre el modo local en memoria de qdrant-client"""
+
+    def _connect(self) -> QdrantClient:
+        return QdrantClient(location=":memory:")
+
+
+def load(store: QdrantStorage, doc_id: str, points: int):
+    rng = np.random.default_rng(0)
+    ids = [str(uuid.uuid5(uuid.NAMESPACE_URL, f"{doc_id}:{i}")) for i in range(points)]
+    vectors = rng.random((points, DIM), dtype=np.float32).tolist()
+    payloads = [{"doc_id": doc_id, "chunk_index": i, "text": f"fragmento {i}"} for i in range(points)]
+    store.upsert(ids, vectors, payloads, batch_size=1000)
+
+
+def legacy_delete(store: QdrantStorage, doc_id: str) -> int:
+    points, _ = store.client.scroll(
+        collection_name=store.collection,
+        scroll_filter=Filter(must=[FieldCondition(key="doc_id", match=MatchValue(value=doc_id))]),
+        limit=10000,
+        with_payload=False,
+        with_vectors=False,
+    )
+    store.client.delete(collection_name=store.collection, points_selector=[p.id for p in points])
+    return len(points)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=12000)
+    parser.add_argument("--other-points", type=int, default=500)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    ok = True
+    for name, delete in (("legacy", legacy_delete), ("filter", lambda store, doc_id: store.delete_document(doc_id))):
+        store = LocalStorage(url="local", collection="bench", dim=DIM)
+        load(store, "grande", args.points)
+        load(store, "otro", args.other_points)
+
+        started = time.perf_counter()
+        reported = delete(store, "grande")
+        elapsed = time.perf_counter() - started
+        remaining = store.count_document("grande")
+        other = store.count_document("otro")
+
+        print(f"{name:7s} reportados={reported:6d}  restantes={remaining:6d}  "
+              f"otro doc={other:5d}/{args.other_points}  {elapsed * 1000:8.1f} ms")
+        if name == "filter":
+            ok = reported == args.points and remaining == 0 and other == args.other_points
+
+    print("\nOK" if ok else "\nFALLÓ: el borrado por filtro no eliminó el documento completo")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmark del motor de embeddings por lotes contra un servidor falso de embeddings.
+
+Compara:
+  - single:  una sola llamada embeddings.create con todos los fragmentos (comportamiento anterior)
+  - batched: aembed_texts (lotes por presupuesto de tokens, en paralelo y con reintentos)
+
+Uso (desde rag-core/):
+    python -m benchmarks.bench_embed_batching --chunks 423 --concurrency 4 --fail-rate 0.1
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+from benchmarks.stub_servers import StubServer, create_openai_stub
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=423, help="fragmentos a embeber (la constitución tiene ~423)")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--batch-inputs", type=int, default=64)
+    parser.add_argument("--base-delay", type=float, default=0.2, help="latencia fija por request (s)")
+    parser.add_argument("--per-input-delay", type=float, default=0.01, help="latencia por texto del lote (s)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fracción de requests que responden 429")
+    args = parser.parse_args()
+
+    stub_app = create_openai_stub(
+        embed_delay=args.base_delay, embed_per_input_delay=args.per_input_delay, fail_rate=args.fail_rate
+    )
+    with StubServer(stub_app) as stub:
+        os.environ["OPENAI_API_KEY"] = "bench"
+        os.environ["OPENAI_BASE_URL"] = f"{stub.url}/v1"
+        os.environ["EMBEDDING_CACHE_ENABLED"] = "false"
+        os.environ["EMBED_CONCURRENCY"] = str(args.concurrency)
+        os.environ["EMBED_BATCH_MAX_INPUTS"] = str(args.batch_inputs)
+        logging.basicConfig(level=logging.WARNING)
+
+        import data_loader
+        from openai import OpenAI
+
+        texts = [f"Artículo {i}. Texto de prueba del artículo {i} para el benchmark. " * 8 for i in range(args.chunks)]
+
+        print(f"{args.chunks} fragmentos, latencia simulada {args.base_delay}s + {args.per_input_delay}s/texto, "
+              f"429 en {args.fail_rate:.0%} de los requests\n")
+
+        # Comportamiento anterior: un único request (sin reintentos propios)
+        start = time.perf_counter()
+        try:
+            OpenAI(max_retries=5).embeddings.create(model=data_loader.EMBED_MODEL, input=texts)
+            elapsed = time.perf_counter() - start
+            print(f"single   {elapsed:7.2f}s  {args.chunks / elapsed:8.1f} chunks/s")
+        except Exception as e:
+            print(f"single   falló: {e}")
+
+        stats = {}
+        vectors = asyncio.run(data_loader.aembed_texts(texts, stats=stats))
+        assert len(vectors) == len(texts)
+        print(f"batched  {stats['elapsed_s']:7.2f}s  {stats['chunks_per_s']:8.1f} chunks/s  "
+              f"lotes={stats['batches']} reintentos={stats['retries']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Benchmark de búsqueda filtrada antes y después de crear los índices de payload.
+
+Necesita un servidor de Qdrant real (QDRANT_HOST/QDRANT_PORT o --url): el modo local de
+qdrant-client ignora los índices de payload. Crea una colección temporal con la misma
+configuración que la de producción (distancia coseno, on_disk_payload), la llena con puntos
+sintéticos y mide, sin índices y luego con los índices de PAYLOAD_INDEXES creados por la
+migración de arranque (QdrantStorage.ensure_collection):
+
+  - query:   búsqueda con el filtro de /query (status + category_ids con MatchAny, sin staging)
+  - doc:     búsqueda restringida a un documento (doc_id)
+  - count:   count exacto por doc_id (borrado e info de documento)
+
+Uso (desde rag-core/, con Qdrant levantado):
+    python -m benchmarks.bench_filtered_search --points 120000 --docs 400 --dim 256
+"""
+import argparse
+import logging
+import statistics
+import time
+import uuid
+
+import numpy as np
+from qdrant_client.models import Distance, VectorParams
+
+from vector_db import PAYLOAD_INDEXES, QdrantStorage
+
+CATEGORIES = 20
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def load(store: QdrantStorage, points: int, docs: int, dim: int, batch_size: int = 2000):
+    rng = np.random.default_rng(0)
+    store.client.create_collection(
+        collection_name=store.collection,
+        vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
+        on_disk_payload=True,
+    )
+    for start in range(0, points, batch_size):
+        end = min(start + batch_size, points)
+        ids = [str(uuid.uuid5(uuid.NAMESPACE_URL, f"bench:{i}")) for i in range(start, end)]
+        vectors = rng.standard_normal((end - start, dim), dtype=np.float32).tolist()
+        payloads = [
+            {
+                "doc_id": f"doc-{i % docs}",
+                "chunk_index": i // docs,
+                "status": "active" if (i % docs) % 20 else "inactive",
+                "category_ids": sorted({int(c) for c in rng.integers(1, CATEGORIES + 1, size=2)}),
+                "area": "penal",
+                "staging": False,
+                "text": f"Artículo {i}. Texto de prueba del fragmento {i}.",
+            }
+            for i in range(start, end)
+        ]
+        store.upsert(ids, vectors, payloads, batch_size=batch_size)
+
+
+def wait_until_indexed(store: QdrantStorage, points: int, timeout: float = 600):
+    """Espera a que el optimizador termine y los índices cubran todos los puntos"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        info = store.client.get_collection(store.collection)
+        schema = info.payload_schema or {}
+        indexed = all(schema.get(field) is not None and schema[field].points >= points for field in PAYLOAD_INDEXES)
+        if info.status.value == "green" and (indexed or not schema):
+            return
+        time.sleep(0.5)
+    raise TimeoutError("Qdrant no terminó de indexar la colección")
+
+
+def measure(store: QdrantStorage, queries: int, docs: int, dim: int, top_k: int) -> dict:
+    rng = np.random.default_rng(1)
+    timings = {"query": [], "doc": [], "count": []}
+    for q in range(queries):
+        vector = rng.standard_normal(dim, dtype=np.float32).tolist()
+        categories = [int(c) for c in rng.integers(1, CATEGORIES + 1, size=3)]
+        doc_id = f"doc-{q % docs}"
+
+        started = time.perf_counter()
+        store.search(vector, top_k=top_k, status="active", category_ids=categories)
+        timings["query"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        store.search(vector, top_k=top_k, doc_id=doc_id, status=None)
+        timings["doc"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        store.count_document(doc_id)
+        timings["count"].append(time.perf_counter() - started)
+
+    return {
+        name: {
+            "mean_ms": statistics.mean(values) * 1000,
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+        }
+        for name, values in timings.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="URL de Qdrant (por defecto QDRANT_HOST/QDRANT_PORT)")
+    parser.add_argument("--points", type=int, default=120000)
+    parser.add_argument("--docs", type=int, default=400)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--collection", default="bench_filtered_search")
+    parser.add_argument("--keep", action="store_true", help="No borrar la colección al terminar")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    store = QdrantStorage(url=args.url, collection=args.collection, dim=args.dim, bootstrap=False)
+    store.delete_all()
+    try:
+        started = time.perf_counter()
+        load(store, args.points, args.docs, args.dim)
+        wait_until_indexed(store, args.points)
+        print(f"{args.points} puntos, {args.docs} documentos, dim={args.dim} "
+              f"cargados en {time.perf_counter() - started:.1f}s ({store.url})")
+        before = measure(store, args.queries, args.docs, args.dim, args.top_k)
+
+        # la misma migración que aplica el arranque de la API sobre una colección existente
+        started = time.perf_counter()
+        store.ensure_collection()
+        wait_until_indexed(store, args.points)
+        print(f"Índices {sorted(PAYLOAD_INDEXES)} construidos en {time.perf_counter() - started:.1f}s")
+        after = measure(store, args.queries, args.docs, args.dim, args.top_k)
+
+        print(f"\n{'':6s} {'sin índices (p50/p95 ms)':>26s} {'con índices (p50/p95 ms)':>26s} {'mejora p50':>11s}")
+        for name in before:
+            b, a = before[name], after[name]
+            print(f"{name:6s} {b['p50_ms']:12.2f} / {b['p95_ms']:9.2f}  {a['p50_ms']:12.2f} / {a['p95_ms']:9.2f}"
+                  f"  {b['p50_ms'] / a['p50_ms']:9.1f}x")
+    finally:
+        if not args.keep:
+            store.delete_all()
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
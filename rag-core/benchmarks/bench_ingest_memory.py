@@ -0,0 +1,112 @@
+"""
+Benchmark de memoria de la ingesta contra servidores falsos de OpenAI y Qdrant.
+
+Compara, con un PDF sintético de N páginas:
+  - legacy:    texto completo → lista completa de fragmentos → todos los vectores → upsert
+  - streaming: ingest_pipeline.run_pipeline (páginas → lotes → embeddings → upsert con backpressure)
+
+Cada modo corre en un proceso aparte (los stubs quedan en el proceso principal) y reporta
+el pico de memoria residente (RSS) por encima de la memoria tras los imports, el tiempo
+hasta el primer upsert en Qdrant y el tiempo total.
+
+Uso (desde rag-core/):
+    python -m benchmarks.bench_ingest_memory --pages 500
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.stub_servers import StubServer, create_openai_stub, create_qdrant_stub
+from benchmarks.synthetic_pdf import write_synthetic_pdf
+
+
+def rss_mb() -> float:
+    # ru_maxrss está en KB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_child(mode: str, pdf_path: str, qdrant_url: str):
+    """Ejecuta una ingesta en este proceso e imprime el resultado como JSON"""
+    logging.basicConfig(level=logging.WARNING)
+    import data_loader
+    from ingest_pipeline import run_pipeline
+    from vector_db import QdrantStorage
+
+    store = QdrantStorage(url=qdrant_url, collection="bench", bootstrap=False)
+
+    def make_points(indices, chunks):
+        ids = [i + 1 for i in indices]
+        return ids, [{"text": c, "doc_id": "bench", "chunk_index": i} for i, c in zip(indices, chunks)]
+
+    baseline = rss_mb()
+    started = time.time()
+    if mode == "legacy":
+        # comportamiento anterior: todo el documento y todos los vectores en memoria
+        full_text = "\n".join(data_loader.iter_pdf_pages(pdf_path))
+        chunks = list(data_loader.iter_chunks([full_text], pdf_path))
+        vectors = asyncio.run(data_loader.aembed_texts(chunks))
+        ids, payloads = make_points(list(range(len(chunks))), chunks)
+        store.upsert(ids, vectors, payloads)
+        total_chunks = len(chunks)
+    else:
+        summary = asyncio.run(run_pipeline(pdf_path, store, make_points, lambda stage, **progress: None))
+        total_chunks = summary["chunks"]
+    print(json.dumps({
+        "chunks": total_chunks,
+        "peak_mb": rss_mb() - baseline,
+        "started": started,
+        "elapsed": time.time() - started,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--articles-per-page", type=int, default=4)
+    parser.add_argument("--batch-inputs", type=int, default=64)
+    parser.add_argument("--embed-delay", type=float, default=0.05)
+    parser.add_argument("--child", choices=["legacy", "streaming"], help=argparse.SUPPRESS)
+    parser.add_argument("--pdf", help=argparse.SUPPRESS)
+    parser.add_argument("--qdrant-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.pdf, args.qdrant_url)
+        return
+
+    openai_app = create_openai_stub(embed_delay=args.embed_delay)
+    qdrant_app = create_qdrant_stub(upsert_delay=0.01)
+    with StubServer(openai_app) as openai_stub, StubServer(qdrant_app) as qdrant_stub:
+        env = {
+            **os.environ,
+            "OPENAI_API_KEY": "bench",
+            "OPENAI_BASE_URL": f"{openai_stub.url}/v1",
+            "EMBEDDING_CACHE_ENABLED": "false",
+            "EMBED_BATCH_MAX_INPUTS": str(args.batch_inputs),
+        }
+        pdf_path = os.path.join(tempfile.mkdtemp(), "gaceta.pdf")
+        write_synthetic_pdf(pdf_path, args.pages, args.articles_per_page)
+        print(f"PDF sintético: {args.pages} páginas, {os.path.getsize(pdf_path) / 1e6:.1f} MB\n")
+
+        for mode in ("streaming", "legacy"):
+            qdrant_app.state.upserts.update(requests=0, points=0, first_at=None)
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_ingest_memory", "--child", mode,
+                 "--pdf", pdf_path, "--qdrant-url", qdrant_stub.url],
+                env=env, capture_output=True, text=True, check=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            first = qdrant_app.state.upserts["first_at"] - result["started"]
+            print(f"{mode:10s} chunks={result['chunks']:5d}  pico RSS=+{result['peak_mb']:7.1f} MB  "
+                  f"primer upsert={first:6.2f}s  total={result['elapsed']:6.2f}s")
+
+
+if __name__ == "__main__":
+    main()
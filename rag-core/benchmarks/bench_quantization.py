@@ -0,0 +1,173 @@
+"""
+Recall@k vs. latencia de la búsqueda con cuantización de vectores.
+
+Necesita un servidor de Qdrant real (QDRANT_HOST/QDRANT_PORT o --url): el modo local de
+qdrant-client no cuantiza. Carga el mismo conjunto de vectores sintéticos (agrupados en temas,
+normalizados, con la dimensión de text-embedding-3-large) en una colección temporal por
+configuración:
+
+  - float:        float32 en RAM, sin cuantización (configuración actual)
+  - scalar:       int8 en RAM + originales en RAM
+  - scalar-disk:  int8 en RAM + originales en disco (QDRANT_VECTORS_ON_DISK=true)
+  - binary:       1 bit por dimensión en RAM + originales en RAM
+  - binary-disk:  1 bit por dimensión en RAM + originales en disco
+
+La verdad de referencia es una búsqueda exacta (sin HNSW) en la colección float. Para cada
+configuración cuantizada se prueban varios oversampling, con y sin rescore, y se informa
+recall@k, latencia p50/p95 y la RAM estimada de los vectores que se recorren en la búsqueda.
+
+Uso (desde rag-core/, con Qdrant levantado):
+    python -m benchmarks.bench_quantization --points 20000 --dim 3072 --queries 200
+"""
+import argparse
+import logging
+import statistics
+import time
+import uuid
+
+import numpy as np
+from qdrant_client.models import SearchParams
+
+from vector_db import QdrantStorage
+
+CONFIGS = {
+    "float": ("none", False),
+    "scalar": ("scalar", False),
+    "scalar-disk": ("scalar", True),
+    "binary": ("binary", False),
+    "binary-disk": ("binary", True),
+}
+
+# bytes por dimensión de la copia que se recorre en RAM
+BYTES_PER_DIM = {"none": 4, "scalar": 1, "binary": 1 / 8}
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def make_dataset(points: int, queries: int, dim: int, topics: int):
+    """Vectores normalizados agrupados alrededor de `topics` centros, y consultas cercanas a ellos"""
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((topics, dim), dtype=np.float32)
+    vectors = centers[rng.integers(0, topics, points)] + 0.6 * rng.standard_normal((points, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    picked = vectors[rng.integers(0, points, queries)]
+    query_vectors = picked + 0.5 / np.sqrt(dim) * rng.standard_normal((queries, dim), dtype=np.float32)
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    return vectors, query_vectors
+
+
+def load(store: QdrantStorage, vectors: np.ndarray, batch_size: int = 500):
+    store.delete_all()
+    store.ensure_collection()
+    for start in range(0, len(vectors), batch_size):
+        end = min(start + batch_size, len(vectors))
+        ids = [str(uuid.uuid5(uuid.NAMESPACE_URL, f"bench:{i}")) for i in range(start, end)]
+        payloads = [{"doc_id": "bench", "chunk_index": i, "status": "active", "text": f"fragmento {i}"}
+                    for i in range(start, end)]
+        store.upsert(ids, vectors[start:end].tolist(), payloads, batch_size=batch_size)
+
+
+def wait_green(store: QdrantStorage, timeout: float = 900):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if store.client.get_collection(store.collection).status.value == "green":
+            return
+        time.sleep(0.5)
+    raise TimeoutError("Qdrant no terminó de optimizar la colección")
+
+
+def exact_neighbors(store: QdrantStorage, query_vectors: np.ndarray, top_k: int) -> list[set]:
+    truth = []
+    for vector in query_vectors:
+        response = store.client.query_points(
+            collection_name=store.collection,
+            query=vector.tolist(),
+            limit=top_k,
+            search_params=SearchParams(exact=True),
+            with_payload=False,
+        )
+        truth.append({str(point.id) for point in response.points})
+    return truth
+
+
+def measure(store: QdrantStorage, query_vectors: np.ndarray, truth: list[set], top_k: int) -> dict:
+    latencies, recalls = [], []
+    for vector, expected in zip(query_vectors, truth):
+        started = time.perf_counter()
+        result = store.search(vector.tolist(), top_k=top_k, status=None)
+        latencies.append(time.perf_counter() - started)
+        recalls.append(len({hit["id"] for hit in result["hits"]} & expected) / top_k)
+    return {
+        "recall": statistics.mean(recalls),
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="URL de Qdrant (por defecto QDRANT_HOST/QDRANT_PORT)")
+    parser.add_argument("--points", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=3072)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--oversampling", default="1,2,4", help="Valores de oversampling a probar")
+    parser.add_argument("--configs", default=",".join(CONFIGS))
+    parser.add_argument("--keep", action="store_true", help="No borrar las colecciones al terminar")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    vectors, query_vectors = make_dataset(args.points, args.queries, args.dim, args.topics)
+    oversamplings = [float(value) for value in args.oversampling.split(",")]
+    stores = {}
+    rows = []
+    try:
+        baseline = QdrantStorage(url=args.url, collection="bench_quant_float", dim=args.dim,
+                                 bootstrap=False, quantization="none", vectors_on_disk=False)
+        stores["float"] = baseline
+        load(baseline, vectors)
+        wait_green(baseline)
+        truth = exact_neighbors(baseline, query_vectors, args.top_k)
+
+        for name in args.configs.split(","):
+            quantization, on_disk = CONFIGS[name]
+            store = stores.get(name) or QdrantStorage(
+                url=args.url, collection=f"bench_quant_{name.replace('-', '_')}", dim=args.dim,
+                bootstrap=False, quantization=quantization, vectors_on_disk=on_disk,
+            )
+            if name not in stores:
+                stores[name] = store
+                started = time.perf_counter()
+                load(store, vectors)
+                wait_green(store)
+                print(f"{name}: {args.points} vectores cargados e indexados en {time.perf_counter() - started:.1f}s")
+            ram_mb = args.points * args.dim * BYTES_PER_DIM[quantization] / 1024 ** 2
+            variants = [(1.0, False)] if quantization == "none" else (
+                [(value, True) for value in oversamplings] + [(1.0, False)]
+            )
+            for oversampling, rescore in variants:
+                store.search_oversampling, store.search_rescore = oversampling, rescore
+                measure(store, query_vectors[:10], truth[:10], args.top_k)  # calentamiento
+                result = measure(store, query_vectors, truth, args.top_k)
+                rows.append((name, oversampling, rescore, ram_mb, result))
+
+        print(f"\n{args.points} vectores de {args.dim} dims, {args.queries} consultas, recall@{args.top_k} "
+              f"contra búsqueda exacta ({baseline.url})")
+        print(f"{'config':12s} {'oversampling':>12s} {'rescore':>8s} {'RAM MB':>8s} {'recall':>7s} "
+              f"{'p50 ms':>8s} {'p95 ms':>8s}")
+        for name, oversampling, rescore, ram_mb, result in rows:
+            print(f"{name:12s} {oversampling:12.1f} {str(rescore):>8s} {ram_mb:8.0f} {result['recall']:7.3f} "
+                  f"{result['p50_ms']:8.2f} {result['p95_ms']:8.2f}")
+    finally:
+        for store in stores.values():
+            if not args.keep:
+                store.delete_all()
+            store.close()
+
+
+if __name__ == "__main__":
+    main()
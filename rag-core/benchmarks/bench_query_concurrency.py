@@ -0,0 +1,110 @@
+"""
+Benchmark de concurrencia de /query contra servidores falsos de OpenAI y Qdrant.
+
+Compara, dentro de UN solo worker de uvicorn:
+  - blocking: el camino anterior (clientes síncronos dentro de un endpoint async)
+  - async:    el camino actual (AsyncOpenAI + AsyncQdrantClient)
+
+Uso (desde rag-core/):
+    python -m benchmarks.bench_query_concurrency --requests 100 --concurrency 50
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import time
+
+import httpx
+
+from benchmarks.stub_servers import StubServer, create_openai_stub, create_qdrant_stub
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run_load(url: str, total: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+    payload = {"question": "Que dice el articulo 10 de la constitucion", "top_k": 5}
+
+    async with httpx.AsyncClient(timeout=600, limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                resp = await client.post(url, json=payload)
+                latencies.append(time.perf_counter() - start)
+                if resp.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "elapsed_s": elapsed,
+        "req_per_s": total / elapsed,
+        "p50_s": statistics.median(latencies),
+        "p95_s": percentile(latencies, 0.95),
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--embed-delay", type=float, default=0.05)
+    parser.add_argument("--search-delay", type=float, default=0.02)
+    parser.add_argument("--chat-delay", type=float, default=0.5)
+    args = parser.parse_args()
+
+    # Los logs por consulta distorsionan la medición
+    logging.getLogger("uvicorn").setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    openai_stub = StubServer(create_openai_stub(args.embed_delay, args.chat_delay))
+    qdrant_stub = StubServer(create_qdrant_stub(args.search_delay))
+
+    with openai_stub, qdrant_stub:
+        # Los clientes se configuran al importar main, por eso el entorno va antes
+        os.environ["OPENAI_API_KEY"] = "bench"
+        os.environ["OPENAI_BASE_URL"] = f"{openai_stub.url}/v1"
+        os.environ["QDRANT_HOST"] = "127.0.0.1"
+        os.environ["QDRANT_PORT"] = str(qdrant_stub.port)
+
+        import main as rag_main
+        from openai import OpenAI
+        from data_loader import embed_texts
+        from vector_db import get_storage
+
+        sync_llm = OpenAI()
+
+        @rag_main.app.post("/_bench/query-blocking")
+        async def query_blocking(request: rag_main.QueryRequest):
+            # Réplica del camino anterior: llamadas síncronas dentro de un endpoint async
+            query_vec = embed_texts([request.question])[0]
+            found = get_storage().search(query_vector=query_vec, top_k=request.top_k * 3)
+            context_block = "\n\n".join(f"- {c}" for c in found["contexts"][:request.top_k])
+            response = sync_llm.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[{"role": "user", "content": f"{context_block}\n\n{request.question}"}],
+                max_tokens=1024,
+            )
+            return {"answer": response.choices[0].message.content}
+
+        with StubServer(rag_main.app) as rag:
+            print(f"{args.requests} consultas, concurrencia {args.concurrency}, "
+                  f"latencias simuladas: embed={args.embed_delay}s search={args.search_delay}s chat={args.chat_delay}s\n")
+            for mode, path in (("blocking", "/_bench/query-blocking"), ("async", "/query")):
+                result = asyncio.run(run_load(f"{rag.url}{path}", args.requests, args.concurrency))
+                print(f"{mode:9s} total={result['elapsed_s']:7.2f}s  {result['req_per_s']:7.2f} req/s  "
+                      f"p50={result['p50_s']:.2f}s  p95={result['p95_s']:.2f}s  errores={result['errors']}")
+
+
+if __name__ == "__main__":
+    main()
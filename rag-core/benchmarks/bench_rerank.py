@@ -0,0 +1,151 @@
+"""
+Benchmark de latencia y calidad del re-ranker (reranker.Reranker).
+
+Para cada pregunta se toman los candidatos de la búsqueda (top_k * 3, como /query) y se
+mide en qué posición queda el fragmento correcto sin re-ranking y con cada modo, y cuánto
+tarda el re-ranking:
+
+  - hit@k: fracción de preguntas cuyo fragmento correcto queda entre los k primeros, para
+    los k que se mandarían al LLM (si hit@4 con re-ranker ≈ hit@10 sin él, se puede bajar
+    RERANK_TOP_K a 4 sin perder respuestas)
+  - MRR y latencia p50/p95 del re-ranking por pregunta
+
+Dos fuentes de candidatos:
+  - sintética (por defecto, sin servicios): un corpus de artículos con vocabulario propio
+    y una búsqueda simulada que ubica el artículo correcto en una posición aleatoria
+    (más probable arriba), como una búsqueda densa imperfecta
+  - real (--questions preguntas.jsonl): embeddings de OpenAI + búsqueda en la colección de
+    Qdrant configurada. Cada línea: {"question": ..., "article": 10, "doc_id": "..."}
+
+El modo cross-encoder necesita `pip install sentence-transformers` (si no, se omite).
+
+Uso (desde rag-core/):
+    python -m benchmarks.bench_rerank --questions 300 --budgets 50,150,500
+    python -m benchmarks.bench_rerank --questions-file preguntas.jsonl
+"""
+import argparse
+import json
+import logging
+import random
+import re
+import statistics
+import time
+
+from reranker import Reranker
+
+CANDIDATES = 30
+FILLER = ("el estado garantiza los derechos de las personas conforme a la ley y la constitución "
+          "toda persona tiene derecho a la protección de sus bienes y a un debido proceso").split()
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def synthetic_cases(count: int, articles: int, seed: int = 0) -> list[tuple[str, list[dict], int]]:
+    """(pregunta, candidatos, id del correcto) con vocabulario propio por artículo"""
+    rnd = random.Random(seed)
+    vocabulary = [f"{rnd.choice('bcdfglmnprstv')}{rnd.choice('aeiou')}{rnd.choice('lmnrs')}"
+                  f"{rnd.choice('aeiou')}{rnd.choice(['cion', 'miento', 'dad', 'ncia', 'ble'])}" for _ in range(600)]
+    corpus = []
+    for number in range(1, articles + 1):
+        terms = rnd.sample(vocabulary, 6)
+        words = [rnd.choice(FILLER) for _ in range(rnd.randint(60, 160))]
+        for term in terms:
+            words.insert(rnd.randrange(len(words)), term)
+        corpus.append({"id": number, "terms": terms,
+                       "text": f"Artículo {number}. " + " ".join(words)})
+
+    cases = []
+    for _ in range(count):
+        target = rnd.choice(corpus)
+        question = "¿Qué establece la ley sobre " + " y ".join(rnd.sample(target["terms"], 3)) + "?"
+        others = rnd.sample([doc for doc in corpus if doc is not target], CANDIDATES - 1)
+        # búsqueda densa simulada: el correcto suele estar arriba, a veces bastante abajo
+        position = min(CANDIDATES - 1, int(rnd.expovariate(1 / 5)))
+        ranked = others[:position] + [target] + others[position:]
+        hits = [{"id": str(doc["id"]), "text": doc["text"], "score": 1 - i / 100} for i, doc in enumerate(ranked)]
+        cases.append((question, hits, str(target["id"])))
+    return cases
+
+
+def real_cases(path: str, top_k: int) -> list[tuple[str, list[dict], str]]:
+    """Candidatos de la colección real (requiere OpenAI y Qdrant)"""
+    from data_loader import embed_texts
+    from vector_db import QdrantStorage
+
+    store = QdrantStorage(bootstrap=False)
+    cases = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            vector = embed_texts([item["question"]])[0]
+            found = store.search(vector, top_k=top_k * 3, doc_id=item.get("doc_id"), status=None,
+                                 query_text=item["question"])
+            heading = re.compile(rf"^\s*Art[ií]culo\s+{item['article']}\b", re.IGNORECASE)
+            target = next((hit["id"] for hit in found["hits"] if heading.match(hit["text"])), None)
+            cases.append((item["question"], found["hits"], target))
+    return cases
+
+
+def evaluate(reranker: Reranker | None, cases, ks: list[int]) -> dict:
+    ranks, latencies = [], []
+    for question, hits, target in cases:
+        started = time.perf_counter()
+        ordered = reranker.rerank(question, hits) if reranker is not None else hits
+        latencies.append((time.perf_counter() - started) * 1000)
+        ids = [hit["id"] for hit in ordered]
+        ranks.append(ids.index(target) + 1 if target in ids else None)
+    return {
+        **{f"hit@{k}": sum(1 for rank in ranks if rank is not None and rank <= k) / len(ranks) for k in ks},
+        "mrr": statistics.mean(1 / rank if rank else 0 for rank in ranks),
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=300, help="Preguntas sintéticas")
+    parser.add_argument("--articles", type=int, default=400, help="Artículos del corpus sintético")
+    parser.add_argument("--questions-file", default=None, help="JSONL con preguntas reales")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--ks", default="3,4,5,10")
+    parser.add_argument("--budgets", default="50,150,500", help="RERANK_BUDGET_MS a probar con el cross-encoder")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    ks = [int(k) for k in args.ks.split(",")]
+    if args.questions_file:
+        cases = real_cases(args.questions_file, args.top_k)
+        source = args.questions_file
+    else:
+        cases = synthetic_cases(args.questions, args.articles)
+        source = f"sintético ({args.articles} artículos)"
+    cases = [case for case in cases if case[2] is not None]
+    print(f"{len(cases)} preguntas con el fragmento correcto entre los candidatos, fuente: {source}")
+
+    rows = [("sin re-ranking", evaluate(None, cases, ks))]
+    rows.append(("lexical", evaluate(Reranker(mode="lexical"), cases, ks)))
+    cross = Reranker(mode="cross-encoder")
+    cross.load()
+    if cross.mode == "cross-encoder":
+        cross.rerank(cases[0][0], cases[0][1])  # calentamiento
+        for budget in args.budgets.split(","):
+            cross.budget_ms = float(budget)
+            rows.append((f"cross-encoder {budget}ms", evaluate(cross, cases, ks)))
+    else:
+        print("cross-encoder omitido: sentence-transformers no está instalado")
+
+    header = " ".join(f"{f'hit@{k}':>7s}" for k in ks)
+    print(f"\n{'modo':24s} {header} {'MRR':>6s} {'p50 ms':>8s} {'p95 ms':>8s}")
+    for name, result in rows:
+        values = " ".join(f"{result[f'hit@{k}']:7.3f}" for k in ks)
+        print(f"{name:24s} {values} {result['mrr']:6.3f} {result['p50_ms']:8.2f} {result['p95_ms']:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Servidores falsos (stubs) de OpenAI y Qdrant para los benchmarks.
+
+Responden con el mismo formato JSON que los servicios reales, pero con una
+latencia simulada fija, para poder medir el comportamiento de rag-core sin
+gastar tokens ni depender de una base de datos real.
+"""
+import asyncio
+import functools
+import json
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@functools.lru_cache(maxsize=4096)
+def fake_vector(dim: int, seed: str) -> list[float]:
+    rnd = random.Random(seed)
+    return [rnd.uniform(-1, 1) for _ in range(dim)]
+
+
+def create_openai_stub(
+    embed_delay: float = 0.05,
+    chat_delay: float = 0.5,
+    dim: int = 3072,
+    embed_per_input_delay: float = 0.0,
+    fail_rate: float = 0.0,
+) -> FastAPI:
+    """
+    Imita /v1/embeddings y /v1/chat/completions.
+    embed_per_input_delay suma latencia por cada texto del lote (como la API real) y
+    fail_rate es la fracción de requests de embeddings que responden 429.
+    """
+    app = FastAPI()
+    app.state.calls = {"embeddings": 0, "chat": 0, "embedded_inputs": 0, "rate_limited": 0}
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        app.state.calls["embeddings"] += 1
+        if random.random() < fail_rate:
+            app.state.calls["rate_limited"] += 1
+            return JSONResponse(
+                status_code=429,
+                headers={"retry-after": "0.1"},
+                content={"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+            )
+        app.state.calls["embedded_inputs"] += len(inputs)
+        size = body.get("dimensions") or dim
+        await asyncio.sleep(embed_delay + embed_per_input_delay * len(inputs))
+        return {
+            "object": "list",
+            "model": body["model"],
+            "data": [
+                {"object": "embedding", "index": i, "embedding": fake_vector(size, text)}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": 10 * len(inputs), "total_tokens": 10 * len(inputs)},
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request):
+        body = await request.json()
+        app.state.calls["chat"] += 1
+        if body.get("stream"):
+            return StreamingResponse(stream_chat(body), media_type="text/event-stream")
+        await asyncio.sleep(chat_delay)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "Respuesta simulada según el Artículo 10."},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 500, "completion_tokens": 12, "total_tokens": 512},
+        }
+
+    async def stream_chat(body: dict):
+        # El primer token tarda un 20% de la latencia total y el resto llega de a poco
+        words = ("Respuesta simulada según el Artículo 10. " * 10).split(" ")
+        await asyncio.sleep(chat_delay * 0.2)
+        for word in words:
+            chunk = {
+                "id": "chatcmpl-stream", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body["model"],
+                "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(chat_delay * 0.8 / len(words))
+        usage = {
+            "id": "chatcmpl-stream", "object": "chat.completion.chunk", "created": int(time.time()),
+            "model": body["model"], "choices": [],
+            "usage": {"prompt_tokens": 500, "completion_tokens": len(words), "total_tokens": 500 + len(words)},
+        }
+        yield f"data: {json.dumps(usage)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return app
+
+
+def create_qdrant_stub(
+    search_delay: float = 0.02,
+    num_results: int = 30,
+    upsert_delay: float = 0.0,
+    dim: int | None = None,
+    search_dim: int | None = None,
+    hybrid: bool | None = None,
+) -> FastAPI:
+    """
+    Imita los endpoints de Qdrant que usan el arranque, la consulta y la ingesta. Los upserts
+    no guardan nada: solo se cuentan y se registra el momento del primero (app.state.upserts).
+
+    La colección informa los vectores que pide el entorno (EMBED_DIM, EMBED_SEARCH_DIM,
+    HYBRID_SEARCH, como vector_db) para que rag-core use los caminos de búsqueda híbrida y en
+    dos etapas (/points/query); los índices de payload creados quedan en app.state.indexes.
+    """
+    app = FastAPI()
+    app.state.upserts = {"requests": 0, "points": 0, "first_at": None}
+    app.state.indexes = {}
+    dim = dim or int(os.getenv("EMBED_DIM", "3072"))
+    search_dim = search_dim if search_dim is not None else int(os.getenv("EMBED_SEARCH_DIM", "0"))
+    if hybrid is None:
+        hybrid = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+    dense = {"size": dim, "distance": "Cosine"}
+    if search_dim:
+        vectors = {"search": {"size": search_dim, "distance": "Cosine"}, "full": {**dense, "hnsw_config": {"m": 0}}}
+    else:
+        vectors = dense
+
+    def ok(result):
+        return {"result": result, "status": "ok", "time": search_delay}
+
+    def fake_points(limit: int):
+        return [
+            {
+                "id": str(uuid.UUID(int=i + 1)),
+                "version": 0,
+                "score": 1.0 - i / 100,
+                "payload": {
+                    "text": f"Artículo {i + 1}. Texto simulado del artículo {i + 1}.",
+                    "source": "constitucion.pdf",
+                    "doc_id": "1",
+                    "chunk_index": i,
+                    "article": i + 1,
+                },
+            }
+            for i in range(min(limit, num_results))
+        ]
+
+    @app.get("/")
+    async def root():
+        return {"title": "qdrant - vector search engine", "version": "1.15.1"}
+
+    @app.get("/collections/{name}/exists")
+    async def exists(name: str):
+        return ok({"exists": True})
+
+    @app.get("/collections/{name}")
+    async def get_collection(name: str):
+        points = app.state.upserts["points"]
+        return ok({
+            "status": "green",
+            "optimizer_status": "ok",
+            "segments_count": 1,
+            "points_count": points,
+            "indexed_vectors_count": points,
+            "config": {
+                "params": {"vectors": vectors, "sparse_vectors": {"bm25": {"modifier": "idf"}} if hybrid else None},
+                "hnsw_config": {"m": 16, "ef_construct": 100, "full_scan_threshold": 10000},
+                "optimizer_config": {
+                    "deleted_threshold": 0.2, "vacuum_min_vector_number": 1000,
+                    "default_segment_number": 0, "flush_interval_sec": 5,
+                },
+                "quantization_config": None,
+            },
+            "payload_schema": {
+                field: {"data_type": schema, "points": points} for field, schema in app.state.indexes.items()
+            },
+        })
+
+    @app.put("/collections/{name}/index")
+    async def create_index(name: str, request: Request):
+        body = await request.json()
+        schema = body.get("field_schema")
+        app.state.indexes[body["field_name"]] = schema.get("type") if isinstance(schema, dict) else schema
+        return ok({"operation_id": 0, "status": "acknowledged"})
+
+    @app.post("/collections/{name}/points/search")
+    async def search(name: str, request: Request):
+        body = await request.json()
+        await asyncio.sleep(search_delay)
+        return ok(fake_points(body.get("limit", 10)))
+
+    @app.post("/collections/{name}/points/query")
+    async def query(name: str, request: Request):
+        body = await request.json()
+        await asyncio.sleep(search_delay)
+        return ok({"points": fake_points(body.get("limit", 10))})
+
+    @app.post("/collections/{name}/points/query/batch")
+    async def query_batch(name: str, request: Request):
+        body = await request.json()
+        await asyncio.sleep(search_delay)
+        return ok([{"points": fake_points(search.get("limit", 10))} for search in body["searches"]])
+
+    @app.put("/collections/{name}/points")
+    async def upsert(name: str, request: Request):
+        body = await request.json()
+        await asyncio.sleep(upsert_delay)
+        if app.state.upserts["first_at"] is None:
+            app.state.upserts["first_at"] = time.time()
+        app.state.upserts["requests"] += 1
+        app.state.upserts["points"] += len(body.get("points", []))
+        return ok({"operation_id": app.state.upserts["requests"], "status": "completed"})
+
+    @app.post("/collections/{name}/points/scroll")
+    async def scroll(name: str):
+        return ok({"points": [], "next_page_offset": None})
+
+    @app.post("/collections/{name}/points/count")
+    async def count(name: str):
+        return ok({"count": 0})
+
+    @app.post("/collections/{name}/facet")
+    async def facet(name: str):
+        return ok({"hits": [{"value": "1", "count": num_results}]})
+
+    @app.post("/collections/{name}/points/delete")
+    async def delete(name: str):
+        return ok({"operation_id": 0, "status": "completed"})
+
+    return app
+
+
+class StubServer:
+    """Levanta una app ASGI con uvicorn en un hilo aparte"""
+
+    def __init__(self, app: FastAPI, port: int | None = None):
+        self.app = app
+        self.port = port or free_port()
+        self.server = uvicorn.Server(
+            uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning", log_config=None, backlog=4096)
+        )
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self) -> "StubServer":
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
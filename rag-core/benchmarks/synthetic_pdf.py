@@ -0,0 +1,51 @@
+"""
+Genera PDFs de prueba con artículos numerados ("Artículo N. ...") sin dependencias externas,
+para medir la ingesta con documentos del tamaño de una Gaceta completa.
+"""
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_synthetic_pdf(path: str, pages: int, articles_per_page: int = 4, lines_per_article: int = 12) -> None:
+    """PDF de `pages` páginas con texto Helvetica (WinAnsi), legible por pypdf"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # árbol de páginas, se completa al final
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    page_refs = []
+    article = 1
+    for _ in range(pages):
+        lines = []
+        for _ in range(articles_per_page):
+            lines.append(f"Artículo {article}. Disposición de prueba número {article} de la norma.")
+            lines.extend(
+                f"Texto del artículo {article}, párrafo {n}: toda persona tiene derecho a la vida y a la integridad."
+                for n in range(lines_per_article)
+            )
+            article += 1
+        body = "BT /F1 8 Tf 10 TL 30 810 Td " + " ".join(f"({_escape(line)}) Tj T*" for line in lines) + " ET"
+        stream = body.encode("cp1252")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref
+        )
+        page_refs.append(len(objects))
+    kids = " ".join(f"{ref} 0 R" for ref in page_refs)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_refs)} >>".encode()
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, obj in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n" % number + obj + b"\nendobj\n")
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
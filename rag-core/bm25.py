@@ -0,0 +1,66 @@
+# vectores dispersos (léxicos) para la búsqueda híbrida BM25 + embeddings
+import os
+import re
+import unicodedata
+import zlib
+from collections import Counter
+from typing import List, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# parámetros de BM25: saturación de la frecuencia (k1) y normalización por largo (b) respecto
+# del largo medio de un fragmento, en términos
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+BM25_AVG_DOC_LEN = float(os.getenv("BM25_AVG_DOC_LEN", "150"))
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a al algo algunas algunos ante antes como con contra cual cuando de del desde donde durante e el
+ella ellas ellos en entre era es esa esas ese eso esos esta estas este esto estos fue ha hay la las
+le les lo los mas me mi mucho muy nada ni no nos o otra otras otro otros para pero poco por porque
+que quien quienes se ser si sin sobre son su sus tambien tanto te todo todos tu un una uno unos y ya
+""".split())
+
+SparseTerms = Tuple[List[int], List[float]]
+
+
+def tokenize(text: str) -> List[str]:
+    """Minúsculas sin tildes, palabras y números; sin palabras vacías"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [token for token in TOKEN_PATTERN.findall(text) if token not in STOPWORDS]
+
+
+def term_id(token: str) -> int:
+    # índice estable del término en el vector disperso (Qdrant admite índices uint32)
+    return zlib.crc32(token.encode("utf-8"))
+
+
+def _to_sparse(weights: dict) -> SparseTerms:
+    items = sorted(weights.items())
+    return [index for index, _ in items], [value for _, value in items]
+
+
+def encode_document(text: str) -> SparseTerms:
+    """
+    Vector disperso de un fragmento: la parte de frecuencia de BM25 (con saturación y
+    normalización por largo). El IDF lo aplica Qdrant al buscar (Modifier.IDF), con las
+    estadísticas de toda la colección, así que no hace falta recalcular nada al ingestar.
+    """
+    counts = Counter(tokenize(text))
+    length = sum(counts.values())
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / BM25_AVG_DOC_LEN)
+    weights: dict = {}
+    for token, tf in counts.items():
+        index = term_id(token)
+        weights[index] = weights.get(index, 0.0) + tf * (BM25_K1 + 1) / (tf + norm)
+    return _to_sparse(weights)
+
+
+def encode_query(text: str) -> SparseTerms:
+    """Vector disperso de una consulta: peso 1 por término distinto"""
+    return _to_sparse({term_id(token): 1.0 for token in set(tokenize(text))})
@@ -0,0 +1,133 @@
+# armado del contexto del prompt: sin duplicados, con vecinos unidos y dentro de un presupuesto de tokens
+import os
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from bm25 import tokenize
+from data_loader import count_tokens, truncate_tokens
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# largo de los shingles (secuencias de palabras) con que se comparan los fragmentos
+SHINGLE_SIZE = 5
+# mínimo de caracteres compartidos para unir dos fragmentos vecinos por su solapamiento
+MIN_OVERLAP_CHARS = 40
+
+
+def _shingles(text: str) -> set:
+    words = tokenize(text)
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def merge_overlap(first: str, second: str) -> str:
+    """
+    Une dos fragmentos consecutivos quitando el texto repetido: el SentenceSplitter
+    deja ~150 tokens de solapamiento entre las partes de un artículo largo.
+    """
+    probe = second[:MIN_OVERLAP_CHARS]
+    start = first.rfind(probe, max(0, len(first) - len(second) - MIN_OVERLAP_CHARS)) if len(probe) == MIN_OVERLAP_CHARS else -1
+    if start >= 0 and second.startswith(first[start:]):
+        return first + second[len(first) - start:]
+    return f"{first}\n{second}"
+
+
+class ContextPacker:
+    """
+    Arma los contextos del prompt a partir de los hits ordenados por relevancia:
+
+    1. descarta los casi duplicados: si la mayoría de los shingles de un fragmento ya están en
+       un bloque elegido (solapamientos, el mismo pasaje en varias ediciones de un código)
+       se omite (CONTEXT_DEDUP_THRESHOLD);
+    2. une vecinos del mismo documento (chunk_index consecutivo) en un solo bloque, sin el
+       texto solapado;
+    3. llena CONTEXT_MAX_TOKENS en orden de relevancia: un bloque o una unión que no entra en
+       lo que queda del presupuesto se omite, y el primer bloque entra siempre, recortado si
+       solo él ya lo supera.
+
+    Cada llamada informa los tokens de contexto antes y después y cuántos se ahorraron.
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None, dedup_threshold: Optional[float] = None):
+        self.max_tokens = max_tokens or int(os.getenv("CONTEXT_MAX_TOKENS", "4000"))
+        self.dedup_threshold = dedup_threshold or float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+        self.stats = {"queries": 0, "tokens_before": 0, "tokens_after": 0, "duplicates": 0, "merged": 0,
+                      "over_budget": 0, "truncated": 0}
+
+    def pack(self, hits: List[Dict]) -> Tuple[List[str], Dict]:
+        """Devuelve (contextos, reporte) para los hits de una consulta"""
+        blocks: List[Dict] = []
+        report = {"chunks": len(hits), "duplicates": 0, "merged": 0, "over_budget": 0, "truncated": 0}
+        used = 0
+        for hit in hits:
+            shingles = _shingles(hit["text"])
+            if any(len(shingles & block["shingles"]) >= self.dedup_threshold * len(shingles) for block in blocks):
+                report["duplicates"] += 1
+                continue
+            index = hit.get("chunk_index")
+            neighbour = next((
+                block for block in blocks
+                if index is not None and block["first"] is not None and block["doc_id"] == hit.get("doc_id")
+                and index in (block["first"] - 1, block["last"] + 1)
+            ), None)
+            if neighbour is not None:
+                if index == neighbour["last"] + 1:
+                    text = merge_overlap(neighbour["text"], hit["text"])
+                else:
+                    text = merge_overlap(hit["text"], neighbour["text"])
+                tokens = count_tokens(text)
+                # el bloque unido también tiene que entrar en lo que queda del presupuesto
+                if used - neighbour["tokens"] + tokens > self.max_tokens:
+                    report["over_budget"] += 1
+                    continue
+                used += tokens - neighbour["tokens"]
+                neighbour.update(text=text, tokens=tokens)
+                if index == neighbour["last"] + 1:
+                    neighbour["last"] = index
+                else:
+                    neighbour["first"] = index
+                neighbour["shingles"] |= shingles
+                report["merged"] += 1
+                continue
+
+            text, tokens = hit["text"], count_tokens(hit["text"])
+            if used + tokens > self.max_tokens:
+                if blocks:
+                    report["over_budget"] += 1
+                    continue
+                # el primer bloque (el más relevante) entra siempre, recortado al presupuesto
+                text = truncate_tokens(text, self.max_tokens)
+                tokens = count_tokens(text)
+                report["truncated"] += 1
+            blocks.append({"doc_id": hit.get("doc_id"), "first": index, "last": index,
+                           "text": text, "tokens": tokens, "shingles": shingles})
+            used += tokens
+
+        contexts = [block["text"] for block in blocks]
+        report["tokens_before"] = sum(count_tokens(hit["text"]) for hit in hits)
+        report["tokens_after"] = used
+        report["tokens_saved"] = report["tokens_before"] - used
+        report["contexts"] = len(contexts)
+
+        self.stats["queries"] += 1
+        for key in ("tokens_before", "tokens_after", "duplicates", "merged", "over_budget", "truncated"):
+            self.stats[key] += report[key]
+        if report["tokens_saved"]:
+            logger.info(f"Contexto: {report}")
+        return contexts, report
+
+    def get_stats(self) -> Dict:
+        queries = self.stats["queries"]
+        saved = self.stats["tokens_before"] - self.stats["tokens_after"]
+        return {
+            "max_tokens": self.max_tokens,
+            "dedup_threshold": self.dedup_threshold,
+            **self.stats,
+            "tokens_saved": saved,
+            "avg_tokens_saved": round(saved / queries, 1) if queries else None,
+        }
@@ -1,19 +1,51 @@
 # creación de los vectores
-from openai import OpenAI
-from llama_index.readers.file import PDFReader
+from openai import AsyncOpenAI, OpenAI, APIConnectionError, APIStatusError
+from pypdf import PdfReader
 from llama_index.core.node_parser import SentenceSplitter
 from dotenv import load_dotenv
+import asyncio
+import logging
+import os
+import random
 import re
+import time
+from typing import Iterable, Iterator
+
+from embedding_cache import EmbeddingCache
+from metrics import OPENAI_SECONDS, record_usage, timed
 
 # cargar variables de entorno definidas en el archivo .env
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # inicialización del cliente de OpenAI para el uso de modelos de lenguaje y embeddings
-client = OpenAI()
+# (los reintentos de embeddings los maneja este módulo, con backoff por lote)
+client = OpenAI(max_retries=0)
+# cliente asíncrono (no bloquea el event loop de uvicorn)
+aclient = AsyncOpenAI(max_retries=0)
 
 # definición del modelo de embeddings y de la dimensión de los vectores resultantes
+# (text-embedding-3 acepta dimensiones reducidas, p. ej. 256/512/1024, a menor costo de almacenamiento y búsqueda)
 EMBED_MODEL = "text-embedding-3-large"
-EMBED_DIM = 3072
+EMBED_DIM = int(os.getenv("EMBED_DIM", "3072"))
+
+# caché persistente de embeddings (evita re-embeber fragmentos sin cambios al re-ingestar)
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+embedding_cache = EmbeddingCache()
+
+# lotes de embeddings: presupuesto de tokens y de entradas por request, lotes en paralelo y reintentos
+EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", "100000"))
+EMBED_BATCH_MAX_INPUTS = int(os.getenv("EMBED_BATCH_MAX_INPUTS", "256"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    # sin tiktoken (o sin acceso para descargar el vocabulario) se estima por caracteres
+    _encoding = None
 
 # configuración del divisor de texto: fragmentos más pequeños para PDFs grandes
 # Reducido para evitar payloads muy grandes en Qdrant
@@ -35,53 +67,250 @@ def clean_text(text: str) -> str:
     return text.strip()
 
 
-def load_and_chunk_pdf(path: str):
-    # carga un archivo PDF desde la ruta indicada, extrae su contenido textual y lo divide en fragmentos adecuados.
-    docs = PDFReader().load_data(file=path)
-    full_text = "\n".join([d.text for d in docs if getattr(d, "text", None)])
-    cleaned_text = clean_text(full_text)
+# inicio de artículo usado para fragmentar ("Artículo X.")
+ARTICLE_PATTERN = re.compile(r"(?i)Artículo\s+\d+[\.\s]")
+# texto máximo que se retiene sin encontrar un nuevo artículo antes de fragmentarlo con el splitter normal
+STREAM_BUFFER_CHARS = int(os.getenv("INGEST_STREAM_BUFFER_CHARS", "20000"))
 
-    # FRAGMENTACIÓN BASADA EN ARTÍCULOS
-    # Buscamos patrones de "Artículo X." para dividir
-    article_pattern = r"(?i)Artículo\s+\d+[\.\s]"
-    
-    # Encontrar todos los inicios de artículo
-    split_points = [m.start() for m in re.finditer(article_pattern, cleaned_text)]
-    
-    if not split_points:
+
+def iter_pdf_pages(path: str) -> Iterator[str]:
+    # recorre el PDF página por página y devuelve el texto limpio de cada una, sin juntar todo el documento
+    reader = PdfReader(path)
+    for page in reader.pages:
+        yield clean_text(page.extract_text() or "")
+
+
+def _split_article(text: str) -> list[str]:
+    # Si el fragmento es demasiado largo (> 1500 chars), lo dividimos con el splitter normal
+    text = text.strip()
+    if not text:
+        return []
+    if len(text) > 1500:
+        return splitter.split_text(text)
+    return [text]
+
+
+def iter_chunks(pages: Iterable[str], path: str = "") -> Iterator[str]:
+    # FRAGMENTACIÓN BASADA EN ARTÍCULOS, en streaming:
+    # el texto de cada página se agrega a un buffer y se emiten los artículos ya cerrados
+    # (los que tienen después el inicio de otro); el último queda pendiente hasta la siguiente página.
+    buffer = ""
+    seen_article = False
+    count = 0
+
+    for page_text in pages:
+        if not page_text:
+            continue
+        buffer = f"{buffer}\n{page_text}" if buffer else page_text
+
+        # Encontrar todos los inicios de artículo
+        split_points = [m.start() for m in ARTICLE_PATTERN.finditer(buffer)]
+        if split_points:
+            head = buffer[:split_points[0]]
+            if not seen_article:
+                # El primer fragmento antes del primer artículo (Preámbulo/Títulos)
+                pieces = [head.strip()] if head.strip() else []
+            else:
+                # continuación del artículo anterior que se partió por tamaño
+                pieces = _split_article(head)
+            for start, end in zip(split_points, split_points[1:]):
+                pieces.extend(_split_article(buffer[start:end]))
+            for piece in pieces:
+                count += 1
+                yield piece
+            buffer = buffer[split_points[-1]:]
+            seen_article = True
+
+        # un artículo (o un documento sin artículos) muy largo no se retiene completo en memoria
+        if len(buffer) > STREAM_BUFFER_CHARS:
+            pieces = splitter.split_text(buffer)
+            for piece in pieces[:-1]:
+                count += 1
+                yield piece
+            buffer = pieces[-1] if pieces else ""
+
+    if seen_article:
+        for piece in _split_article(buffer):
+            count += 1
+            yield piece
+        print(f"Extracted {count} chunks using Article-Regex from {path}")
+    else:
         # Si no hay artículos detectados, usamos el splitter normal
         print(f"No articles detected in {path}, using standard splitting.")
-        return splitter.split_text(cleaned_text)
-
-    chunks = []
-    # El primer fragmento antes del primer artículo (Preámbulo/Títulos)
-    if split_points[0] > 0:
-        chunks.append(cleaned_text[:split_points[0]].strip())
-
-    for i in range(len(split_points)):
-        start = split_points[i]
-        end = split_points[i+1] if i+1 < len(split_points) else len(cleaned_text)
-        chunk_text = cleaned_text[start:end].strip()
-        
-        # Si el fragmento es demasiado largo (> 1500 chars), lo dividimos con el splitter normal
-        if len(chunk_text) > 1500:
-            sub_chunks = splitter.split_text(chunk_text)
-            chunks.extend(sub_chunks)
-        else:
-            chunks.append(chunk_text)
-
-    # retorno de la lista de fragmentos resultantes
-    print(f"Extracted {len(chunks)} chunks using Article-Regex from {path}")
-    return chunks
-
-
-def embed_texts(texts: list[str]) -> list[list[float]]:
+        if buffer.strip():
+            yield from splitter.split_text(buffer)
+
+
+def load_and_chunk_pdf(path: str):
+    # carga un archivo PDF desde la ruta indicada, extrae su contenido textual y lo divide en fragmentos adecuados.
+    return list(iter_chunks(iter_pdf_pages(path), path))
+
+
+def count_tokens(text: str) -> int:
+    # tokens según el tokenizer del modelo de embeddings; si tiktoken no está disponible se estima
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 3 + 1
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    # recorta el texto a max_tokens (misma medida que count_tokens)
+    if _encoding is not None:
+        tokens = _encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else _encoding.decode(tokens[:max_tokens])
+    return text[:max(0, max_tokens - 1) * 3]
+
+
+def split_batches(texts: list[str]) -> list[list[int]]:
+    # agrupa los índices de los textos en lotes que respetan el presupuesto de tokens y de entradas por request
+    batches, current, current_tokens = [], [], 0
+    for i, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if current and (current_tokens + tokens > EMBED_BATCH_MAX_TOKENS or len(current) >= EMBED_BATCH_MAX_INPUTS):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def iter_batches(texts: Iterable[str]) -> Iterator[list[str]]:
+    # versión en streaming de split_batches: arma los lotes a medida que llegan los textos
+    current, current_tokens = [], 0
+    for text in texts:
+        tokens = count_tokens(text)
+        if current and (current_tokens + tokens > EMBED_BATCH_MAX_TOKENS or len(current) >= EMBED_BATCH_MAX_INPUTS):
+            yield current
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        yield current
+
+
+def _retry_delay(error: Exception, attempt: int) -> float | None:
+    # devuelve cuánto esperar antes de reintentar, o None si el error no es reintentable (solo 429/5xx/red)
+    if isinstance(error, APIStatusError) and error.status_code != 429 and error.status_code < 500:
+        return None
+    if not isinstance(error, (APIStatusError, APIConnectionError)):
+        return None
+    if attempt >= EMBED_MAX_RETRIES:
+        return None
+    retry_after = None
+    if isinstance(error, APIStatusError):
+        retry_after = error.response.headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return min(30.0, 0.5 * 2 ** attempt) + random.uniform(0, 0.25)
+
+
+def _lookup_cached(texts: list[str]):
+    # busca en la caché persistente los vectores ya calculados; devuelve (claves, vectores, textos faltantes)
+    keys = [EmbeddingCache.key(EMBED_MODEL, t, EMBED_DIM) for t in texts]
+    vectors = embedding_cache.get_many(keys) if EMBEDDING_CACHE_ENABLED else {}
+    missing = list(dict.fromkeys(t for t, k in zip(texts, keys) if k not in vectors))
+    return keys, vectors, missing
+
+
+def _store_new(missing: list[str], new_vectors: list[list[float]], vectors: dict):
+    new_items = {EmbeddingCache.key(EMBED_MODEL, t, EMBED_DIM): v for t, v in zip(missing, new_vectors)}
+    if EMBEDDING_CACHE_ENABLED and new_items:
+        embedding_cache.put_many(new_items)
+    vectors.update(new_items)
+
+
+def _finish_stats(stats: dict | None, total: int, missing: int, batches: int, retries: int, started: float):
+    call_stats = embedding_cache.record(hits=total - missing, misses=missing)
+    elapsed = time.perf_counter() - started
+    call_stats.update({
+        "batches": batches,
+        "retries": retries,
+        "elapsed_s": round(elapsed, 3),
+        "chunks_per_s": round(total / elapsed, 1) if elapsed > 0 else None,
+    })
+    if stats is not None:
+        stats.update(call_stats)
+    return call_stats
+
+
+def embed_texts(texts: list[str], stats: dict | None = None) -> list[list[float]]:
     # genera los embeddings correspondientes a una lista de fragmentos de texto utilizando el modelo de OpenAI especificado.
-    # solicitud al modelo de OpenAI para generar embeddings del texto proporcionado
-    response = client.embeddings.create(
-        model=EMBED_MODEL,
-        input=texts,
-    )
-
-    # extracción y retorno de los vectores de embeddings generados
-    return [item.embedding for item in response.data]
+    # solo se envían a OpenAI los textos que no estén en la caché, en lotes secuenciales limitados por tokens.
+    started = time.perf_counter()
+    keys, vectors, missing = _lookup_cached(texts)
+    batches = split_batches(missing)
+    retries = 0
+
+    for batch in batches:
+        inputs = [missing[i] for i in batch]
+        attempt = 0
+        with timed(OPENAI_SECONDS, "embeddings"):
+            while True:
+                try:
+                    # solicitud al modelo de OpenAI para generar embeddings del texto proporcionado
+                    response = client.embeddings.create(model=EMBED_MODEL, input=inputs, dimensions=EMBED_DIM)
+                    break
+                except Exception as e:
+                    delay = _retry_delay(e, attempt)
+                    if delay is None:
+                        raise
+                    attempt += 1
+                    retries += 1
+                    time.sleep(delay)
+        record_usage(EMBED_MODEL, response.usage)
+        _store_new(inputs, [item.embedding for item in response.data], vectors)
+
+    _finish_stats(stats, len(texts), len(missing), len(batches), retries, started)
+
+    # retorno de los vectores en el mismo orden que los textos
+    return [vectors[k] for k in keys]
+
+
+async def aembed_texts(texts: list[str], stats: dict | None = None, on_progress=None) -> list[list[float]]:
+    # versión asíncrona de embed_texts: los lotes se envían en paralelo (hasta EMBED_CONCURRENCY a la vez),
+    # con reintentos ante 429/5xx, y el resultado conserva el orden de entrada.
+    # on_progress(listos, total) se llama al terminar cada lote (los textos en caché cuentan como listos).
+    started = time.perf_counter()
+    # la caché es SQLite en disco: sus lecturas y escrituras van a un hilo para no bloquear el event loop
+    keys, vectors, missing = await asyncio.to_thread(_lookup_cached, texts)
+    batches = split_batches(missing)
+    semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+    retries = 0
+    done = 0
+
+    async def embed_batch(batch: list[int]):
+        nonlocal retries, done
+        inputs = [missing[i] for i in batch]
+        attempt = 0
+        async with semaphore:
+            with timed(OPENAI_SECONDS, "embeddings"):
+                while True:
+                    try:
+                        response = await aclient.embeddings.create(model=EMBED_MODEL, input=inputs, dimensions=EMBED_DIM)
+                        break
+                    except Exception as e:
+                        delay = _retry_delay(e, attempt)
+                        if delay is None:
+                            raise
+                        attempt += 1
+                        retries += 1
+                        logger.warning(f"Reintento {attempt} de lote de embeddings en {delay:.1f}s: {e}")
+                        await asyncio.sleep(delay)
+        record_usage(EMBED_MODEL, response.usage)
+        await asyncio.to_thread(_store_new, inputs, [item.embedding for item in response.data], vectors)
+        if on_progress is not None:
+            done += len(inputs)
+            on_progress(len(texts) - len(missing) + done, len(texts))
+
+    await asyncio.gather(*(embed_batch(b) for b in batches))
+
+    call_stats = _finish_stats(stats, len(texts), len(missing), len(batches), retries, started)
+    if len(texts) > 1:
+        logger.info(f"Embeddings de {len(texts)} textos: {call_stats}")
+
+    return [vectors[k] for k in keys]
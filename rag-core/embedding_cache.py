@@ -0,0 +1,155 @@
+# caché persistente de embeddings, direccionada por contenido
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from answer_cache import cache_dir
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# cada cuánto (segundos) se aplican el TTL y el límite de entradas al escribir
+PRUNE_INTERVAL_SECONDS = 600
+# un acierto solo reescribe last_used_at si el anterior es más viejo que esto (evita una escritura por consulta)
+TOUCH_INTERVAL_SECONDS = 3600
+
+
+class EmbeddingCache:
+    """
+    Guarda en SQLite (CACHE_DIR/embeddings.sqlite) el vector de cada texto ya embebido,
+    con clave sha256(modelo, dimensión, texto) y el vector como float32.
+
+    Al re-ingestar un PDF casi igual (p. ej. una nueva edición de la Gaceta del mismo código)
+    solo los fragmentos nuevos o modificados llegan a la API de embeddings.
+    El archivo es compartido por todos los workers del servicio.
+
+    Para que no crezca sin límite, al escribir se borran las entradas que no se usan hace más
+    de EMBEDDING_CACHE_TTL_DAYS días y, si se supera EMBEDDING_CACHE_MAX_ENTRIES, las usadas
+    hace más tiempo (LRU por last_used_at, que actualizan los aciertos; 0 desactiva cada límite).
+    """
+
+    def __init__(self, db_path: Optional[str] = None, max_entries: Optional[int] = None,
+                 ttl_days: Optional[float] = None):
+        self.db_path = db_path or str(cache_dir() / "embeddings.sqlite")
+        self.max_entries = max_entries if max_entries is not None else int(
+            os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+        self.ttl_days = ttl_days if ttl_days is not None else float(os.getenv("EMBEDDING_CACHE_TTL_DAYS", "90"))
+        self.stats = {"hits": 0, "misses": 0, "pruned": 0}
+        self._last_prune = 0.0
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        # La conexión no debe cruzar un fork
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vector BLOB NOT NULL, created_at REAL NOT NULL,"
+                " last_used_at REAL NOT NULL DEFAULT 0)"
+            )
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(embeddings)")}
+            if "last_used_at" not in columns:
+                # archivos creados antes de la columna: se toma created_at como último uso
+                try:
+                    self._db.execute("ALTER TABLE embeddings ADD COLUMN last_used_at REAL NOT NULL DEFAULT 0")
+                    self._db.execute("UPDATE embeddings SET last_used_at = created_at")
+                except sqlite3.OperationalError as e:
+                    # otro worker pudo agregarla primero
+                    if "duplicate column" not in str(e):
+                        raise
+            self._db.execute("DROP INDEX IF EXISTS embeddings_created_at")
+            self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used_at ON embeddings (last_used_at)")
+            self._db_pid = os.getpid()
+        return self._db
+
+    @staticmethod
+    def key(model: str, text: str, dim: Optional[int] = None) -> str:
+        return hashlib.sha256(f"{model}\x00{dim or ''}\x00{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        stale = []
+        unique = list(dict.fromkeys(keys))
+        now = time.time()
+        with self._lock:
+            conn = self._conn()
+            # SQLite limita la cantidad de parámetros por consulta
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                placeholders = ",".join("?" for _ in batch)
+                rows = conn.execute(
+                    f"SELECT key, vector, last_used_at FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob, last_used_at in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+                    if now - last_used_at >= TOUCH_INTERVAL_SECONDS:
+                        stale.append((now, key))
+            if stale:
+                conn.executemany("UPDATE embeddings SET last_used_at = ? WHERE key = ?", stale)
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        now = time.time()
+        rows = [
+            (key, len(vec), np.asarray(vec, dtype=np.float32).tobytes(), now, now)
+            for key, vec in items.items()
+        ]
+        with self._lock:
+            self._conn().executemany(
+                "INSERT OR REPLACE INTO embeddings (key, dim, vector, created_at, last_used_at)"
+                " VALUES (?, ?, ?, ?, ?)", rows
+            )
+            if now - self._last_prune >= PRUNE_INTERVAL_SECONDS:
+                self._last_prune = now
+                self._prune(now)
+
+    def _prune(self, now: float) -> int:
+        # borra las entradas sin uso reciente y, por encima del límite, las usadas hace más tiempo (con el lock tomado)
+        conn = self._conn()
+        pruned = 0
+        if self.ttl_days > 0:
+            pruned += conn.execute(
+                "DELETE FROM embeddings WHERE last_used_at < ?", (now - self.ttl_days * 86400,)
+            ).rowcount
+        if self.max_entries > 0:
+            excess = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+            if excess > 0:
+                pruned += conn.execute(
+                    "DELETE FROM embeddings WHERE key IN"
+                    " (SELECT key FROM embeddings ORDER BY last_used_at LIMIT ?)", (excess,)
+                ).rowcount
+        if pruned:
+            self.stats["pruned"] += pruned
+            logger.info(f"Caché de embeddings: {pruned} entradas eliminadas por TTL/límite")
+        return pruned
+
+    def record(self, hits: int, misses: int) -> Dict:
+        """Acumula estadísticas globales y devuelve las de esta llamada"""
+        self.stats["hits"] += hits
+        self.stats["misses"] += misses
+        total = hits + misses
+        return {"hits": hits, "misses": misses, "hit_ratio": round(hits / total, 4) if total else None}
+
+    def get_stats(self) -> Dict:
+        total = self.stats["hits"] + self.stats["misses"]
+        with self._lock:
+            entries = self._conn().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {
+            "pid": os.getpid(),
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_days": self.ttl_days,
+            "hit_ratio": round(self.stats["hits"] / total, 4) if total else None,
+            **self.stats,
+        }
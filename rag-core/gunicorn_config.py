@@ -29,6 +29,26 @@ proc_name = "rag-python"
 # Preload app (carga la app antes de hacer fork, ahorra memoria)
 preload_app = True
 
+# Métricas de Prometheus compartidas por los workers (metrics.py): cada worker escribe sus
+# valores en este directorio y GET /metrics los suma. Debe definirse antes de cargar la app.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/rag-metrics")
+
+
+def on_starting(server):
+    import metrics
+    metrics.reset_multiprocess_dir()
+
+
+def child_exit(server, worker):
+    import metrics
+    metrics.mark_worker_dead(worker.pid)
+
+# El cliente de Qdrant se crea en cada worker (lifespan de FastAPI); por si el
+# proceso maestro llegó a crearlo, se descarta la instancia heredada tras el fork.
+def post_fork(server, worker):
+    import vector_db
+    vector_db.reset_storage()
+
 # Graceful timeout
 graceful_timeout = 30
 
@@ -0,0 +1,113 @@
+# comparación de fragmentos para la re-ingesta incremental de un documento
+import hashlib
+import re
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+# encabezado de artículo al inicio de un fragmento ("Artículo 12.")
+ARTICLE_HEADING = re.compile(r"(?i)^\s*Art[ií]culo\s+(\d+)")
+CHUNK_KEY = re.compile(r"^art(\d+)#(\d+)$")
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def article_fields(chunk_key: str) -> Dict:
+    """
+    Campos de payload para buscar un artículo sin embeddings: número de artículo y parte
+    (los artículos de más de 1500 caracteres se parten en varios fragmentos). None para el
+    texto anterior al primer artículo.
+    """
+    match = CHUNK_KEY.match(chunk_key)
+    if match is None:
+        return {"article": None, "article_part": None}
+    return {"article": int(match.group(1)), "article_part": int(match.group(2))}
+
+
+class ChunkDiff:
+    """
+    Clasifica los fragmentos nuevos de un documento contra los puntos ya guardados en Qdrant.
+
+    Cada fragmento recibe una clave estable (chunk_key) según el artículo al que pertenece y
+    el orden de aparición: "art12#0", "art12#1" si el artículo se partió en dos, "pre#0" para
+    el texto anterior al primer artículo. Así, insertar un artículo no cambia la clave de los
+    demás. Con la clave y el hash del texto:
+
+    - added:     clave nueva
+    - updated:   misma clave, distinto hash (el punto viejo se reemplaza por uno nuevo)
+    - unchanged: misma clave y mismo hash (no se re-embebe ni se re-sube)
+    - removed:   claves guardadas que ya no aparecen
+
+    Los puntos sin chunk_key (ingestados antes de este modo) y los que quedaron en staging por
+    una ingesta interrumpida se descartan al publicar. Los fragmentos deben pasar por
+    classify() en orden.
+    """
+
+    def __init__(self, doc_id: str, doc_version: str, stored: Dict[str, Dict]):
+        self.doc_id = doc_id
+        self.doc_version = doc_version
+        self.stored_by_key: Dict[str, Tuple[str, Dict]] = {}
+        self.stale: set = set()
+        for point_id, payload in stored.items():
+            key = payload.get("chunk_key")
+            if key is None or payload.get("staging") or key in self.stored_by_key:
+                self.stale.add(point_id)
+            else:
+                self.stored_by_key[key] = (point_id, payload)
+
+        self.counts = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0}
+        self.identities: Dict[int, Tuple[str, str]] = {}
+        # payload a corregir en fragmentos sin cambios (chunk_index desplazado, campos nuevos)
+        self.point_updates: Dict[str, Dict] = {}
+        self.replaced: List[str] = []
+        self.new_ids: set = set()
+        self._seen_keys: set = set()
+        self._article = "pre"
+        self._occurrences: Dict[str, int] = defaultdict(int)
+
+    def point_id(self, key: str, digest: str) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{self.doc_id}:v{self.doc_version}:{key}:{digest}"))
+
+    def classify(self, index: int, text: str) -> bool:
+        """Registra el fragmento y devuelve True si hay que embeberlo y subirlo"""
+        heading = ARTICLE_HEADING.match(text)
+        if heading:
+            self._article = f"art{heading.group(1)}"
+        key = f"{self._article}#{self._occurrences[self._article]}"
+        self._occurrences[self._article] += 1
+        digest = content_hash(text)
+        self.identities[index] = (key, digest)
+        self._seen_keys.add(key)
+
+        stored = self.stored_by_key.get(key)
+        if stored is None:
+            self.counts["added"] += 1
+        elif stored[1].get("content_hash") == digest:
+            self.counts["unchanged"] += 1
+            updates = {}
+            if stored[1].get("chunk_index") != index:
+                updates["chunk_index"] = index
+            if "article" not in stored[1]:
+                # puntos ingestados antes de guardar el número de artículo
+                updates.update(article_fields(key))
+            if updates:
+                self.point_updates[stored[0]] = updates
+            return False
+        else:
+            self.counts["updated"] += 1
+            self.replaced.append(stored[0])
+        self.new_ids.add(self.point_id(key, digest))
+        return True
+
+    def identity(self, index: int) -> Tuple[str, str, str]:
+        """(point_id, chunk_key, content_hash) de un fragmento ya clasificado"""
+        key, digest = self.identities[index]
+        return self.point_id(key, digest), key, digest
+
+    def delete_ids(self) -> List[str]:
+        """Puntos a borrar al publicar: reemplazados, eliminados y restos sin clave o en staging"""
+        removed = [point_id for key, (point_id, _) in self.stored_by_key.items() if key not in self._seen_keys]
+        self.counts["removed"] = len(removed)
+        return list((self.stale | set(self.replaced) | set(removed)) - self.new_ids)
@@ -0,0 +1,372 @@
+# cola de trabajos de ingesta en segundo plano
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from answer_cache import cache_dir
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# etapas que recorre un trabajo; GET /ingest-jobs/{id} muestra la actual
+STAGES = ("queued", "parse", "chunk", "embed", "upsert", "done")
+
+# report(etapa, **contadores) registra el progreso del trabajo en curso
+Reporter = Callable[..., None]
+Handler = Callable[[Dict, Reporter], Awaitable[Dict]]
+
+
+class IngestJobQueue:
+    """
+    Cola persistente de ingestas en SQLite (CACHE_DIR/ingest_jobs.sqlite), compartida por
+    todos los workers de gunicorn. Cada worker ejecuta hasta INGEST_CONCURRENCY trabajos a la
+    vez; el que encola despierta a sus propios consumidores y los demás la revisan cada
+    INGEST_POLL_INTERVAL segundos.
+
+    Idempotencia por doc_id:
+    - Nunca corren dos trabajos del mismo documento a la vez.
+    - Si ya hay un trabajo en cola para ese doc_id, se reutiliza (con la última petición).
+    - Si el mismo pedido ya se está procesando, se devuelve ese trabajo en lugar de repetirlo.
+
+    Cada trabajo en curso tiene un lease: su worker lo renueva (junto con el progreso) cada
+    pocos segundos, y si pasa INGEST_JOB_LEASE_SECONDS sin renovarse cualquier worker lo vuelve
+    a encolar al buscar trabajo (hasta INGEST_MAX_ATTEMPTS intentos). Es el único criterio para
+    dar por abandonado un trabajo: el PID del worker no sirve entre contenedores o hosts, así
+    que un worker que murió se detecta igual que uno colgado. El número de intento hace de
+    token: un worker que perdió el lease ya no puede cerrar ni actualizar el trabajo.
+
+    Las lecturas y escrituras de SQLite de los endpoints y de los consumidores se hacen en un
+    hilo (asyncio.to_thread) para no bloquear el event loop.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        concurrency: Optional[int] = None,
+        poll_interval: Optional[float] = None,
+    ):
+        self.db_path = db_path or str(cache_dir() / "ingest_jobs.sqlite")
+        self.concurrency = concurrency or int(os.getenv("INGEST_CONCURRENCY", "1"))
+        self.poll_interval = poll_interval or float(os.getenv("INGEST_POLL_INTERVAL", "1.0"))
+        self.max_attempts = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+        self.retention_seconds = float(os.getenv("INGEST_JOB_RETENTION_HOURS", "168")) * 3600
+        self.lease_seconds = float(os.getenv("INGEST_JOB_LEASE_SECONDS", "120"))
+        self.heartbeat_interval = min(2.0, self.lease_seconds / 3)
+        self.stats = {"submitted": 0, "deduplicated": 0, "completed": 0, "failed": 0, "requeued": 0,
+                      "lease_expired": 0, "lease_lost": 0}
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._running: Dict[str, asyncio.Task] = {}
+        self._progress: Dict[str, Dict] = {}  # job_id -> {"stage", "progress"} aún no guardados
+
+    def _conn(self) -> sqlite3.Connection:
+        # La conexión no debe cruzar un fork
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._db.row_factory = sqlite3.Row
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, doc_id TEXT NOT NULL, status TEXT NOT NULL, stage TEXT NOT NULL,"
+                " request TEXT NOT NULL, progress TEXT NOT NULL DEFAULT '{}', result TEXT, error TEXT,"
+                " attempts INTEGER NOT NULL DEFAULT 0, worker_pid INTEGER,"
+                " created_at REAL NOT NULL, started_at REAL, updated_at REAL NOT NULL, finished_at REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_doc_status ON jobs (doc_id, status)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+            self._db_pid = os.getpid()
+        return self._db
+
+    @staticmethod
+    def _to_dict(row: Optional[sqlite3.Row]) -> Optional[Dict]:
+        if row is None:
+            return None
+        job = dict(row)
+        job["job_id"] = job.pop("id")
+        job["request"] = json.loads(job["request"])
+        job["progress"] = json.loads(job["progress"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    # --------------------------------------------------------------------------
+    # API usada por los endpoints
+    # --------------------------------------------------------------------------
+
+    def submit(self, doc_id: str, request: Dict) -> tuple[Dict, bool]:
+        """Encola una ingesta. Devuelve (trabajo, deduplicado)"""
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                    (now - self.retention_seconds,),
+                )
+                queued = conn.execute(
+                    "SELECT id FROM jobs WHERE doc_id = ? AND status = 'queued'", (doc_id,)
+                ).fetchone()
+                running = conn.execute(
+                    "SELECT id FROM jobs WHERE doc_id = ? AND status = 'running' AND request = ?", (doc_id, payload)
+                ).fetchone()
+                if queued is not None:
+                    # la petición más reciente reemplaza a la que esperaba en cola
+                    job_id, deduplicated = queued["id"], True
+                    conn.execute("UPDATE jobs SET request = ?, updated_at = ? WHERE id = ?", (payload, now, job_id))
+                elif running is not None:
+                    job_id, deduplicated = running["id"], True
+                else:
+                    job_id, deduplicated = str(uuid.uuid4()), False
+                    conn.execute(
+                        "INSERT INTO jobs (id, doc_id, status, stage, request, created_at, updated_at)"
+                        " VALUES (?, ?, 'queued', 'queued', ?, ?, ?)",
+                        (job_id, doc_id, payload, now, now),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        self.stats["deduplicated" if deduplicated else "submitted"] += 1
+        if self._wakeup is not None:
+            # submit puede correr en un hilo (asyncio.to_thread): el evento se activa desde el loop
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return self.get(job_id), deduplicated
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row)
+
+    def list(self, doc_id: Optional[str] = None, status: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        query, params = "SELECT * FROM jobs WHERE 1 = 1", []
+        if doc_id:
+            query += " AND doc_id = ?"
+            params.append(doc_id)
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn().execute(query, params).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    async def wait(self, job_id: str, timeout: Optional[float] = None) -> Dict:
+        """Espera (sin bloquear el event loop) a que el trabajo termine"""
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            job = await asyncio.to_thread(self.get, job_id)
+            if job is None or job["status"] in ("done", "failed"):
+                return job
+            if deadline and time.monotonic() > deadline:
+                raise asyncio.TimeoutError(f"El trabajo {job_id} sigue en la etapa {job['stage']}")
+            await asyncio.sleep(min(self.poll_interval, 0.5))
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            rows = self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {
+            "pid": os.getpid(),
+            "concurrency": self.concurrency,
+            "running_here": len(self._running),
+            "jobs": {status: count for status, count in rows},
+            **self.stats,
+        }
+
+    # --------------------------------------------------------------------------
+    # Estado de cada trabajo
+    # --------------------------------------------------------------------------
+
+    def report(self, job_id: str, stage: str, **progress) -> None:
+        """
+        Registra en memoria los contadores de progreso y la etapa; el latido del trabajo los
+        guarda en SQLite. Como las etapas del pipeline se solapan, la etapa solo avanza
+        (muestra la más adelantada que ya empezó).
+        """
+        state = self._progress.get(job_id)
+        if state is None:
+            return
+        state["progress"].update(progress)
+        if STAGES.index(stage) > STAGES.index(state["stage"]):
+            state["stage"] = stage
+
+    def _heartbeat(self, job_id: str, attempt: int) -> bool:
+        """Renueva el lease y guarda el progreso; False si el trabajo ya no es de este intento"""
+        state = self._progress.get(job_id, {"stage": "queued", "progress": {}})
+        with self._lock:
+            updated = self._conn().execute(
+                "UPDATE jobs SET stage = ?, progress = ?, updated_at = ?"
+                " WHERE id = ? AND status = 'running' AND attempts = ?",
+                (state["stage"], json.dumps(state["progress"]), time.time(), job_id, attempt),
+            ).rowcount
+        return updated > 0
+
+    async def _keep_alive(self, job_id: str, attempt: int, task: asyncio.Task):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            if not await asyncio.to_thread(self._heartbeat, job_id, attempt):
+                # otro worker lo retomó (lease vencido): este intento se abandona
+                logger.warning(f"Trabajo {job_id} perdió el lease (intento {attempt}); se cancela")
+                self.stats["lease_lost"] += 1
+                task.cancel()
+                return
+
+    def _finish(self, job_id: str, status: str, result: Optional[Dict] = None, error: Optional[str] = None,
+                attempt: Optional[int] = None):
+        now = time.time()
+        # último progreso registrado en memoria (el latido pudo no alcanzar a guardarlo)
+        state = self._progress.get(job_id)
+        stage = "done" if status == "done" else (state["stage"] if state else None)
+        query = (
+            "UPDATE jobs SET status = ?, stage = COALESCE(?, stage), progress = COALESCE(?, progress),"
+            " result = ?, error = ?, finished_at = ?, updated_at = ? WHERE id = ?"
+        )
+        params = [status, stage, json.dumps(state["progress"]) if state else None,
+                  json.dumps(result, ensure_ascii=False) if result else None, error, now, now, job_id]
+        if attempt is not None:
+            query += " AND status = 'running' AND attempts = ?"
+            params.append(attempt)
+        with self._lock:
+            updated = self._conn().execute(query, params).rowcount
+        if updated:
+            self.stats["completed" if status == "done" else "failed"] += 1
+
+    def _requeue(self, job_id: str, attempt: Optional[int] = None):
+        """Devuelve el trabajo a la cola, o lo da por fallido si ya agotó INGEST_MAX_ATTEMPTS"""
+        if attempt is not None and attempt >= self.max_attempts:
+            self._finish(job_id, "failed", error="El worker se detuvo durante la ingesta demasiadas veces",
+                         attempt=attempt)
+            return
+        query = "UPDATE jobs SET status = 'queued', stage = 'queued', worker_pid = NULL, updated_at = ? WHERE id = ?"
+        params = [time.time(), job_id]
+        if attempt is not None:
+            query += " AND status = 'running' AND attempts = ?"
+            params.append(attempt)
+        with self._lock:
+            updated = self._conn().execute(query, params).rowcount
+        if updated:
+            self.stats["requeued"] += 1
+
+    def _expire_leases(self, conn: sqlite3.Connection, now: float) -> None:
+        # dentro de la transacción de _claim: re-encola (o da por fallidos) los trabajos sin latido
+        expired = conn.execute(
+            "SELECT id, worker_pid, attempts FROM jobs WHERE status = 'running' AND updated_at < ?",
+            (now - self.lease_seconds,),
+        ).fetchall()
+        for r in expired:
+            if r["attempts"] >= self.max_attempts:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, updated_at = ? WHERE id = ?",
+                    ("El trabajo perdió el lease demasiadas veces", now, now, r["id"]),
+                )
+            else:
+                logger.warning(f"Re-encolando trabajo {r['id']} sin latido (worker {r['worker_pid']})")
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', stage = 'queued', worker_pid = NULL, updated_at = ?"
+                    " WHERE id = ?", (now, r["id"]),
+                )
+        self.stats["lease_expired"] += len(expired)
+
+    def _claim(self) -> Optional[Dict]:
+        """Toma el trabajo en cola más antiguo cuyo documento no se esté procesando"""
+        now = time.time()
+        with self._lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._expire_leases(conn, now)
+                # en cola con los intentos agotados (p. ej. de versiones anteriores): no se vuelven a tomar
+                exhausted = conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, updated_at = ?"
+                    " WHERE status = 'queued' AND attempts >= ?",
+                    ("Se agotaron los intentos de la ingesta", now, now, self.max_attempts),
+                ).rowcount
+                self.stats["failed"] += exhausted
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' AND doc_id NOT IN"
+                    " (SELECT doc_id FROM jobs WHERE status = 'running') ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker_pid = ?,"
+                        " started_at = ?, updated_at = ? WHERE id = ?",
+                        (os.getpid(), now, now, row["id"]),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return self.get(row["id"]) if row is not None else None
+
+    # --------------------------------------------------------------------------
+    # Consumidores (tareas asyncio dentro de cada worker)
+    # --------------------------------------------------------------------------
+
+    async def _consume(self, handler: Handler):
+        while True:
+            job = await asyncio.to_thread(self._claim)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job_id, attempt = job["job_id"], job["attempts"]
+            self._progress[job_id] = {"stage": job["stage"], "progress": dict(job["progress"])}
+            # el handler corre en su propia tarea para que perder el lease lo cancele sin detener al consumidor
+            work = asyncio.create_task(
+                handler(job, lambda stage, **progress: self.report(job_id, stage, **progress))
+            )
+            self._running[job_id] = work
+            keep_alive = asyncio.create_task(self._keep_alive(job_id, attempt, work))
+            started = time.perf_counter()
+            logger.info(f"Procesando trabajo de ingesta {job_id} (doc_id {job['doc_id']}, intento {attempt})")
+            try:
+                result = await asyncio.shield(work)
+                await asyncio.to_thread(self._finish, job_id, "done", result, None, attempt)
+                logger.info(f"Trabajo {job_id} completado en {time.perf_counter() - started:.1f}s")
+            except asyncio.CancelledError:
+                if work.cancelled() and keep_alive.done():
+                    # lo canceló _keep_alive: el trabajo ya es de otro intento
+                    continue
+                # apagado del worker: otro worker lo retomará
+                work.cancel()
+                await asyncio.gather(work, return_exceptions=True)
+                self._requeue(job_id, attempt)
+                raise
+            except Exception as e:
+                logger.error(f"Trabajo de ingesta {job_id} falló: {e}", exc_info=True)
+                await asyncio.to_thread(self._finish, job_id, "failed", None, str(e), attempt)
+            finally:
+                keep_alive.cancel()
+                self._running.pop(job_id, None)
+                self._progress.pop(job_id, None)
+
+    def start(self, handler: Handler) -> None:
+        """Lanza los consumidores de este worker (se llama desde el lifespan de FastAPI)"""
+        self._wakeup = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._tasks = [asyncio.create_task(self._consume(handler)) for _ in range(self.concurrency)]
+        logger.info(f"Cola de ingesta iniciada con {self.concurrency} consumidor(es) en el worker {os.getpid()}")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
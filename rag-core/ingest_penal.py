@@ -23,7 +23,7 @@ def get_available_pdfs():
     return [pdf.name for pdf in pdfs]
 
 def ingest_pdf(pdf_name, doc_id, category_ids):
-    """Ingesta un PDF individual"""
+    """Encola la ingesta de un PDF individual y devuelve el job_id (o None si falló)"""
     payload = {
         "pdf_path": pdf_name,
         "doc_id": str(doc_id),
@@ -39,25 +39,48 @@ def ingest_pdf(pdf_name, doc_id, category_ids):
         print(f"{'='*60}")
         
         response = requests.post(
-            f"{RAG_URL}/ingest-pdf",
+            f"{RAG_URL}/ingest-jobs",
             json=payload,
-            timeout=300  # 5 minutos timeout
+            timeout=30  # solo encola; el procesamiento es en segundo plano
         )
         
-        if response.status_code == 200:
+        if response.status_code == 202:
             data = response.json()
-            print(f"✅ ÉXITO")
-            print(f"   Chunks creados: {data.get('chunks_created', 'N/A')}")
-            print(f"   Fecha: {data.get('upload_date', 'N/A')}")
-            return True
+            print(f"📥 EN COLA")
+            print(f"   Job ID: {data['job_id']}")
+            return data["job_id"]
         else:
             print(f"❌ ERROR: {response.status_code}")
             print(f"   Respuesta: {response.text[:200]}")
-            return False
+            return None
             
     except Exception as e:
         print(f"❌ EXCEPCIÓN: {e}")
-        return False
+        return None
+
+def wait_for_jobs(jobs, poll_interval=2):
+    """Consulta GET /ingest-jobs/{id} hasta que todos los trabajos terminen"""
+    pending = dict(jobs)
+    finished = {}
+    while pending:
+        time.sleep(poll_interval)
+        for job_id, pdf in list(pending.items()):
+            try:
+                job = requests.get(f"{RAG_URL}/ingest-jobs/{job_id}", timeout=10).json()
+            except Exception as e:
+                print(f"⚠️ No se pudo consultar {job_id}: {e}")
+                continue
+            if job["status"] in ("done", "failed"):
+                finished[job_id] = job
+                del pending[job_id]
+                if job["status"] == "done":
+                    print(f"✅ {pdf}: {job['result']['ingested']} chunks")
+                else:
+                    print(f"❌ {pdf}: {job['error']}")
+            else:
+                progress = ", ".join(f"{k}={v}" for k, v in job["progress"].items())
+                print(f"⏳ {pdf}: {job['stage']} {progress}")
+    return finished
 
 def main():
     print("\n" + "="*60)
@@ -97,23 +120,28 @@ def main():
         "total": len(pdfs_penales)
     }
     
+    jobs = {}
     for i, pdf in enumerate(pdfs_penales, start=1):
         doc_id = f"penal_{i}"
         
-        # Ingestar con categoría penal
+        # Encolar con categoría penal (el servicio limita la concurrencia por worker)
         category_ids = [CATEGORY_PENAL]
         
-        success = ingest_pdf(pdf, doc_id, category_ids)
+        job_id = ingest_pdf(pdf, doc_id, category_ids)
         
-        if success:
+        if job_id:
+            jobs[job_id] = pdf
+        else:
+            resultados["fallidos"] += 1
+    
+    print("\n" + "="*60)
+    print("PROGRESO DE LOS TRABAJOS")
+    print("="*60)
+    for job in wait_for_jobs(jobs).values():
+        if job["status"] == "done":
             resultados["exitosos"] += 1
         else:
             resultados["fallidos"] += 1
-        
-        # Pausa entre ingestas
-        if i < len(pdfs_penales):
-            print("\nEsperando 3 segundos antes del siguiente...")
-            time.sleep(3)
     
     # Resumen final
     print("\n" + "="*60)
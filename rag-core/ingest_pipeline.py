@@ -0,0 +1,135 @@
+# pipeline de ingesta en streaming: páginas → fragmentos → embeddings → Qdrant
+import asyncio
+import os
+import time
+import logging
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from data_loader import EMBED_CONCURRENCY, aembed_texts, iter_batches, iter_chunks, iter_pdf_pages
+from metrics import INGEST_STAGE_SECONDS, timed
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# lotes que pueden esperar entre una etapa y la siguiente (backpressure)
+INGEST_PIPELINE_DEPTH = int(os.getenv("INGEST_PIPELINE_DEPTH", "4"))
+
+# make_points(índices, fragmentos) -> (ids, payloads)
+PointsBuilder = Callable[[List[int], List[str]], Tuple[List[str], List[Dict]]]
+
+
+def _next_batch(batches) -> List[str] | None:
+    return next(batches, None)
+
+
+async def run_pipeline(
+    path: str,
+    store,
+    make_points: PointsBuilder,
+    report: Callable[..., None],
+    before_first_upsert: Callable[[], None] | None = None,
+    keep: Callable[[int, str], bool] | None = None,
+) -> Dict:
+    """
+    Procesa un PDF como un flujo de lotes:
+
+        parse/chunk (hilo) --cola--> embed (EMBED_CONCURRENCY lotes) --cola--> upsert (hilo)
+
+    Cada etapa registra la duración de cada lote en rag_ingest_stage_seconds (parse incluye el
+    chunking). Cada lote de fragmentos respeta el presupuesto de tokens de los embeddings. Las colas son
+    acotadas (INGEST_PIPELINE_DEPTH), así que si OpenAI o Qdrant van lentos el parseo se detiene:
+    la memoria depende del tamaño de los lotes y no del tamaño del documento, y los primeros
+    puntos llegan a Qdrant antes de terminar de leer el PDF.
+
+    before_first_upsert se ejecuta (en un hilo) justo antes del primer upsert; si el PDF no
+    produce fragmentos no se llama y se lanza ValueError.
+
+    keep(índice, fragmento) se llama en orden para cada fragmento; los que devuelven False
+    (p. ej. sin cambios en una re-ingesta incremental) no se embeben ni se suben.
+    """
+    pages_read = 0
+
+    def count_pages(pages):
+        nonlocal pages_read
+        for page in pages:
+            pages_read += 1
+            yield page
+
+    batches = iter_batches(iter_chunks(count_pages(iter_pdf_pages(path)), path))
+    embed_queue: asyncio.Queue = asyncio.Queue(maxsize=INGEST_PIPELINE_DEPTH)
+    upsert_queue: asyncio.Queue = asyncio.Queue(maxsize=INGEST_PIPELINE_DEPTH)
+    counters = {"chunks": 0, "embedded": 0, "upserted": 0}
+    embed_stats = {"hits": 0, "misses": 0, "batches": 0, "retries": 0}
+
+    async def produce():
+        while True:
+            # pypdf y las regex son CPU: se ejecutan en un hilo, un lote a la vez
+            with timed(INGEST_STAGE_SECONDS, "parse"):
+                batch = await asyncio.to_thread(_next_batch, batches)
+            if batch is None:
+                break
+            start = counters["chunks"]
+            counters["chunks"] += len(batch)
+            report("chunk", pages=pages_read, chunks=counters["chunks"])
+            items = [(start + i, text) for i, text in enumerate(batch)]
+            if keep is not None:
+                items = [(index, text) for index, text in items if keep(index, text)]
+            if items:
+                await embed_queue.put(([index for index, _ in items], [text for _, text in items]))
+        for _ in range(EMBED_CONCURRENCY):
+            await embed_queue.put(None)
+
+    async def embed():
+        while (item := await embed_queue.get()) is not None:
+            indices, texts = item
+            stats = {}
+            with timed(INGEST_STAGE_SECONDS, "embed"):
+                vectors = await aembed_texts(texts, stats=stats)
+            for key in embed_stats:
+                embed_stats[key] += stats[key]
+            counters["embedded"] += len(texts)
+            report("embed", embedded=counters["embedded"])
+            # en la cola se guardan como float32 (~8 veces menos memoria que listas de float)
+            await upsert_queue.put((indices, texts, np.asarray(vectors, dtype=np.float32)))
+
+    async def upsert():
+        first = True
+        while (item := await upsert_queue.get()) is not None:
+            indices, texts, vectors = item
+            if first and before_first_upsert is not None:
+                await asyncio.to_thread(before_first_upsert)
+            first = False
+            ids, payloads = make_points(indices, texts)
+            with timed(INGEST_STAGE_SECONDS, "upsert"):
+                await asyncio.to_thread(store.upsert, ids, vectors.tolist(), payloads)
+            counters["upserted"] += len(ids)
+            report("upsert", upserted=counters["upserted"])
+
+    started = time.perf_counter()
+    report("parse")
+    try:
+        async with asyncio.TaskGroup() as group:
+            group.create_task(produce())
+            upserter = group.create_task(upsert())
+            embedders = [group.create_task(embed()) for _ in range(EMBED_CONCURRENCY)]
+            await asyncio.gather(*embedders)
+            await upsert_queue.put(None)
+            await upserter
+    except ExceptionGroup as errors:
+        # se propaga el error original (OpenAI, Qdrant, PDF ilegible...) en lugar del grupo
+        raise errors.exceptions[0]
+
+    if counters["chunks"] == 0:
+        raise ValueError("No se pudieron extraer chunks del PDF")
+
+    total = embed_stats["hits"] + embed_stats["misses"]
+    elapsed = time.perf_counter() - started
+    embed_stats["hit_ratio"] = round(embed_stats["hits"] / total, 4) if total else None
+    embed_stats["elapsed_s"] = round(elapsed, 3)
+    embed_stats["chunks_per_s"] = round(total / elapsed, 1) if elapsed > 0 else None
+    logger.info(f"Pipeline de {path}: {pages_read} páginas, {counters['chunks']} chunks, embeddings {embed_stats}")
+    return {"pages": pages_read, **counters, "embedding_cache": embed_stats}
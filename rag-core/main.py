@@ -1,21 +1,78 @@
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
-import uuid
+import asyncio
 import os
+import re
+import json
+import time
 from datetime import datetime
 from pathlib import Path
-from openai import OpenAI
+from openai import AsyncOpenAI
 
-from data_loader import load_and_chunk_pdf, embed_texts
-from vector_db import QdrantStorage
+from data_loader import aembed_texts, embedding_cache
+from vector_db import get_storage, close_storage
+from answer_cache import AnswerCache
+from ingest_jobs import IngestJobQueue
+from ingest_pipeline import run_pipeline
+from incremental_ingest import ChunkDiff, article_fields
+from reranker import Reranker
+from context_packer import ContextPacker
+import metrics
+from metrics import INGEST_STAGE_SECONDS, OPENAI_SECONDS, QUERIES, QUERY_STAGE_SECONDS, record_usage, timed
 
 load_dotenv()
 
-app = FastAPI()
 logger = logging.getLogger("uvicorn")
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+# Caché de respuestas (por worker) para preguntas repetidas
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+answer_cache = AnswerCache()
+
+# Re-ranking opcional en CPU de los candidatos antes del prompt (RERANKER=lexical|cross-encoder)
+reranker = Reranker()
+
+# Contextos del prompt sin duplicados, con vecinos unidos y dentro de CONTEXT_MAX_TOKENS
+context_packer = ContextPacker()
+
+# Camino rápido de /query para preguntas por número de artículo (sin embedding ni búsqueda vectorial)
+ARTICLE_FAST_PATH = os.getenv("ARTICLE_FAST_PATH", "true").lower() == "true"
+# "artículo 10", "articulos 5, 6 y 7", "art. 10", "arts. 10 y 12"
+ARTICLE_REFERENCE = re.compile(r"\bart(?:[ií]culos?\b|s?\.)\s*(\d+(?:\s*(?:,|y|e)\s*\d+)*)", re.IGNORECASE)
+MAX_ARTICLE_REFERENCES = 5
+
+# Cola de ingestas en segundo plano (compartida por los workers, INGEST_CONCURRENCY por worker)
+ingest_queue = IngestJobQueue()
+# espera máxima de /ingest-pdf; después responde 202 con el job_id
+INGEST_SYNC_TIMEOUT = float(os.getenv("INGEST_SYNC_TIMEOUT", "600"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Ciclo de vida del worker: se ejecuta después del fork de gunicorn, por lo que
+    cada worker abre su propio cliente de Qdrant, verifica la colección una vez y
+    arranca sus consumidores de la cola de ingesta.
+    """
+    store = get_storage()
+    try:
+        store.ensure_collection()
+    except Exception as e:
+        # Si Qdrant aún no está disponible, la colección se verifica en la primera petición
+        logger.warning(f"Qdrant no disponible al iniciar: {e}")
+    # el cross-encoder se carga en segundo plano para que la primera consulta no lo espere
+    app.state.reranker_load = asyncio.create_task(asyncio.to_thread(reranker.load))
+    ingest_queue.start(run_ingest)
+    yield
+    await ingest_queue.stop()
+    await close_storage()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 # Modelos de request
@@ -25,10 +82,11 @@ class IngestRequest(BaseModel):
     # area y doc_version se mantienen por compatibilidad pero ya no se usan como metadata principal
     area: str = "general"  # Deprecated: se deja por compatibilidad
     doc_version: str = "1.0"  # Se usa solo para la generación de IDs internos
-    author: str = None
+    author: str | None = None
     category_ids: list[int] = []  # Lista de IDs de categorías
     status: str = "active"
     replace_existing: bool = True
+    incremental: bool = True  # Solo re-embebe y sube los fragmentos que cambiaron
     name: str | None = None
     description: str | None = None
 
@@ -42,88 +100,207 @@ class QueryRequest(BaseModel):
     top_k: int = 10
 
 
+class BatchQueryRequest(BaseModel):
+    queries: list[QueryRequest]
+    concurrency: int | None = None  # completions en paralelo (por defecto BATCH_LLM_CONCURRENCY)
+
+
+def resolve_pdf_path(pdf_path: str) -> Path:
+    """Ruta completa del PDF dentro de pdfs/; 404/400 si no existe o no es un archivo"""
+    pdf_full_path = Path("pdfs") / pdf_path
+    
+    if not pdf_full_path.exists():
+        raise HTTPException(
+            status_code=404, 
+            detail=f"Archivo PDF no encontrado: {pdf_path} (buscado en: {pdf_full_path})"
+        )
+    
+    if not pdf_full_path.is_file():
+        raise HTTPException(
+            status_code=400,
+            detail=f"La ruta no es un archivo válido: {pdf_path}"
+        )
+    return pdf_full_path
+
+
+async def run_ingest(job: dict, report) -> dict:
+    """
+    PROCESO DE INGESTA (se ejecuta dentro de un trabajo de la cola):
+    1. Localiza el PDF en el servidor y lo lee página por página (parse).
+    2. Pica el texto en fragmentos a medida que llegan las páginas (chunk).
+    3. Convierte cada lote de fragmentos a vectores con OpenAI (embed).
+    4. Guarda cada lote en Qdrant en cuanto tiene sus vectores (upsert).
+    Ver ingest_pipeline.run_pipeline: la memoria no crece con el tamaño del documento.
+    
+    Si replace_existing e incremental son True (por defecto), solo se embeben y suben los
+    fragmentos nuevos o modificados (en staging) y al final se publican de una vez junto con
+    el borrado de los eliminados (ver incremental_ingest.ChunkDiff). Con incremental=False los
+    datos viejos se eliminan justo antes del primer lote.
+    """
+    request = IngestRequest(**job["request"])
+    started = time.perf_counter()
+    store = get_storage()
+    pdf_full_path = resolve_pdf_path(request.pdf_path)
+    upload_timestamp = datetime.now().isoformat()
+    incremental = request.replace_existing and request.incremental
+    deleted_count = 0
+    
+    with timed(INGEST_STAGE_SECONDS, "diff"):
+        stored = await asyncio.to_thread(store.document_chunk_state, request.doc_id) if incremental else {}
+    diff = ChunkDiff(request.doc_id, request.doc_version, stored)
+    
+    # metadata común a todos los fragmentos del documento
+    shared_payload = {
+        "source": request.pdf_path,
+        "doc_id": request.doc_id,
+        "category_ids": request.category_ids,
+        "upload_date": upload_timestamp,
+        "status": request.status,
+        "metadata": {
+            "author": request.author,
+            "name": request.name,
+            "description": request.description,
+        }
+    }
+    
+    def make_points(indices: list[int], chunks: list[str]):
+        # IDs por contenido y payloads enriquecidos con metadata para un lote de fragmentos
+        ids, payloads = [], []
+        for index, chunk in zip(indices, chunks):
+            point_id, chunk_key, digest = diff.identity(index)
+            ids.append(point_id)
+            payloads.append({
+                "text": chunk,
+                **shared_payload,
+                "chunk_index": index,
+                "chunk_key": chunk_key,
+                **article_fields(chunk_key),
+                "content_hash": digest,
+                "staging": incremental,
+            })
+        return ids, payloads
+    
+    def delete_previous():
+        nonlocal deleted_count
+        deleted_count = store.delete_document(request.doc_id)
+        logger.info(f"Eliminados {deleted_count} chunks del doc_id: {request.doc_id}")
+    
+    summary = await run_pipeline(
+        str(pdf_full_path),
+        store,
+        make_points,
+        report,
+        before_first_upsert=delete_previous if request.replace_existing and not incremental else None,
+        keep=diff.classify,
+    )
+    logger.info(f"Caché de embeddings para doc_id {request.doc_id}: {summary['embedding_cache']}")
+    
+    changes = None
+    if incremental:
+        # publicar: borrar lo reemplazado/eliminado y quitar staging en un solo request
+        delete_ids = diff.delete_ids()
+        with timed(INGEST_STAGE_SECONDS, "publish"):
+            await asyncio.to_thread(store.publish_document, request.doc_id, delete_ids, shared_payload, diff.point_updates)
+        deleted_count = len(delete_ids)
+        changes = diff.counts
+        logger.info(f"Re-ingesta incremental de doc_id {request.doc_id}: {changes}")
+    
+    # Registro del documento en el catálogo (listado e info sin recorrer los fragmentos)
+    with timed(INGEST_STAGE_SECONDS, "catalog"):
+        chunks_total = await asyncio.to_thread(store.count_document, request.doc_id)
+        await asyncio.to_thread(store.catalog_upsert, {
+            **shared_payload,
+            **shared_payload["metadata"],
+            "area": request.area,
+            "chunks": chunks_total,
+        })
+    
+    # Las respuestas cacheadas que usaban este documento ya no son válidas
+    await answer_cache.invalidate_docs([request.doc_id])
+    INGEST_STAGE_SECONDS.labels("total").observe(time.perf_counter() - started)
+    
+    return {
+        "success": True,
+        "ingested": summary["chunks"],
+        "pages": summary["pages"],
+        "doc_id": request.doc_id,
+        "name": request.name,
+        "description": request.description,
+        "deleted_previous": deleted_count,
+        "upload_date": upload_timestamp,
+        "changes": changes,
+        "embedding_cache": summary["embedding_cache"]
+    }
+
+
+def job_response(job: dict, deduplicated: bool | None = None) -> dict:
+    """Vista pública de un trabajo de ingesta"""
+    response = {
+        "job_id": job["job_id"],
+        "doc_id": job["doc_id"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "progress": job["progress"],
+        "attempts": job["attempts"],
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+    if deduplicated is not None:
+        response["deduplicated"] = deduplicated
+    return response
+
+
+@app.post("/ingest-jobs", status_code=202)
+async def submit_ingest_job(request: IngestRequest):
+    """
+    Encola la ingesta de un PDF y responde de inmediato con el job_id.
+    El progreso se consulta en GET /ingest-jobs/{job_id}.
+    """
+    resolve_pdf_path(request.pdf_path)
+    job, deduplicated = await asyncio.to_thread(ingest_queue.submit, request.doc_id, request.model_dump())
+    return job_response(job, deduplicated)
+
+
+@app.get("/ingest-jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    """Estado de un trabajo: queued/running/done/failed y etapa parse/chunk/embed/upsert con contadores"""
+    job = await asyncio.to_thread(ingest_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo {job_id} no encontrado")
+    return job_response(job)
+
+
+@app.get("/ingest-jobs")
+async def list_ingest_jobs(doc_id: str = None, status: str = None, limit: int = 50):
+    """Lista los trabajos de ingesta más recientes (opcionalmente por doc_id o estado)"""
+    jobs = await asyncio.to_thread(ingest_queue.list, doc_id=doc_id, status=status, limit=limit)
+    return {"jobs": [job_response(j) for j in jobs]}
+
+
 @app.post("/ingest-pdf")
 async def rag_ingest_pdf(request: IngestRequest):
     """
-    PROCESO DE INGESTA:
-    1. Localiza el PDF en el servidor.
-    2. Si el doc_id ya existe y replace_existing es True, limpia los datos viejos.
-    3. Pica el PDF en fragmentos (chunks).
-    4. Convierte fragmentos a vectores (OpenAI).
-    5. Guarda todo en Qdrant con sus etiquetas (área, categoría).
+    Ingesta síncrona (compatibilidad): encola el trabajo y espera a que termine.
+    La espera no bloquea el worker; si pasa INGEST_SYNC_TIMEOUT segundos responde 202
+    con el trabajo (se sigue en GET /ingest-jobs/{job_id}). Para documentos grandes
+    conviene usar /ingest-jobs.
     """
     try:
-        store = QdrantStorage()
-        
-        # 1. Construir la ruta completa del PDF usando pathlib
-        pdf_full_path = Path("pdfs") / request.pdf_path
-        
-        # Verificar si el archivo existe antes de proceder
-        if not pdf_full_path.exists():
-            raise HTTPException(
-                status_code=404, 
-                detail=f"Archivo PDF no encontrado: {request.pdf_path} (buscado en: {pdf_full_path})"
-            )
-        
-        if not pdf_full_path.is_file():
-            raise HTTPException(
-                status_code=400,
-                detail=f"La ruta no es un archivo válido: {request.pdf_path}"
-            )
-        
-        # 2. Si se debe reemplazar, eliminar versión anterior
-        deleted_count = 0
-        if request.replace_existing:
-            deleted_count = store.delete_document(request.doc_id)
-            logger.info(f"Eliminados {deleted_count} chunks del doc_id: {request.doc_id}")
+        resolve_pdf_path(request.pdf_path)
+        job, _ = await asyncio.to_thread(ingest_queue.submit, request.doc_id, request.model_dump())
+        try:
+            job = await ingest_queue.wait(job["job_id"], timeout=INGEST_SYNC_TIMEOUT)
+        except asyncio.TimeoutError:
+            job = await asyncio.to_thread(ingest_queue.get, job["job_id"])
+            return JSONResponse(status_code=202, content=job_response(job))
         
-        # 3. Cargar y chunk el PDF (convertir Path a string para compatibilidad)
-        chunks = load_and_chunk_pdf(str(pdf_full_path))
+        if job["status"] == "failed":
+            raise HTTPException(status_code=500, detail=f"Error processing PDF: {job['error']}")
         
-        if not chunks:
-            raise HTTPException(status_code=400, detail="No se pudieron extraer chunks del PDF")
-        
-        # 4. Generar embeddings
-        vecs = embed_texts(chunks)
-        
-        # 5. Crear IDs únicos para cada chunk
-        ids = [
-            str(uuid.uuid5(uuid.NAMESPACE_URL, f"{request.doc_id}:v{request.doc_version}:{i}"))
-            for i in range(len(chunks))
-        ]
-        
-        # 6. Crear payloads enriquecidos con metadata
-        upload_timestamp = datetime.now().isoformat()
-        payloads = [
-            {
-                "text": chunks[i],
-                "source": request.pdf_path,
-                "doc_id": request.doc_id,
-                "category_ids": request.category_ids,
-                "upload_date": upload_timestamp,
-                "status": request.status,
-                "chunk_index": i,
-                "metadata": {
-                    "author": request.author,
-                    "name": request.name,
-                    "description": request.description,
-                }
-            }
-            for i in range(len(chunks))
-        ]
-        
-        # 7. Upsert en Qdrant
-        store.upsert(ids, vecs, payloads)
-        
-        return {
-            "success": True,
-            "ingested": len(chunks),
-            "doc_id": request.doc_id,
-            "name": request.name,
-            "description": request.description,
-            "deleted_previous": deleted_count if request.replace_existing else 0,
-            "upload_date": upload_timestamp
-        }
+        return {**job["result"], "job_id": job["job_id"]}
         
     except HTTPException:
         raise
@@ -132,6 +309,218 @@ async def rag_ingest_pdf(request: IngestRequest):
         raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
 
 
+# /query/batch: preguntas por llamada y completions de OpenAI en paralelo por lote
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "500"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+NO_CONTEXT_ANSWER = "No se encontró información relevante en los documentos disponibles."
+
+SYSTEM_PROMPT = "Eres un asistente que responde preguntas basándose únicamente en el contexto proporcionado. Si la información no está en el contexto, indícalo claramente."
+
+
+async def retrieve_contexts(request: QueryRequest, query_vec: list[float] | None = None,
+                            timings: dict | None = None) -> dict:
+    """
+    Pasos 1 y 2 del RAG: embedding de la pregunta, búsqueda en Qdrant y re-ranking.
+    Devuelve los contextos ya limitados a top_k (o a RERANK_TOP_K si hay re-ranker) y empaquetados
+    por context_packer (sin duplicados y dentro de CONTEXT_MAX_TOKENS). Cada etapa se mide en
+    rag_query_stage_seconds y, si se pasa timings, se agrega ahí en milisegundos.
+    """
+    # 1. Generar embedding de la pregunta (si no viene ya calculado)
+    if query_vec is None:
+        with timed(QUERY_STAGE_SECONDS, "embed", timings):
+            query_vec = (await aembed_texts([request.question]))[0]
+    
+    # 2. Buscar en Qdrant con filtros (híbrida: embeddings + BM25; traer más resultados para re-ranking)
+    store = get_storage()
+    with timed(QUERY_STAGE_SECONDS, "search", timings):
+        found = await store.asearch(**search_arguments(request, query_vec))
+    return await select_contexts(request, found, timings)
+
+
+def search_arguments(request: QueryRequest, query_vec: list[float]) -> dict:
+    """Argumentos de la búsqueda en Qdrant para una consulta"""
+    return {
+        "query_vector": query_vec,
+        "top_k": request.top_k * 3,  # Traer 3x más para re-ranking
+        "area": request.area,
+        "doc_id": request.doc_id,
+        "status": request.status,
+        "category_ids": request.category_ids,
+        "query_text": request.question
+    }
+
+
+async def select_contexts(request: QueryRequest, found: dict, timings: dict | None = None) -> dict:
+    """Re-ranking, límite de top_k y empaquetado de los candidatos de la búsqueda"""
+    # 2.5 RE-RANKING: re-ranker opcional (con presupuesto de tiempo) y luego, si la pregunta
+    # menciona un artículo específico, sus fragmentos primero (conservando el orden del re-ranker)
+    if reranker.enabled and found["hits"]:
+        with timed(QUERY_STAGE_SECONDS, "rerank", timings):
+            found["hits"] = await reranker.arerank(request.question, found["hits"])
+    
+    article_match = re.search(r'art[ií]culo\s+(\d+)', request.question, re.IGNORECASE)
+    
+    if article_match and found["hits"]:
+        target_article = article_match.group(1)
+        logger.info(f"Detectado: Usuario pregunta por Artículo {target_article}")
+        
+        # Separar contextos que contienen el artículo específico
+        exact_matches = []
+        other_hits = []
+        
+        for hit in found["hits"]:
+            # Buscar "Artículo X" al inicio del chunk (con o sin tilde)
+            if re.search(rf'Art[ií]culo\s+{target_article}[\.\s]', hit["text"], re.IGNORECASE):
+                exact_matches.append(hit)
+            else:
+                other_hits.append(hit)
+        
+        # Re-ordenar: primero los matches exactos, luego los demás
+        found["hits"] = exact_matches + other_hits
+        logger.info(f"Re-ranking: {len(exact_matches)} matches exactos del Artículo {target_article}")
+    
+    # Limitar al top_k original
+    found["hits"] = found["hits"][:reranker.keep(request.top_k)]
+    with timed(QUERY_STAGE_SECONDS, "pack", timings):
+        found["contexts"], found["packing"] = context_packer.pack(found["hits"])
+    
+    # DEBUG: contextos encontrados (los tiempos de cada etapa se registran al responder)
+    logger.debug(f"Query: {request.question}")
+    for i, ctx in enumerate(found["contexts"]):
+        logger.debug(f"Contexto {i+1}: {ctx[:100]}".replace('\n', ' '))
+    
+    return found
+
+
+def article_references(question: str) -> list[int]:
+    """Números de artículo mencionados en la pregunta, en orden y sin repetir"""
+    articles = []
+    for match in ARTICLE_REFERENCE.finditer(question):
+        for number in re.findall(r"\d+", match.group(1)):
+            if int(number) not in articles:
+                articles.append(int(number))
+    return articles[:MAX_ARTICLE_REFERENCES]
+
+
+async def fetch_article_contexts(request: QueryRequest, timings: dict | None = None) -> dict | None:
+    """
+    Camino rápido: si la pregunta menciona artículos ("Que dice el artículo 10"), trae sus
+    fragmentos por filtro sobre el payload indexado "article", sin embedding de la pregunta.
+    La búsqueda respeta los filtros de la consulta (doc_id, area, status, category_ids).
+    Devuelve None (y se usa la búsqueda normal) si no hay referencias, si no se encontraron,
+    si dentro de esos filtros aparecen en más de un documento y la consulta no fija doc_id
+    (la búsqueda decide qué documento es el relevante) o si algún fragmento del filtro no
+    tiene el campo "article" (ingestado antes: su documento no aparecería).
+    """
+    if not ARTICLE_FAST_PATH:
+        return None
+    articles = article_references(request.question)
+    if not articles:
+        return None
+    with timed(QUERY_STAGE_SECONDS, "article_lookup", timings):
+        found = await get_storage().afetch_articles(
+            articles,
+            limit=request.top_k * 3,
+            area=request.area,
+            doc_id=request.doc_id,
+            status=request.status,
+            category_ids=request.category_ids
+        )
+    if not found["article_field_complete"]:
+        return None
+    if not found["hits"] or (len(found["doc_ids"]) > 1 and not request.doc_id):
+        return None
+    found["hits"] = found["hits"][:request.top_k]
+    with timed(QUERY_STAGE_SECONDS, "pack", timings):
+        found["contexts"], found["packing"] = context_packer.pack(found["hits"])
+    logger.info(f"Camino rápido: artículos {articles} de {found['doc_ids']} ({len(found['hits'])} fragmentos)")
+    return found
+
+
+async def lookup_cached_answer(request: QueryRequest, filter_key: str, timings: dict | None = None):
+    """
+    Busca la respuesta en la caché: primero por pregunta exacta (sin llamar a OpenAI), luego
+    el camino rápido por número de artículo y por último por similitud del embedding.
+    Devuelve (respuesta, tipo_de_acierto, query_vec, contextos): query_vec se reutiliza en la
+    búsqueda si no hubo acierto, y contextos viene ya resuelto si aplicó el camino rápido.
+    """
+    if ANSWER_CACHE_ENABLED:
+        await answer_cache.refresh()
+        cached = answer_cache.get_exact(request.question, filter_key)
+        if cached is not None:
+            return cached, "exact", None, None
+    
+    found = await fetch_article_contexts(request, timings)
+    if found is not None:
+        return None, "miss", None, found
+    
+    with timed(QUERY_STAGE_SECONDS, "embed", timings):
+        query_vec = (await aembed_texts([request.question]))[0]
+    
+    if ANSWER_CACHE_ENABLED:
+        cached = answer_cache.get_similar(request.question, query_vec, filter_key)
+        if cached is not None:
+            return cached, "semantic", query_vec, None
+    
+    return None, "miss", query_vec, None
+
+
+def build_messages(question: str, contexts: list[str]) -> list[dict]:
+    """Paso 3 del RAG: arma el prompt con los contextos recuperados"""
+    context_block = "\n\n".join(f"- {c}" for c in contexts)
+    
+    user_content = (
+        f"Usa el siguiente contexto para responder la pregunta.\n\n"
+        f"Contexto:\n{context_block}\n\n"
+        f"Pregunta: {question}\n\n"
+        "Responde de manera concisa usando únicamente el contexto proporcionado."
+    )
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_content}
+    ]
+
+
+async def complete_answer(question: str, contexts: list[str], timings: dict | None = None) -> str:
+    """Pasos 3 y 4 del RAG: prompt con los contextos y respuesta de OpenAI"""
+    model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    with timed(QUERY_STAGE_SECONDS, "prompt", timings):
+        messages = build_messages(question, contexts)
+    with timed(QUERY_STAGE_SECONDS, "llm", timings), timed(OPENAI_SECONDS, "chat"):
+        response = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=1024,
+            temperature=0.2
+        )
+    record_usage(model, response.usage)
+    return response.choices[0].message.content.strip()
+
+
+def build_result(request: QueryRequest, found: dict, answer: str) -> dict:
+    """Respuesta de /query (la que se guarda en la caché)"""
+    return {
+        "answer": answer,
+        "sources": found["sources"],
+        "doc_ids": found.get("doc_ids", []),
+        "num_contexts": len(found["contexts"]),
+        "filters_applied": {
+            "area": request.area,
+            "doc_id": request.doc_id
+        }
+    }
+
+
+def finish_query(endpoint: str, outcome: str, started: float, timings: dict) -> dict:
+    """Registra la duración total y el resultado de una consulta; devuelve los tiempos por etapa (ms)"""
+    elapsed = time.perf_counter() - started
+    QUERY_STAGE_SECONDS.labels("total").observe(elapsed)
+    QUERIES.labels(endpoint, outcome).inc()
+    timings["total_ms"] = round(elapsed * 1000, 1)
+    logger.info(f"Consulta {endpoint} ({outcome}): {timings}")
+    return timings
+
+
 @app.post("/query")
 async def rag_query(request: QueryRequest):
     """
@@ -141,103 +530,286 @@ async def rag_query(request: QueryRequest):
     3. Toma esos fragmentos y se los entrega a GPT-4o-mini.
     4. GPT redacta la respuesta usando solo el "Contexto" entregado.
     """
+    started = time.perf_counter()
+    # hora de inicio: la respuesta en caché vale solo si no hubo invalidaciones después
+    started_at = time.time()
+    timings = {}
     try:
-        # 1. Generar embedding de la pregunta
-        query_vec = embed_texts([request.question])[0]
-        
-        # 2. Buscar en Qdrant con filtros (traer más resultados para re-ranking)
-        store = QdrantStorage()
-        found = store.search(
-            query_vector=query_vec,
-            top_k=request.top_k * 3,  # Traer 3x más para re-ranking
-            area=request.area,
-            doc_id=request.doc_id,
-            status=request.status,
-            category_ids=request.category_ids
+        filter_key = AnswerCache.filter_key(
+            request.category_ids, request.doc_id, request.status, request.area, request.top_k
         )
+        cached, cache_status, query_vec, found = await lookup_cached_answer(request, filter_key, timings)
+        if cached is not None:
+            return {**cached, "cache": cache_status, "timings": finish_query("query", cache_status, started, timings)}
         
-        # 2.5 RE-RANKING: Detectar si la pregunta menciona un artículo específico
-        import re
-        article_match = re.search(r'art[ií]culo\s+(\d+)', request.question, re.IGNORECASE)
-        
-        if article_match and found["contexts"]:
-            target_article = article_match.group(1)
-            logger.info(f"Detectado: Usuario pregunta por Artículo {target_article}")
-            
-            # Separar contextos que contienen el artículo específico
-            exact_matches = []
-            other_contexts = []
-            
-            for ctx in found["contexts"]:
-                # Buscar "Artículo X" al inicio del chunk (con o sin tilde)
-                if re.search(rf'Art[ií]culo\s+{target_article}[\.\s]', ctx, re.IGNORECASE):
-                    exact_matches.append(ctx)
-                else:
-                    other_contexts.append(ctx)
-            
-            # Re-ordenar: primero los matches exactos, luego los demás
-            found["contexts"] = exact_matches + other_contexts
-            logger.info(f"Re-ranking: {len(exact_matches)} matches exactos del Artículo {target_article}")
-        
-        # Limitar al top_k original
-        found["contexts"] = found["contexts"][:request.top_k]
-        
-        # DEBUG: Imprimir los contextos encontrados
-        logger.info(f"Query: {request.question}")
-        logger.info(f"Contextos encontrados ({len(found['contexts'])}):")
-        for i, ctx in enumerate(found["contexts"]):
-            logger.info(f"--- Contexto {i+1} (primeros 100 caracteres) ---")
-            logger.info(ctx[:100].replace('\n', ' '))
+        if found is None:
+            found = await retrieve_contexts(request, query_vec, timings)
         
         if not found["contexts"]:
             return {
-                "answer": "No se encontró información relevante en los documentos disponibles.",
+                "answer": NO_CONTEXT_ANSWER,
                 "sources": [],
                 "doc_ids": [],
-                "num_contexts": 0
+                "num_contexts": 0,
+                "timings": finish_query("query", "no_context", started, timings)
             }
         
-        # 3. Construir contexto para el LLM
-        context_block = "\n\n".join(f"- {c}" for c in found["contexts"])
+        # 3 y 4. Construir contexto y llamar a OpenAI
+        answer = await complete_answer(request.question, found["contexts"], timings)
         
-        # Eliminar info de área si no es relevante
-        user_content = (
-            f"Usa el siguiente contexto para responder la pregunta.\n\n"
-            f"Contexto:\n{context_block}\n\n"
-            f"Pregunta: {request.question}\n\n"
-            "Responde de manera concisa usando únicamente el contexto proporcionado."
-        )
+        result = build_result(request, found, answer)
+        if ANSWER_CACHE_ENABLED:
+            answer_cache.put(request.question, query_vec, filter_key, result, started_at)
+        
+        return {**result, "cache": cache_status, "context_tokens": found["packing"],
+                "timings": finish_query("query", cache_status, started, timings)}
+        
+    except Exception as e:
+        QUERIES.labels("query", "error").inc()
+        logger.error(f"Error querying: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error querying: {str(e)}")
 
-        # 4. Llamar a OpenAI
-        response = client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-            messages=[
-                {
-                    "role": "system", 
-                    "content": "Eres un asistente que responde preguntas basándose únicamente en el contexto proporcionado. Si la información no está en el contexto, indícalo claramente."
-                },
-                {"role": "user", "content": user_content}
-            ],
-            max_tokens=1024,
-            temperature=0.2
-        )
 
-        answer = response.choices[0].message.content.strip()
+def sse_event(event: str, data: dict) -> str:
+    """Formatea un evento Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/query/stream")
+async def rag_query_stream(request: QueryRequest):
+    """
+    Igual que /query, pero responde como Server-Sent Events:
+    - event: sources  -> fuentes y doc_ids recuperados (antes de llamar al LLM)
+    - event: token    -> fragmentos de la respuesta a medida que GPT los genera
+    - event: done     -> métricas (time-to-first-token, latencia total, tokens)
+    - event: error    -> si algo falla a mitad del stream
+    """
+    async def event_stream():
+        started = time.perf_counter()
+        started_at = time.time()
+        timings = {}
+        try:
+            filter_key = AnswerCache.filter_key(
+                request.category_ids, request.doc_id, request.status, request.area, request.top_k
+            )
+            cached, cache_status, query_vec, found = await lookup_cached_answer(request, filter_key, timings)
+            if cached is not None:
+                yield sse_event("sources", {
+                    "sources": cached["sources"],
+                    "doc_ids": cached["doc_ids"],
+                    "num_contexts": cached["num_contexts"]
+                })
+                yield sse_event("token", {"text": cached["answer"]})
+                elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+                yield sse_event("done", {"retrieval_ms": elapsed_ms, "ttft_ms": elapsed_ms,
+                                         "total_ms": elapsed_ms, "cache": cache_status,
+                                         "timings": finish_query("stream", cache_status, started, timings)})
+                return
+            
+            if found is None:
+                found = await retrieve_contexts(request, query_vec, timings)
+            retrieval_ms = (time.perf_counter() - started) * 1000
+            
+            yield sse_event("sources", {
+                "sources": found["sources"],
+                "doc_ids": found.get("doc_ids", []),
+                "num_contexts": len(found["contexts"])
+            })
+            
+            if not found["contexts"]:
+                yield sse_event("token", {"text": NO_CONTEXT_ANSWER})
+                yield sse_event("done", {"retrieval_ms": round(retrieval_ms, 1), "ttft_ms": None,
+                                         "total_ms": round((time.perf_counter() - started) * 1000, 1),
+                                         "timings": finish_query("stream", "no_context", started, timings)})
+                return
+            
+            model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+            with timed(QUERY_STAGE_SECONDS, "prompt", timings):
+                messages = build_messages(request.question, found["contexts"])
+            llm_started = time.perf_counter()
+            stream = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=1024,
+                temperature=0.2,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            
+            ttft_ms = None
+            usage = None
+            parts = []
+            async for chunk in stream:
+                if chunk.usage:
+                    usage = chunk.usage.model_dump()
+                if not chunk.choices:
+                    continue
+                text = chunk.choices[0].delta.content
+                if text:
+                    if ttft_ms is None:
+                        ttft_ms = (time.perf_counter() - started) * 1000
+                        QUERY_STAGE_SECONDS.labels("ttft").observe(ttft_ms / 1000)
+                        timings["ttft_ms"] = round(ttft_ms, 1)
+                    parts.append(text)
+                    yield sse_event("token", {"text": text})
+            
+            llm_seconds = time.perf_counter() - llm_started
+            QUERY_STAGE_SECONDS.labels("llm").observe(llm_seconds)
+            OPENAI_SECONDS.labels("chat").observe(llm_seconds)
+            timings["llm_ms"] = round(llm_seconds * 1000, 1)
+            record_usage(model, usage)
+            
+            if ANSWER_CACHE_ENABLED:
+                answer_cache.put(request.question, query_vec, filter_key,
+                                 build_result(request, found, "".join(parts).strip()), started_at)
+            
+            timings = finish_query("stream", cache_status, started, timings)
+            yield sse_event("done", {
+                "retrieval_ms": round(retrieval_ms, 1),
+                "ttft_ms": round(ttft_ms, 1) if ttft_ms is not None else None,
+                "total_ms": timings["total_ms"],
+                "usage": usage,
+                "cache": cache_status,
+                "context_tokens": found["packing"],
+                "timings": timings
+            })
+        
+        except Exception as e:
+            QUERIES.labels("stream", "error").inc()
+            logger.error(f"Error en query stream: {str(e)}", exc_info=True)
+            yield sse_event("error", {"detail": f"Error querying: {str(e)}"})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/query/batch")
+async def rag_query_batch(batch: BatchQueryRequest):
+    """
+    Varias consultas en una sola llamada (suites de regresión, análisis de casos en lote), con
+    el mismo resultado que /query para cada una pero compartiendo los viajes de red:
+    1. caché exacta y camino rápido por número de artículo de cada pregunta;
+    2. embeddings de las preguntas restantes en un solo pedido (aembed_texts) y caché semántica;
+    3. una sola búsqueda en lote en Qdrant (query_batch_points) para todas las que faltan;
+    4. completions de OpenAI en paralelo, como máximo `concurrency` a la vez.
+    Los resultados vienen en el orden de las consultas, cada uno con sus tiempos; si falla la
+    completion de una consulta, esa trae "error" y el resto del lote sigue.
+    """
+    if len(batch.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"El lote tiene {len(batch.queries)} consultas (máximo {BATCH_MAX_QUERIES})"
+        )
+    started = time.perf_counter()
+    started_at = time.time()
+    timings = {}
+    items = [{
+        "request": request,
+        "filter_key": AnswerCache.filter_key(
+            request.category_ids, request.doc_id, request.status, request.area, request.top_k
+        ),
+        "cached": None,
+        "cache": "miss",
+        "query_vec": None,
+        "found": None,
+    } for request in batch.queries]
+    
+    def stage(name: str, stage_started: float):
+        elapsed = time.perf_counter() - stage_started
+        QUERY_STAGE_SECONDS.labels(f"batch_{name}").observe(elapsed)
+        timings[f"{name}_ms"] = round(elapsed * 1000, 1)
+    
+    try:
+        # 1. Caché exacta y camino rápido (consultas a Qdrant por filtro, en paralelo)
+        stage_started = time.perf_counter()
+        if ANSWER_CACHE_ENABLED:
+            await answer_cache.refresh()
+            for item in items:
+                item["cached"] = answer_cache.get_exact(item["request"].question, item["filter_key"])
+                if item["cached"] is not None:
+                    item["cache"] = "exact"
+        pending = [item for item in items if item["cached"] is None]
+        fast = await asyncio.gather(*(fetch_article_contexts(item["request"]) for item in pending))
+        for item, found in zip(pending, fast):
+            item["found"] = found
+        stage("lookup", stage_started)
         
-        return {
-            "answer": answer,
-            "sources": found["sources"],
-            "doc_ids": found.get("doc_ids", []),
-            "num_contexts": len(found["contexts"]),
-            "filters_applied": {
-                "area": request.area,
-                "doc_id": request.doc_id
-            }
-        }
+        # 2. Embeddings de todas las preguntas restantes en un solo pedido
+        stage_started = time.perf_counter()
+        pending = [item for item in pending if item["found"] is None]
+        if pending:
+            vectors = await aembed_texts([item["request"].question for item in pending])
+            for item, vector in zip(pending, vectors):
+                item["query_vec"] = vector
+                if ANSWER_CACHE_ENABLED:
+                    item["cached"] = answer_cache.get_similar(item["request"].question, vector, item["filter_key"])
+                    if item["cached"] is not None:
+                        item["cache"] = "semantic"
+        stage("embed", stage_started)
         
+        # 3. Una búsqueda en lote en Qdrant y re-ranking/empaquetado de cada consulta
+        stage_started = time.perf_counter()
+        pending = [item for item in pending if item["cached"] is None]
+        results = await get_storage().asearch_batch([
+            search_arguments(item["request"], item["query_vec"]) for item in pending
+        ])
+        selected = await asyncio.gather(*(
+            select_contexts(item["request"], found) for item, found in zip(pending, results)
+        ))
+        for item, found in zip(pending, selected):
+            item["found"] = found
+        stage("search", stage_started)
     except Exception as e:
-        logger.error(f"Error querying: {str(e)}", exc_info=True)
+        logger.error(f"Error querying batch: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error querying: {str(e)}")
+    
+    # 4. Completions en paralelo con límite
+    stage_started = time.perf_counter()
+    semaphore = asyncio.Semaphore(max(1, batch.concurrency or BATCH_LLM_CONCURRENCY))
+    
+    async def answer(item: dict) -> dict:
+        request = item["request"]
+        if item["cached"] is not None:
+            QUERIES.labels("batch", item["cache"]).inc()
+            return {**item["cached"], "cache": item["cache"]}
+        found = item["found"]
+        if not found["contexts"]:
+            QUERIES.labels("batch", "no_context").inc()
+            return {"answer": NO_CONTEXT_ANSWER, "sources": [], "doc_ids": [], "num_contexts": 0}
+        async with semaphore:
+            llm_started = time.perf_counter()
+            try:
+                result = build_result(request, found, await complete_answer(request.question, found["contexts"]))
+            except Exception as e:
+                QUERIES.labels("batch", "error").inc()
+                logger.error(f"Error en la consulta del lote '{request.question[:50]}': {str(e)}")
+                return {"error": f"Error querying: {str(e)}", "cache": "miss"}
+            llm_ms = round((time.perf_counter() - llm_started) * 1000, 1)
+        QUERIES.labels("batch", "miss").inc()
+        if ANSWER_CACHE_ENABLED:
+            answer_cache.put(request.question, item["query_vec"], item["filter_key"], result, started_at)
+        return {**result, "cache": "miss", "context_tokens": found["packing"], "llm_ms": llm_ms}
+    
+    async def answer_item(item: dict) -> dict:
+        result = await answer(item)
+        result["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return {"question": item["request"].question, **result}
+    
+    answers = await asyncio.gather(*(answer_item(item) for item in items))
+    stage("llm", stage_started)
+    stage("total", started)
+    
+    summary = {
+        "queries": len(items),
+        "errors": sum(1 for result in answers if "error" in result),
+        "cache_hits": sum(1 for item in items if item["cached"] is not None),
+        "article_fast_path": sum(1 for item in items if item["cached"] is None and item["query_vec"] is None),
+    }
+    logger.info(f"Lote de consultas: {summary} {timings}")
+    return {"results": answers, "summary": summary, "timings": timings}
 
 
 @app.delete("/document/{doc_id}")
@@ -246,8 +818,9 @@ async def delete_document(doc_id: str):
     Elimina físicamente un documento y todos sus chunks
     """
     try:
-        store = QdrantStorage()
-        count = store.delete_document(doc_id)
+        store = get_storage()
+        count = await asyncio.to_thread(store.delete_document, doc_id)
+        await answer_cache.invalidate_docs([doc_id])
         
         if count == 0:
             raise HTTPException(status_code=404, detail=f"Documento {doc_id} no encontrado")
@@ -271,8 +844,8 @@ async def get_document_info(doc_id: str):
     Obtiene información de un documento
     """
     try:
-        store = QdrantStorage()
-        info = store.get_document_info(doc_id)
+        store = get_storage()
+        info = await asyncio.to_thread(store.get_document_info, doc_id)
         
         if not info:
             raise HTTPException(status_code=404, detail=f"Documento {doc_id} no encontrado")
@@ -299,8 +872,8 @@ async def list_documents(area: str = None):
     Opcionalmente filtrados por área
     """
     try:
-        store = QdrantStorage()
-        documents = store.list_documents(area=area)
+        store = get_storage()
+        documents = await asyncio.to_thread(store.list_documents, area=area)
         
         return {
             "total": len(documents),
@@ -316,9 +889,74 @@ async def list_documents(area: str = None):
 @app.delete("/admin/qdrant/collection")
 async def delete_qdrant_collection():
     try:
-        store = QdrantStorage()
-        store.delete_all()
+        store = get_storage()
+        await asyncio.to_thread(store.delete_all)
+        await answer_cache.invalidate_all()
         return {"success": True, "message": "Colección de Qdrant eliminada completamente"}
     except Exception as e:
         logger.error(f"Error deleting Qdrant collection: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.post("/admin/catalog/reconcile")
+async def reconcile_catalog():
+    """Reconstruye el catálogo de documentos a partir de los fragmentos guardados en Qdrant"""
+    try:
+        return await asyncio.to_thread(get_storage().reconcile_catalog)
+    except Exception as e:
+        logger.error(f"Error reconciling catalog: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.get("/admin/qdrant/stats")
+async def qdrant_stats():
+    """Estadísticas del cliente de Qdrant de este worker (pool, reconexiones, errores)"""
+    return get_storage().pool_stats()
+
+
+@app.get("/admin/qdrant/indexes")
+async def qdrant_payload_indexes():
+    """Índices de payload de la colección y cuántos puntos cubre cada uno"""
+    try:
+        return await asyncio.to_thread(get_storage().payload_indexes)
+    except Exception as e:
+        logger.error(f"Error reading payload indexes: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.get("/admin/cache/stats")
+async def answer_cache_stats():
+    """Estadísticas de la caché de respuestas de este worker"""
+    return {"enabled": ANSWER_CACHE_ENABLED, **answer_cache.get_stats()}
+
+
+@app.get("/admin/reranker/stats")
+async def reranker_stats():
+    """Modo, presupuesto y latencia del re-ranker de este worker"""
+    return reranker.get_stats()
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Métricas de Prometheus: latencia por etapa de consultas e ingestas, OpenAI, Qdrant y tokens"""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/admin/context/stats")
+async def context_stats():
+    """Tokens de contexto enviados al LLM y ahorrados por el empaquetado en este worker"""
+    return context_packer.get_stats()
+
+
+@app.get("/admin/ingest-jobs/stats")
+async def ingest_jobs_stats():
+    """Trabajos por estado y contadores de la cola en este worker"""
+    return await asyncio.to_thread(ingest_queue.get_stats)
+
+
+@app.get("/admin/embedding-cache/stats")
+async def embedding_cache_stats():
+    """Estadísticas de la caché persistente de embeddings"""
+    # el COUNT(*) sobre SQLite no debe bloquear el event loop
+    return await asyncio.to_thread(embedding_cache.get_stats)
@@ -0,0 +1,106 @@
+# métricas de Prometheus de consultas, ingestas y llamadas a OpenAI/Qdrant (GET /metrics)
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Con gunicorn cada worker es un proceso: si PROMETHEUS_MULTIPROC_DIR está definido (lo fija
+# gunicorn_config.py) cada worker escribe sus valores en archivos de ese directorio y /metrics
+# los suma, así que el scrape ve el total del servicio sin importar qué worker responda.
+# Debe estar en el entorno antes de importar prometheus_client.
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+from prometheus_client import (  # noqa: E402
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess,
+)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+INGEST_BUCKETS = LATENCY_BUCKETS + (120, 300, 600)
+
+QUERY_STAGE_SECONDS = Histogram(
+    "rag_query_stage_seconds",
+    "Duración de cada etapa de una consulta (embed, search, rerank, pack, prompt, llm, total...)",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+INGEST_STAGE_SECONDS = Histogram(
+    "rag_ingest_stage_seconds",
+    "Duración de cada etapa de una ingesta (parse, embed y upsert por lote; diff, publish, catalog y total por documento)",
+    ["stage"],
+    buckets=INGEST_BUCKETS,
+)
+QUERIES = Counter(
+    "rag_queries",
+    "Consultas por endpoint y resultado (exact, semantic, miss, no_context, error)",
+    ["endpoint", "outcome"],
+)
+OPENAI_SECONDS = Histogram(
+    "rag_openai_request_seconds",
+    "Duración de las llamadas a OpenAI (reintentos incluidos)",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+OPENAI_TOKENS = Counter(
+    "rag_openai_tokens",
+    "Tokens consumidos según el campo usage de las respuestas de OpenAI",
+    ["model", "type"],
+)
+QDRANT_SECONDS = Histogram(
+    "rag_qdrant_request_seconds",
+    "Duración de las operaciones contra Qdrant",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+@contextmanager
+def timed(histogram: Histogram, label: str, timings: dict | None = None):
+    """
+    Mide el bloque (sirve también alrededor de un await) y lo registra en el histograma con
+    esa etiqueta; si se pasa timings, agrega ahí "<label>_ms" para la respuesta o el log.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        histogram.labels(label).observe(elapsed)
+        if timings is not None:
+            timings[f"{label}_ms"] = round(timings.get(f"{label}_ms", 0) + elapsed * 1000, 1)
+
+
+def record_usage(model: str, usage) -> None:
+    """Suma los tokens de un usage de OpenAI (objeto o dict, de chat o de embeddings)"""
+    if usage is None:
+        return
+    if not isinstance(usage, dict):
+        usage = usage.model_dump()
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage.get(kind):
+            OPENAI_TOKENS.labels(model, kind.removesuffix("_tokens")).inc(usage[kind])
+
+
+def reset_multiprocess_dir() -> None:
+    """Vacía el directorio de métricas al arrancar gunicorn (los valores de la ejecución anterior no cuentan)"""
+    if MULTIPROC_DIR:
+        shutil.rmtree(MULTIPROC_DIR, ignore_errors=True)
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+
+def mark_worker_dead(pid: int) -> None:
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
+
+
+def render() -> tuple[bytes, str]:
+    """Exposición en formato de texto de Prometheus (sumando todos los workers si corresponde)"""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
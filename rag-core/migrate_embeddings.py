@@ -0,0 +1,105 @@
+"""
+Migración de la colección de fragmentos a otra dimensión de embeddings (EMBED_DIM), al
+esquema de búsqueda en dos etapas (EMBED_SEARCH_DIM) o al de búsqueda híbrida (HYBRID_SEARCH,
+cuyo vector disperso BM25 se calcula del texto de cada punto al copiarlo).
+
+Copia todos los puntos publicados de la colección de origen a una colección nueva, creada con
+la configuración del entorno (dimensiones, cuantización, vectores en disco e índices). Por
+defecto los vectores se derivan de los ya guardados: text-embedding-3 es Matryoshka, así que
+truncar y re-normalizar da el mismo vector que pedir menos dimensiones a la API, sin llamar a
+OpenAI. Con --reembed se recalculan desde el texto (pasando por la caché de embeddings); hace
+falta si la colección de origen tiene menos dimensiones que EMBED_DIM.
+
+Los IDs y payloads se conservan, así que se puede volver a ejecutar si se interrumpe. Al
+terminar se reconstruye el catálogo de la colección nueva; para usarla, cambiar
+QDRANT_COLLECTION y reiniciar el servicio.
+
+Uso (desde rag-core/):
+    EMBED_DIM=1024 EMBED_SEARCH_DIM=256 python migrate_embeddings.py --target legal_docs_1024
+"""
+import argparse
+import logging
+import os
+import time
+
+from qdrant_client.models import Filter
+
+from vector_db import FULL_VECTOR, STAGING_CONDITION, QdrantStorage, truncate_embedding
+
+logger = logging.getLogger(__name__)
+
+
+def stored_vector(point) -> list[float]:
+    vector = point.vector
+    if isinstance(vector, dict):
+        # vectores con nombre (dos etapas y/o disperso): el denso completo es "full" o el sin nombre
+        vector = vector[FULL_VECTOR] if FULL_VECTOR in vector else vector[""]
+    return vector
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=os.getenv("QDRANT_COLLECTION", "docs"), help="Colección de origen")
+    parser.add_argument("--target", required=True, help="Colección nueva (se crea con la configuración del entorno)")
+    parser.add_argument("--reembed", action="store_true", help="Recalcular los embeddings desde el texto")
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("vector_db").setLevel(logging.WARNING)
+
+    if args.source == args.target:
+        parser.error("--target debe ser una colección distinta de --source")
+
+    source = QdrantStorage(collection=args.source, bootstrap=False)
+    if not source.client.collection_exists(args.source):
+        parser.error(f"La colección de origen '{args.source}' no existe")
+    target = QdrantStorage(collection=args.target)
+    if args.reembed:
+        # importación diferida: solo este modo necesita el cliente de OpenAI
+        from data_loader import EMBED_DIM, embed_texts
+        if EMBED_DIM != target.dim:
+            parser.error(f"EMBED_DIM ({EMBED_DIM}) no coincide con la dimensión de la colección nueva ({target.dim})")
+
+    total = source.client.count(args.source, exact=True).count
+    logger.info(f"Migrando {total} puntos de '{args.source}' a '{args.target}' ({target._vector_mode()})")
+    started = time.perf_counter()
+    copied = 0
+    offset = None
+    while True:
+        points, offset = source.client.scroll(
+            collection_name=args.source,
+            scroll_filter=Filter(must_not=[STAGING_CONDITION]),
+            limit=args.batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=not args.reembed,
+        )
+        if points:
+            ids = [str(point.id) for point in points]
+            payloads = [point.payload or {} for point in points]
+            if args.reembed:
+                vectors = embed_texts([payload.get("text", "") for payload in payloads])
+            else:
+                vectors = [stored_vector(point) for point in points]
+                if len(vectors[0]) < target.dim:
+                    parser.error(
+                        f"Los vectores de origen tienen {len(vectors[0])} dimensiones y EMBED_DIM es "
+                        f"{target.dim}: usar --reembed"
+                    )
+                vectors = [truncate_embedding(vector, target.dim) for vector in vectors]
+            target.upsert(ids, vectors, payloads, batch_size=args.batch_size)
+            copied += len(points)
+            logger.info(f"{copied}/{total} puntos copiados")
+        if offset is None:
+            break
+
+    catalog = target.reconcile_catalog()
+    logger.info(
+        f"Migración completa en {time.perf_counter() - started:.1f}s: {copied} puntos, "
+        f"{catalog['documents']} documentos. Para usarla: QDRANT_COLLECTION={args.target}"
+    )
+
+
+if __name__ == "__main__":
+    main()
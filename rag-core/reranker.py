@@ -0,0 +1,162 @@
+# re-ranking de los fragmentos recuperados antes de armar el prompt
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from bm25 import BM25_B, BM25_K1, tokenize
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RERANK_MODES = ("none", "lexical", "cross-encoder")
+
+
+class Reranker:
+    """
+    Re-ordena los candidatos de la búsqueda según su relevancia para la pregunta, en CPU:
+
+    - lexical:       BM25 de la pregunta sobre los candidatos (IDF calculado entre ellos),
+                     combinado por RRF con el orden de la búsqueda. Sin dependencias.
+    - cross-encoder: un cross-encoder pequeño de sentence-transformers (RERANKER_MODEL) que
+                     puntúa cada par (pregunta, fragmento). Requiere `pip install
+                     sentence-transformers`; sin el paquete se usa lexical.
+
+    Los candidatos se puntúan por lotes en el orden de la búsqueda y se deja de puntuar al
+    agotar RERANK_BUDGET_MS: los puntuados se ordenan y el resto sigue en su orden original,
+    así que la latencia agregada está acotada aunque el modelo vaya lento o haya carga.
+    Con el ranking mejorado se pueden mandar menos contextos al LLM (RERANK_TOP_K).
+    """
+
+    def __init__(
+        self,
+        mode: Optional[str] = None,
+        model_name: Optional[str] = None,
+        budget_ms: Optional[float] = None,
+        batch_size: Optional[int] = None,
+    ):
+        self.mode = (mode or os.getenv("RERANKER", "none")).lower()
+        if self.mode not in RERANK_MODES:
+            raise ValueError(f"RERANKER debe ser uno de {RERANK_MODES}, no '{self.mode}'")
+        self.model_name = model_name or os.getenv("RERANKER_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+        self.budget_ms = budget_ms if budget_ms is not None else float(os.getenv("RERANK_BUDGET_MS", "150"))
+        self.batch_size = batch_size or int(os.getenv("RERANK_BATCH_SIZE", "8"))
+        # contextos que se envían al LLM después de re-rankear (0 = el top_k de la consulta)
+        self.top_k = int(os.getenv("RERANK_TOP_K", "0"))
+        self.stats = {"calls": 0, "candidates": 0, "scored": 0, "budget_exceeded": 0, "total_ms": 0.0}
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "none"
+
+    def keep(self, top_k: int) -> int:
+        """Cantidad de contextos a conservar para una consulta con este top_k"""
+        return min(top_k, self.top_k) if self.enabled and self.top_k else top_k
+
+    def load(self) -> None:
+        """Carga el cross-encoder (una vez por proceso); si no está instalado pasa a lexical"""
+        if self.mode != "cross-encoder" or self._model is not None:
+            return
+        with self._lock:
+            if self._model is not None:
+                return
+            try:
+                from sentence_transformers import CrossEncoder
+            except ImportError:
+                logger.warning("sentence-transformers no está instalado: se usa el re-ranking lexical")
+                self.mode = "lexical"
+                return
+            started = time.perf_counter()
+            self._model = CrossEncoder(self.model_name, max_length=512, device="cpu")
+            logger.info(f"Cross-encoder {self.model_name} cargado en {time.perf_counter() - started:.1f}s")
+
+    @staticmethod
+    def _lexical_scores(question: str, texts: List[str]) -> List[float]:
+        # BM25 con estadísticas de los propios candidatos
+        terms = set(tokenize(question))
+        docs = [Counter(tokenize(text)) for text in texts]
+        avg_len = sum(sum(doc.values()) for doc in docs) / len(docs) or 1.0
+        df = {term: sum(1 for doc in docs if term in doc) for term in terms}
+        scores = []
+        for doc in docs:
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * sum(doc.values()) / avg_len)
+            score = 0.0
+            for term in terms:
+                tf = doc.get(term, 0)
+                if tf:
+                    idf = math.log(1 + (len(docs) - df[term] + 0.5) / (df[term] + 0.5))
+                    score += idf * tf * (BM25_K1 + 1) / (tf + norm)
+            scores.append(score)
+        return scores
+
+    def _cross_encoder_scores(self, question: str, texts: List[str]) -> List[float]:
+        with self._lock:
+            scores = self._model.predict([(question, text) for text in texts], batch_size=len(texts),
+                                         show_progress_bar=False)
+        return [float(score) for score in scores]
+
+    def rerank(self, question: str, hits: List[Dict]) -> List[Dict]:
+        """Devuelve los hits re-ordenados (con rerank_score en los que se llegaron a puntuar)"""
+        if not self.enabled or len(hits) < 2:
+            return hits
+        self.load()
+        started = time.perf_counter()
+        texts = [hit["text"] for hit in hits]
+
+        if self.mode == "lexical":
+            # es barato: se puntúan todos y se fusiona con el orden de la búsqueda
+            scores = self._lexical_scores(question, texts)
+            lexical_rank = {i: rank for rank, i in enumerate(sorted(range(len(hits)), key=lambda i: -scores[i]))}
+            fused = [1 / (60 + i) + 1 / (60 + lexical_rank[i]) for i in range(len(hits))]
+            scored = len(hits)
+        else:
+            fused = []
+            for start in range(0, len(hits), self.batch_size):
+                if (time.perf_counter() - started) * 1000 > self.budget_ms:
+                    self.stats["budget_exceeded"] += 1
+                    break
+                fused.extend(self._cross_encoder_scores(question, texts[start:start + self.batch_size]))
+            scored = len(fused)
+
+        order = sorted(range(scored), key=lambda i: -fused[i]) + list(range(scored, len(hits)))
+        result = []
+        for i in order:
+            hit = dict(hits[i])
+            if i < scored:
+                hit["rerank_score"] = round(fused[i], 6)
+            result.append(hit)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.stats["calls"] += 1
+        self.stats["candidates"] += len(hits)
+        self.stats["scored"] += scored
+        self.stats["total_ms"] += elapsed_ms
+        logger.info(f"Re-ranking {self.mode}: {scored}/{len(hits)} candidatos en {elapsed_ms:.1f}ms")
+        return result
+
+    async def arerank(self, question: str, hits: List[Dict]) -> List[Dict]:
+        """rerank() en un hilo: el cross-encoder es CPU y no debe bloquear el event loop"""
+        if not self.enabled or len(hits) < 2:
+            return hits
+        return await asyncio.to_thread(self.rerank, question, hits)
+
+    def get_stats(self) -> Dict:
+        calls = self.stats["calls"]
+        return {
+            "mode": self.mode,
+            "model": self.model_name if self.mode == "cross-encoder" else None,
+            "budget_ms": self.budget_ms,
+            "top_k": self.top_k or None,
+            **self.stats,
+            "total_ms": round(self.stats["total_ms"], 1),
+            "avg_ms": round(self.stats["total_ms"] / calls, 2) if calls else None,
+        }
@@ -1,11 +1,17 @@
 """
 Test de Análisis de Casos - Verificar capacidad del RAG
 Este script prueba si el sistema puede analizar casos complejos, no solo consultas simples
+
+Uso:
+    python test_case_analysis.py           # un caso a la vez contra /query
+    python test_case_analysis.py --batch   # todos los casos en una llamada a /query/batch
 """
 import requests
 import json
+import sys
 
 RAG_URL = "http://localhost:8000/query"
+RAG_BATCH_URL = "http://localhost:8000/query/batch"
 
 # Casos de prueba
 casos = [
@@ -63,57 +69,63 @@ casos = [
     }
 ]
 
-def test_caso(caso):
-    """Prueba un caso individual"""
+def mostrar_caso(caso):
     print("\n" + "="*80)
     print(f"CASO: {caso['nombre']}")
     print(f"TIPO: {caso['tipo'].upper()}")
     print("="*80)
+
+
+def evaluar_respuesta(caso, data):
+    """Muestra y evalúa la respuesta del RAG para un caso"""
+    print(f"\n✅ Respuesta recibida")
+    print(f"Contextos encontrados: {data.get('num_contexts', 0)}")
+    print(f"Fuentes: {', '.join(data.get('sources', []))}")
+
+    print(f"\n📄 RESPUESTA DEL ASISTENTE:")
+    print("-" * 80)
+    print(data.get('answer', 'Sin respuesta'))
+    print("-" * 80)
+
+    # Evaluar calidad de la respuesta
+    answer = data.get('answer', '')
+
+    if caso['tipo'] == 'simple':
+        # Para consultas simples, verificar que mencione el artículo
+        if 'artículo' in answer.lower() or 'articulo' in answer.lower():
+            print("\n✅ EVALUACIÓN: Respuesta contiene referencia a artículos")
+        else:
+            print("\n⚠️ EVALUACIÓN: Respuesta no menciona artículos específicos")
+
+    elif caso['tipo'] == 'caso_complejo':
+        # Para casos complejos, verificar análisis detallado
+        criterios = {
+            'menciona_articulos': any(x in answer.lower() for x in ['artículo', 'articulo', 'ley']),
+            'menciona_penas': any(x in answer.lower() for x in ['pena', 'sanción', 'años', 'prisión']),
+            'analisis_detallado': len(answer) > 300,
+            'menciona_procedimiento': any(x in answer.lower() for x in ['procedimiento', 'proceso', 'denuncia'])
+        }
+
+        print(f"\n📊 EVALUACIÓN DEL ANÁLISIS:")
+        for criterio, cumple in criterios.items():
+            status = "✅" if cumple else "❌"
+            print(f"   {status} {criterio.replace('_', ' ').title()}")
+
+        if all(criterios.values()):
+            print("\n✅ CONCLUSIÓN: El sistema puede analizar casos complejos")
+        else:
+            print("\n⚠️ CONCLUSIÓN: El análisis podría mejorar")
+
+
+def test_caso(caso):
+    """Prueba un caso individual"""
+    mostrar_caso(caso)
     
     try:
         response = requests.post(RAG_URL, json=caso['payload'], timeout=60)
         
         if response.status_code == 200:
-            data = response.json()
-            
-            print(f"\n✅ Respuesta recibida")
-            print(f"Contextos encontrados: {data.get('num_contexts', 0)}")
-            print(f"Fuentes: {', '.join(data.get('sources', []))}")
-            
-            print(f"\n📄 RESPUESTA DEL ASISTENTE:")
-            print("-" * 80)
-            print(data.get('answer', 'Sin respuesta'))
-            print("-" * 80)
-            
-            # Evaluar calidad de la respuesta
-            answer = data.get('answer', '')
-            
-            if caso['tipo'] == 'simple':
-                # Para consultas simples, verificar que mencione el artículo
-                if 'artículo' in answer.lower() or 'articulo' in answer.lower():
-                    print("\n✅ EVALUACIÓN: Respuesta contiene referencia a artículos")
-                else:
-                    print("\n⚠️ EVALUACIÓN: Respuesta no menciona artículos específicos")
-            
-            elif caso['tipo'] == 'caso_complejo':
-                # Para casos complejos, verificar análisis detallado
-                criterios = {
-                    'menciona_articulos': any(x in answer.lower() for x in ['artículo', 'articulo', 'ley']),
-                    'menciona_penas': any(x in answer.lower() for x in ['pena', 'sanción', 'años', 'prisión']),
-                    'analisis_detallado': len(answer) > 300,
-                    'menciona_procedimiento': any(x in answer.lower() for x in ['procedimiento', 'proceso', 'denuncia'])
-                }
-                
-                print(f"\n📊 EVALUACIÓN DEL ANÁLISIS:")
-                for criterio, cumple in criterios.items():
-                    status = "✅" if cumple else "❌"
-                    print(f"   {status} {criterio.replace('_', ' ').title()}")
-                
-                if all(criterios.values()):
-                    print("\n✅ CONCLUSIÓN: El sistema puede analizar casos complejos")
-                else:
-                    print("\n⚠️ CONCLUSIÓN: El análisis podría mejorar")
-            
+            evaluar_respuesta(caso, response.json())
             return True
             
         else:
@@ -125,6 +137,34 @@ def test_caso(caso):
         print(f"\n❌ EXCEPCIÓN: {e}")
         return False
 
+
+def test_lote(casos):
+    """Prueba todos los casos en una sola llamada a /query/batch; devuelve la cantidad de exitosos"""
+    payload = {"queries": [caso['payload'] for caso in casos]}
+    try:
+        response = requests.post(RAG_BATCH_URL, json=payload, timeout=600)
+    except Exception as e:
+        print(f"\n❌ EXCEPCIÓN: {e}")
+        return 0
+    if response.status_code != 200:
+        print(f"\n❌ ERROR: {response.status_code}")
+        print(f"Respuesta: {response.text}")
+        return 0
+    
+    data = response.json()
+    exitosos = 0
+    for caso, resultado in zip(casos, data['results']):
+        mostrar_caso(caso)
+        if 'error' in resultado:
+            print(f"\n❌ ERROR: {resultado['error']}")
+            continue
+        evaluar_respuesta(caso, resultado)
+        print(f"⏱️ {resultado['total_ms']:.0f} ms (caché: {resultado.get('cache')})")
+        exitosos += 1
+    print(f"\n⏱️ Tiempos del lote: {data['timings']}")
+    return exitosos
+
+
 def main():
     print("\n" + "="*80)
     print("TEST DE CAPACIDADES DEL RAG - CONSULTAS SIMPLES VS ANÁLISIS DE CASOS")
@@ -135,14 +175,18 @@ def main():
         "fallidos": 0
     }
     
-    for caso in casos:
-        success = test_caso(caso)
-        if success:
-            resultados["exitosos"] += 1
-        else:
-            resultados["fallidos"] += 1
-        
-        input("\nPresiona Enter para continuar con el siguiente caso...")
+    if "--batch" in sys.argv:
+        resultados["exitosos"] = test_lote(casos)
+        resultados["fallidos"] = len(casos) - resultados["exitosos"]
+    else:
+        for caso in casos:
+            success = test_caso(caso)
+            if success:
+                resultados["exitosos"] += 1
+            else:
+                resultados["fallidos"] += 1
+            
+            input("\nPresiona Enter para continuar con el siguiente caso...")
     
     # Resumen
     print("\n" + "="*80)
@@ -1,17 +1,85 @@
-from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams, Distance, PointStruct, Filter, FieldCondition, MatchValue
-from typing import List, Dict, Optional
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+from qdrant_client.models import (
+    VectorParams, Distance, PointStruct, Filter, FieldCondition, MatchValue, MatchAny,
+    DeleteOperation, PointIdsList, SetPayload, SetPayloadOperation, FilterSelector,
+    PayloadSchemaType, ScalarQuantization, ScalarQuantizationConfig, ScalarType, BinaryQuantization,
+    BinaryQuantizationConfig, Disabled, VectorParamsDiff, SearchParams, QuantizationSearchParams,
+    HnswConfigDiff, Prefetch, SparseVectorParams, SparseVector, Modifier, FusionQuery, Fusion,
+    QueryRequest, HasIdCondition, IsEmptyCondition, IsNullCondition, PayloadField,
+)
+from typing import Awaitable, Callable, List, Dict, Optional, TypeVar
+import httpx
 import logging
+import math
 import os
+import threading
+import time
+import uuid
+from datetime import datetime
 from dotenv import load_dotenv
 
+from bm25 import encode_document, encode_query
+from metrics import QDRANT_SECONDS, timed
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Los puntos de una re-ingesta incremental se escriben con staging=True y se publican todos
+# juntos al final; las lecturas los excluyen hasta entonces.
+STAGING_CONDITION = FieldCondition(key="staging", match=MatchValue(value=True))
+
+# cada cuánto (segundos) se vuelve a contar si quedan fragmentos sin el campo "article"
+ARTICLE_FIELD_RECHECK_SECONDS = 300
+
+# Índices de payload de la colección de fragmentos: cubren los filtros de /query (status,
+# category_ids, area y staging) y los de borrado, info y re-ingesta (doc_id). Sin índice, Qdrant
+# filtra leyendo el payload (on_disk) punto por punto.
+PAYLOAD_INDEXES = {
+    "doc_id": PayloadSchemaType.KEYWORD,
+    "status": PayloadSchemaType.KEYWORD,
+    "category_ids": PayloadSchemaType.INTEGER,
+    "area": PayloadSchemaType.KEYWORD,
+    "staging": PayloadSchemaType.BOOL,
+    "article": PayloadSchemaType.INTEGER,
+}
+
+# Modos de cuantización de vectores (QDRANT_QUANTIZATION)
+QUANTIZATION_MODES = ("none", "scalar", "binary")
+
+# Vectores con nombre de la búsqueda en dos etapas (EMBED_SEARCH_DIM): "search" es el prefijo
+# Matryoshka del embedding (indexado con HNSW) y "full" el embedding completo, que solo se usa
+# para reordenar los candidatos
+SEARCH_VECTOR = "search"
+FULL_VECTOR = "full"
+# Vector disperso de la búsqueda híbrida (HYBRID_SEARCH): términos del fragmento con pesos BM25
+SPARSE_VECTOR = "bm25"
+
+T = TypeVar("T")
+
+
+def truncate_embedding(vector: List[float], dim: int) -> List[float]:
+    """
+    Acorta un embedding de text-embedding-3 a sus primeras `dim` dimensiones y lo re-normaliza:
+    es el mismo vector que devuelve la API con dimensions=dim (representación Matryoshka).
+    """
+    head = vector[:dim]
+    norm = math.sqrt(sum(x * x for x in head)) or 1.0
+    return [x / norm for x in head]
+
 
 class QdrantStorage:
-    def __init__(self, url=None, collection=None, dim=3072):
+    """
+    Acceso a Qdrant con un cliente HTTP reutilizable (pool de conexiones keep-alive).
+
+    Está pensado para vivir una vez por proceso (ver get_storage): la existencia de
+    la colección se verifica una sola vez y se cachea, y si Qdrant se reinicia el
+    cliente se reconecta y reintenta la operación una vez.
+    """
+
+    def __init__(self, url=None, collection=None, dim=None, bootstrap=True, quantization=None, vectors_on_disk=None,
+                 search_dim=None):
         # Cargar configuración desde variables de entorno
         if url is None:
             qdrant_host = os.getenv("QDRANT_HOST", "127.0.0.1")
@@ -20,95 +88,542 @@ class QdrantStorage:
         
         if collection is None:
             collection = os.getenv("QDRANT_COLLECTION", "docs")
-        self.client = QdrantClient(url=url, timeout=30)
+        self.url = url
         self.collection = collection
-        
-        # Crear colección si no existe
-        if not self.client.collection_exists(self.collection):
-            self.client.create_collection(
-                collection_name=self.collection,
-                vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
+        self.catalog_collection = f"{collection}_catalog"
+        # True si este proceso creó el catálogo y aún no terminó de reconstruirlo desde los fragmentos
+        self.catalog_created = False
+        self._catalog_rebuild: Optional[threading.Thread] = None
+        # Dimensión de los embeddings (EMBED_DIM, la misma que pide data_loader a OpenAI) y, para
+        # la búsqueda en dos etapas, dimensión del primer paso (EMBED_SEARCH_DIM; 0 = desactivada)
+        self.dim = dim or int(os.getenv("EMBED_DIM", "3072"))
+        if search_dim is None:
+            search_dim = int(os.getenv("EMBED_SEARCH_DIM", "0"))
+        if search_dim and not 0 < search_dim < self.dim:
+            raise ValueError(f"EMBED_SEARCH_DIM debe ser menor que EMBED_DIM ({self.dim}), no {search_dim}")
+        self.search_dim = search_dim
+        # candidatos del primer paso por cada resultado final
+        self.search_candidates = int(os.getenv("EMBED_SEARCH_CANDIDATES", "8"))
+        # Búsqueda híbrida: el vector denso y el disperso (BM25) se consultan en el mismo request
+        # y se fusionan por RRF. Solo se activa si la colección tiene el vector disperso.
+        self.hybrid_requested = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+        self.hybrid = self.hybrid_requested
+        self.pid = os.getpid()
+        self.max_connections = int(os.getenv("QDRANT_POOL_MAX_CONNECTIONS", "20"))
+        self.max_keepalive = int(os.getenv("QDRANT_POOL_MAX_KEEPALIVE", "10"))
+        # Cuantización: "scalar" guarda una copia int8 de los vectores (4 veces menos memoria) y
+        # "binary" una de 1 bit por dimensión (32 veces menos). La búsqueda recorre la copia
+        # cuantizada pidiendo oversampling * top_k candidatos y, con rescore, los reordena con
+        # los vectores originales, que pueden quedar en disco (QDRANT_VECTORS_ON_DISK).
+        self.quantization = (quantization or os.getenv("QDRANT_QUANTIZATION", "none")).lower()
+        if self.quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"QDRANT_QUANTIZATION debe ser uno de {QUANTIZATION_MODES}, no '{self.quantization}'")
+        if vectors_on_disk is None:
+            vectors_on_disk = os.getenv("QDRANT_VECTORS_ON_DISK", "false").lower() == "true"
+        self.vectors_on_disk = vectors_on_disk
+        self.quantization_always_ram = os.getenv("QDRANT_QUANTIZATION_ALWAYS_RAM", "true").lower() == "true"
+        self.search_rescore = os.getenv("QDRANT_SEARCH_RESCORE", "true").lower() == "true"
+        self.search_oversampling = float(os.getenv("QDRANT_SEARCH_OVERSAMPLING", "2.0"))
+        self.stats = {"requests": 0, "errors": 0, "reconnects": 0, "bootstraps": 0}
+        self._lock = threading.Lock()
+        self._collection_ready = False
+        # (momento del último conteo, todos los fragmentos tienen "article")
+        self._article_field = (float("-inf"), False)
+        self.client = self._connect()
+        # Cliente asíncrono para el camino de consulta; se crea en el primer uso
+        self._aclient: Optional[AsyncQdrantClient] = None
+
+        # Crear colección si no existe (una sola vez por proceso)
+        if bootstrap:
+            self.ensure_collection()
+
+    def _limits(self) -> httpx.Limits:
+        # Qdrant desactiva keep-alive para localhost por defecto; aquí queremos
+        # reutilizar conexiones siempre, por eso se pasan límites explícitos.
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive,
+        )
+
+    def _connect(self) -> QdrantClient:
+        return QdrantClient(url=self.url, timeout=30, limits=self._limits())
+
+    @property
+    def aclient(self) -> AsyncQdrantClient:
+        if self._aclient is None:
+            self._aclient = AsyncQdrantClient(url=self.url, timeout=30, limits=self._limits())
+        return self._aclient
+
+    def ensure_collection(self) -> None:
+        """Crea la colección si no existe. El resultado se cachea en el proceso."""
+        if self._collection_ready:
+            return
+        with self._lock:
+            if self._collection_ready:
+                return
+            if not self.client.collection_exists(self.collection):
+                self.client.create_collection(
+                    collection_name=self.collection,
+                    vectors_config=self._vectors_config(),
+                    sparse_vectors_config=self._sparse_vectors_config(),
+                    quantization_config=self._quantization_config(),
+                )
+                logger.info(f"Colección '{self.collection}' creada")
+            if not self.client.collection_exists(self.catalog_collection):
+                try:
+                    # colección sin vectores: solo un registro (payload) por documento
+                    self.client.create_collection(collection_name=self.catalog_collection, vectors_config={})
+                    self.catalog_created = True
+                    logger.info(f"Catálogo '{self.catalog_collection}' creado")
+                    self._schedule_catalog_rebuild()
+                except UnexpectedResponse as e:
+                    # Otro worker pudo crearlo primero
+                    if e.status_code != 409:
+                        raise
+            info = self.client.get_collection(self.collection)
+            self._check_layout(info)
+            self._create_missing_indexes(info.payload_schema)
+            updates = self._collection_updates(info)
+            if updates:
+                self.client.update_collection(self.collection, **updates)
+                logger.info(f"Configuración de vectores de '{self.collection}' actualizada: {self._vector_mode()}")
+            self.stats["bootstraps"] += 1
+            self._collection_ready = True
+
+    async def aensure_collection(self) -> None:
+        """Igual que ensure_collection() pero sin bloquear el event loop."""
+        if self._collection_ready:
+            return
+        if not await self.aclient.collection_exists(self.collection):
+            try:
+                await self.aclient.create_collection(
+                    collection_name=self.collection,
+                    vectors_config=self._vectors_config(),
+                    sparse_vectors_config=self._sparse_vectors_config(),
+                    quantization_config=self._quantization_config(),
+                )
+                logger.info(f"Colección '{self.collection}' creada")
+            except UnexpectedResponse as e:
+                # Otra petición concurrente pudo crearla primero
+                if e.status_code != 409:
+                    raise
+        if not await self.aclient.collection_exists(self.catalog_collection):
+            try:
+                await self.aclient.create_collection(collection_name=self.catalog_collection, vectors_config={})
+                self.catalog_created = True
+                logger.info(f"Catálogo '{self.catalog_collection}' creado")
+                self._schedule_catalog_rebuild()
+            except UnexpectedResponse as e:
+                if e.status_code != 409:
+                    raise
+        info = await self.aclient.get_collection(self.collection)
+        self._check_layout(info)
+        for field in self._missing_indexes(info.payload_schema):
+            await self.aclient.create_payload_index(
+                self.collection, field_name=field, field_schema=PAYLOAD_INDEXES[field], wait=False
+            )
+            logger.info(f"Índice de payload '{field}' creado en '{self.collection}'")
+        updates = self._collection_updates(info)
+        if updates:
+            await self.aclient.update_collection(self.collection, **updates)
+            logger.info(f"Configuración de vectores de '{self.collection}' actualizada: {self._vector_mode()}")
+        self.stats["bootstraps"] += 1
+        self._collection_ready = True
+
+    def _vectors_config(self):
+        if not self.search_dim:
+            return VectorParams(size=self.dim, distance=Distance.COSINE, on_disk=self.vectors_on_disk)
+        # el vector completo no necesita grafo HNSW (m=0): solo se lee para reordenar candidatos
+        return {
+            SEARCH_VECTOR: VectorParams(size=self.search_dim, distance=Distance.COSINE),
+            FULL_VECTOR: VectorParams(
+                size=self.dim, distance=Distance.COSINE, on_disk=self.vectors_on_disk, hnsw_config=HnswConfigDiff(m=0)
+            ),
+        }
+
+    def _sparse_vectors_config(self) -> Optional[Dict]:
+        if not self.hybrid_requested:
+            return None
+        # Qdrant calcula el IDF de cada término al buscar, con las estadísticas de la colección
+        return {SPARSE_VECTOR: SparseVectorParams(modifier=Modifier.IDF)}
+
+    def _layout(self) -> Dict[str, int]:
+        if not self.search_dim:
+            return {"": self.dim}
+        return {SEARCH_VECTOR: self.search_dim, FULL_VECTOR: self.dim}
+
+    def _check_layout(self, info) -> None:
+        """Avisa si la colección existente tiene otras dimensiones que las del entorno"""
+        params = info.config.params.vectors
+        if isinstance(params, VectorParams):
+            current = {"": params.size}
+        else:
+            current = {name: vector.size for name, vector in (params or {}).items()}
+        if current != self._layout():
+            logger.error(
+                f"La colección '{self.collection}' tiene vectores {current} y el entorno pide {self._layout()} "
+                f"(EMBED_DIM/EMBED_SEARCH_DIM): migrar con `python migrate_embeddings.py --target <colección>`"
+            )
+        self.hybrid = self.hybrid_requested and SPARSE_VECTOR in (info.config.params.sparse_vectors or {})
+        if self.hybrid_requested and not self.hybrid:
+            logger.warning(
+                f"La colección '{self.collection}' no tiene el vector disperso '{SPARSE_VECTOR}': búsqueda solo "
+                f"densa hasta migrarla con `python migrate_embeddings.py --target <colección>`"
+            )
+
+    def point_vector(self, vector: List[float], text: Optional[str] = None):
+        """Vector (o vectores con nombre) de un punto a partir del embedding completo y su texto"""
+        if not self.search_dim:
+            dense = {"": vector}
+        else:
+            dense = {SEARCH_VECTOR: truncate_embedding(vector, self.search_dim), FULL_VECTOR: vector}
+        indices, values = encode_document(text) if self.hybrid and text else ([], [])
+        if not indices:
+            return dense.get("", dense)
+        return {**dense, SPARSE_VECTOR: SparseVector(indices=indices, values=values)}
+
+    def _quantization_config(self):
+        if self.quantization == "scalar":
+            return ScalarQuantization(scalar=ScalarQuantizationConfig(
+                type=ScalarType.INT8, quantile=0.99, always_ram=self.quantization_always_ram
+            ))
+        if self.quantization == "binary":
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=self.quantization_always_ram))
+        return None
+
+    def _vector_mode(self) -> Dict:
+        return {
+            "quantization": self.quantization,
+            "vectors_on_disk": self.vectors_on_disk,
+            "dim": self.dim,
+            "search_dim": self.search_dim or None,
+            "hybrid": self.hybrid,
+        }
+
+    def _collection_updates(self, info) -> Dict:
+        """
+        Diferencias entre la configuración de vectores pedida por el entorno y la de la colección
+        existente, como argumentos de update_collection (migración al arrancar). Qdrant cuantiza
+        o mueve los vectores a disco en segundo plano con el optimizador.
+        """
+        updates = {}
+        params = info.config.params.vectors
+        if isinstance(params, dict):
+            name, params = FULL_VECTOR, params.get(FULL_VECTOR)
+        else:
+            name = ""
+        if isinstance(params, VectorParams) and bool(params.on_disk) != self.vectors_on_disk:
+            updates["vectors_config"] = {name: VectorParamsDiff(on_disk=self.vectors_on_disk)}
+        current = info.config.quantization_config
+        if isinstance(current, ScalarQuantization):
+            current_mode = "scalar"
+        elif isinstance(current, BinaryQuantization):
+            current_mode = "binary"
+        else:
+            current_mode = "none" if current is None else "other"
+        if current_mode != self.quantization:
+            updates["quantization_config"] = self._quantization_config() or Disabled.DISABLED
+        return updates
+
+    def _search_params(self) -> Optional[SearchParams]:
+        if self.quantization == "none":
+            return None
+        return SearchParams(quantization=QuantizationSearchParams(
+            rescore=self.search_rescore, oversampling=self.search_oversampling
+        ))
+
+    @staticmethod
+    def _missing_indexes(payload_schema: Optional[Dict]) -> List[str]:
+        return [field for field in PAYLOAD_INDEXES if field not in (payload_schema or {})]
+
+    def _create_missing_indexes(self, payload_schema: Optional[Dict]) -> List[str]:
+        """
+        Crea los índices de PAYLOAD_INDEXES que falten en la colección. En una colección nueva
+        es inmediato; en una existente (migración) Qdrant los construye en segundo plano
+        (wait=False) sin bloquear el arranque. Crear un índice que ya existe no falla, así que
+        varios workers pueden hacerlo a la vez.
+        """
+        missing = self._missing_indexes(payload_schema)
+        for field in missing:
+            self.client.create_payload_index(
+                self.collection, field_name=field, field_schema=PAYLOAD_INDEXES[field], wait=False
             )
-            logger.info(f"Colección '{self.collection}' creada")
+            logger.info(f"Índice de payload '{field}' creado en '{self.collection}'")
+        return missing
+
+    def payload_indexes(self) -> Dict:
+        """Índices de payload de la colección: {campo: {tipo, puntos indexados}}"""
+        info = self._run(lambda c: c.get_collection(self.collection))
+        return {
+            field: {"type": str(schema.data_type.value), "points": schema.points}
+            for field, schema in (info.payload_schema or {}).items()
+        }
+
+    async def areconnect(self) -> None:
+        """Reconexión del cliente asíncrono (y del síncrono, que comparte el estado)."""
+        if self._aclient is not None:
+            try:
+                await self._aclient.close()
+            except Exception:
+                pass
+            self._aclient = None
+        self.reconnect()
+
+    def reconnect(self) -> None:
+        """Cierra el cliente actual y abre uno nuevo (p. ej. tras un reinicio de Qdrant)."""
+        with self._lock:
+            try:
+                self.client.close()
+            except Exception:
+                pass
+            self.client = self._connect()
+            self._collection_ready = False
+            self.stats["reconnects"] += 1
+        logger.warning(f"Reconectado a Qdrant en {self.url}")
+
+    def close(self) -> None:
+        self.client.close()
+
+    async def aclose(self) -> None:
+        self.client.close()
+        if self._aclient is not None:
+            await self._aclient.close()
+            self._aclient = None
+
+    def _run(self, operation: Callable[[QdrantClient], T]) -> T:
+        """
+        Ejecuta una operación contra Qdrant.
+        Si la conexión se cae, o la colección desapareció porque Qdrant se reinició
+        sin datos, se reconecta/re-crea la colección y se reintenta una vez.
+        """
+        self.stats["requests"] += 1
+        try:
+            self.ensure_collection()
+            return operation(self.client)
+        except (ResponseHandlingException, httpx.TransportError) as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Fallo de conexión con Qdrant ({e}), reintentando")
+            self.reconnect()
+        except UnexpectedResponse as e:
+            self.stats["errors"] += 1
+            if e.status_code != 404:
+                raise
+            logger.warning(f"Colección '{self.collection}' no encontrada, re-creando")
+            self._collection_ready = False
+        self.ensure_collection()
+        return operation(self.client)
+
+    async def _arun(self, operation: Callable[[AsyncQdrantClient], Awaitable[T]]) -> T:
+        """Equivalente asíncrono de _run() usando el cliente AsyncQdrantClient"""
+        self.stats["requests"] += 1
+        try:
+            await self.aensure_collection()
+            return await operation(self.aclient)
+        except (ResponseHandlingException, httpx.TransportError) as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Fallo de conexión con Qdrant ({e}), reintentando")
+            await self.areconnect()
+        except UnexpectedResponse as e:
+            self.stats["errors"] += 1
+            if e.status_code != 404:
+                raise
+            logger.warning(f"Colección '{self.collection}' no encontrada, re-creando")
+            self._collection_ready = False
+        await self.aensure_collection()
+        return await operation(self.aclient)
+
+    def pool_stats(self) -> Dict:
+        """Estadísticas del cliente y de su pool de conexiones HTTP."""
+        stats = {
+            "pid": self.pid,
+            "url": self.url,
+            "collection": self.collection,
+            "collection_ready": self._collection_ready,
+            "max_connections": self.max_connections,
+            "max_keepalive_connections": self.max_keepalive,
+            **self._vector_mode(),
+            **self.stats,
+        }
+        stats["sync_pool"] = self._http_pool_stats(
+            lambda: self.client._client.openapi_client.client._client
+        )
+        stats["async_pool"] = self._http_pool_stats(
+            lambda: self._aclient._client.openapi_client.client._async_client
+        )
+        return stats
+
+    @staticmethod
+    def _http_pool_stats(get_http_client: Callable) -> Optional[Dict]:
+        try:
+            # httpx no expone el pool públicamente; se lee del transporte de httpcore
+            connections = list(get_http_client()._transport._pool.connections)
+        except AttributeError:
+            return None
+        idle = sum(1 for c in connections if c.is_idle())
+        return {
+            "connections": len(connections),
+            "idle_connections": idle,
+            "active_connections": len(connections) - idle,
+        }
 
     def delete_all(self) -> None:
-        """Elimina completamente la colección actual (todos los puntos)."""
+        """Elimina completamente la colección actual (todos los puntos) y su catálogo."""
         if self.client.collection_exists(self.collection):
             self.client.delete_collection(self.collection)
             logger.info(f"Colección '{self.collection}' eliminada completamente")
+        if self.client.collection_exists(self.catalog_collection):
+            self.client.delete_collection(self.catalog_collection)
+        # La próxima operación volverá a crear la colección
+        self._collection_ready = False
 
-    def upsert(self, ids: List[str], vectors: List[List[float]], payloads: List[Dict], batch_size: int = 200):
+    def upsert(
+        self,
+        ids: List[str],
+        vectors: List[List[float]],
+        payloads: List[Dict],
+        batch_size: int = 200,
+        on_batch: Optional[Callable[[int], None]] = None,
+    ):
         """Inserta o actualiza puntos en la colección en lotes (batches).
 
         :param ids: Lista de IDs de puntos.
         :param vectors: Lista de vectores (embeddings).
         :param payloads: Lista de payloads asociados a cada punto.
         :param batch_size: Tamaño del lote para enviar a Qdrant.
+        :param on_batch: Se llama con la cantidad de puntos ya enviados tras cada lote.
         """
         total = len(ids)
         if not (len(vectors) == total and len(payloads) == total):
             raise ValueError("Las listas ids, vectors y payloads deben tener el mismo tamaño")
 
         logger.info(f"Iniciando upsert de {total} puntos en lotes de hasta {batch_size}")
+        # la forma de los vectores (con nombre, dispersos) depende de la colección
+        self.ensure_collection()
 
         for start in range(0, total, batch_size):
             end = min(start + batch_size, total)
             batch_points = [
-                PointStruct(id=ids[i], vector=vectors[i], payload=payloads[i])
+                PointStruct(id=ids[i], vector=self.point_vector(vectors[i], payloads[i].get("text")), payload=payloads[i])
                 for i in range(start, end)
             ]
-            self.client.upsert(self.collection, points=batch_points)
+            with timed(QDRANT_SECONDS, "upsert"):
+                self._run(lambda c: c.upsert(self.collection, points=batch_points))
             logger.info(f"Upsert de lote {start}-{end - 1} completado ({len(batch_points)} puntos)")
+            if on_batch is not None:
+                on_batch(end)
 
         logger.info(f"Upsert total de {total} puntos completado en lotes")
 
+    def document_chunk_state(self, doc_id: str, page_size: int = 1000) -> Dict[str, Dict]:
+        """
+        Estado guardado de los fragmentos de un documento, para la re-ingesta incremental:
+        {point_id: {"chunk_key", "content_hash", "chunk_index", "staging", "article"}}. Recorre el
+        documento paginando con scroll y sin traer vectores.
+        """
+        state = {}
+        offset = None
+        doc_filter = self._doc_filter(doc_id)
+        while True:
+            points, offset = self._run(lambda c: c.scroll(
+                collection_name=self.collection,
+                scroll_filter=doc_filter,
+                limit=page_size,
+                offset=offset,
+                with_payload=["chunk_key", "content_hash", "chunk_index", "staging", "article"],
+                with_vectors=False
+            ))
+            for point in points:
+                state[str(point.id)] = point.payload or {}
+            if offset is None:
+                return state
+
+    def publish_document(
+        self,
+        doc_id: str,
+        delete_ids: List[str],
+        shared_payload: Dict,
+        point_updates: Dict[str, Dict],
+    ) -> None:
+        """
+        Cierra una re-ingesta incremental en un único request batch_update_points:
+        1. actualiza la metadata común y quita staging a los puntos del documento que se
+           conservan (los que se van a borrar no se publican),
+        2. corrige el payload de los fragmentos sin cambios (chunk_index desplazado, número de artículo),
+        3. borra los puntos reemplazados o eliminados (y restos de ingestas fallidas).
+        Qdrant aplica las operaciones en orden, pero cada una es visible por separado: con este
+        orden un lector nunca ve un fragmento faltante (la versión nueva se publica antes de
+        borrar la vieja); como mucho, durante un instante, ve ambas versiones de un fragmento
+        modificado.
+        """
+        doc_filter = self._doc_filter(doc_id)
+        if delete_ids:
+            doc_filter.must_not = [HasIdCondition(has_id=delete_ids)]
+        operations = [SetPayloadOperation(
+            set_payload=SetPayload(payload={**shared_payload, "staging": False}, filter=doc_filter)
+        )]
+        operations.extend(
+            SetPayloadOperation(set_payload=SetPayload(payload=payload, points=[point_id]))
+            for point_id, payload in point_updates.items()
+        )
+        if delete_ids:
+            operations.append(DeleteOperation(delete=PointIdsList(points=delete_ids)))
+        self._run(lambda c: c.batch_update_points(self.collection, update_operations=operations))
+        logger.info(
+            f"Documento {doc_id} publicado: {len(delete_ids)} puntos eliminados, "
+            f"{len(point_updates)} fragmentos sin cambios actualizados"
+        )
+
     def delete_document(self, doc_id: str) -> int:
         """
         Elimina físicamente todos los puntos de un documento
         Retorna la cantidad de puntos eliminados
+
+        El borrado se hace en el servidor con un filtro por doc_id (sin traer los IDs a Python),
+        así que no depende del tamaño del documento; la cantidad sale de un count exacto previo.
         """
-        # Obtener IDs de los puntos a eliminar
-        scroll_result = self.client.scroll(
+        doc_filter = self._doc_filter(doc_id)
+        count = self._run(lambda c: c.count(
             collection_name=self.collection,
-            scroll_filter=Filter(
-                must=[FieldCondition(key="doc_id", match=MatchValue(value=doc_id))]
-            ),
-            limit=10000,  # Ajustar según necesidad
-            with_payload=False,
-            with_vectors=False
-        )
-        
-        points_to_delete = scroll_result[0]
+            count_filter=doc_filter,
+            exact=True
+        )).count
         
-        if not points_to_delete:
+        if count == 0:
             logger.warning(f"No se encontraron puntos para doc_id: {doc_id}")
+            self.catalog_delete(doc_id)
             return 0
         
-        point_ids = [p.id for p in points_to_delete]
-        
         # Eliminar puntos
-        self.client.delete(
+        self._run(lambda c: c.delete(
             collection_name=self.collection,
-            points_selector=point_ids
-        )
+            points_selector=FilterSelector(filter=doc_filter),
+            wait=True
+        ))
+        self.catalog_delete(doc_id)
         
-        count = len(point_ids)
         logger.info(f"Eliminados {count} puntos del documento {doc_id}")
         return count
 
-    def search(
-        self, 
-        query_vector: List[float], 
-        top_k: int = 5,
+    def count_document(self, doc_id: str) -> int:
+        """Cantidad exacta de puntos de un documento"""
+        return self._run(lambda c: c.count(
+            collection_name=self.collection,
+            count_filter=self._doc_filter(doc_id),
+            exact=True
+        )).count
+
+    @staticmethod
+    def _doc_filter(doc_id: str) -> Filter:
+        return Filter(must=[FieldCondition(key="doc_id", match=MatchValue(value=doc_id))])
+
+    def _build_filter(
+        self,
         area: Optional[str] = None,
         doc_id: Optional[str] = None,
         status: Optional[str] = "active",
         category_ids: Optional[List[int]] = None
-    ) -> Dict:
-        """
-        Búsqueda vectorial con filtros opcionales
-        """
-        # Construir filtros
+    ) -> Optional[Filter]:
+        """Construye el filtro de Qdrant a partir de los filtros opcionales de la consulta"""
         filter_conditions = []
         
         if area:
@@ -129,26 +644,20 @@ class QdrantStorage:
         if category_ids:
             # En Qdrant, si guardamos un array, podemos buscar si contiene alguno de estos valores
             # Usamos MatchAny para comparar contra una lista de valores
-            from qdrant_client.models import MatchAny
             filter_conditions.append(
                 FieldCondition(key="category_ids", match=MatchAny(any=category_ids))
             )
         
-        # Aplicar filtros si existen
-        query_filter = Filter(must=filter_conditions) if filter_conditions else None
-        
-        # Realizar búsqueda
-        results = self.client.search(
-            collection_name=self.collection,
-            query_vector=query_vector,
-            query_filter=query_filter,
-            with_payload=True,
-            limit=top_k
-        )
-        
+        # Los puntos en staging (re-ingesta en curso) nunca se devuelven
+        return Filter(must=filter_conditions or None, must_not=[STAGING_CONDITION])
+
+    @staticmethod
+    def _format_results(results) -> Dict:
+        """Convierte los puntos encontrados en contextos, fuentes y doc_ids"""
         contexts = []
         sources = set()
         doc_ids = set()
+        hits = []
         
         for r in results:
             payload = getattr(r, "payload", None) or {}
@@ -158,6 +667,14 @@ class QdrantStorage:
             
             if text:
                 contexts.append(text)
+                hits.append({
+                    "id": str(r.id),
+                    "score": getattr(r, "score", None),
+                    "text": text,
+                    "source": source,
+                    "doc_id": doc_id_val,
+                    "chunk_index": payload.get("chunk_index"),
+                })
                 if source:
                     sources.add(source)
                 if doc_id_val:
@@ -166,72 +683,428 @@ class QdrantStorage:
         return {
             "contexts": contexts,
             "sources": list(sources),
-            "doc_ids": list(doc_ids)
+            "doc_ids": list(doc_ids),
+            "hits": hits
+        }
+
+    def _dense_query(self, query_vector: List[float], query_filter: Optional[Filter], limit: int) -> Dict:
+        """Parte densa de la búsqueda como argumentos de Prefetch/query_points"""
+        if not self.search_dim:
+            return {"query": query_vector, "filter": query_filter, "params": self._search_params(), "limit": limit}
+        # dos etapas: el prefetch recorre el índice HNSW del vector corto (con filtros y
+        # cuantización) y trae limit * EMBED_SEARCH_CANDIDATES candidatos, que se reordenan
+        # con el vector completo
+        return {
+            "prefetch": Prefetch(
+                query=truncate_embedding(query_vector, self.search_dim),
+                using=SEARCH_VECTOR,
+                filter=query_filter,
+                params=self._search_params(),
+                limit=limit * self.search_candidates,
+            ),
+            "query": query_vector,
+            "using": FULL_VECTOR,
+            "limit": limit,
         }
 
+    def _query(
+        self,
+        query_vector: List[float],
+        query_filter: Optional[Filter],
+        top_k: int,
+        query_text: Optional[str] = None,
+    ) -> Dict:
+        """
+        Argumentos de query_points para una búsqueda. Con búsqueda híbrida y el texto de la
+        pregunta, los top_k resultados del vector denso y los del disperso (BM25) se fusionan
+        por RRF: un fragmento con los términos exactos de la pregunta (p. ej. "artículo 150")
+        entra aunque su embedding no esté entre los más cercanos.
+        """
+        indices, values = encode_query(query_text) if self.hybrid and query_text else ([], [])
+        if not indices:
+            return self._dense_query(query_vector, query_filter, top_k)
+        return {
+            "prefetch": [
+                Prefetch(**self._dense_query(query_vector, query_filter, top_k)),
+                Prefetch(
+                    query=SparseVector(indices=indices, values=values),
+                    using=SPARSE_VECTOR,
+                    filter=query_filter,
+                    limit=top_k,
+                ),
+            ],
+            "query": FusionQuery(fusion=Fusion.RRF),
+            "limit": top_k,
+        }
+
+    def _search(
+        self,
+        client,
+        query_vector: List[float],
+        query_filter: Optional[Filter],
+        top_k: int,
+        query_text: Optional[str] = None,
+    ):
+        """
+        Búsqueda con el cliente síncrono o asíncrono (devuelve el resultado o la corrutina),
+        siempre en un solo request a Qdrant (ver _query)
+        """
+        query = self._query(query_vector, query_filter, top_k, query_text)
+        if "prefetch" in query:
+            return client.query_points(collection_name=self.collection, **query, with_payload=True)
+        return client.search(
+            collection_name=self.collection,
+            query_vector=query_vector,
+            query_filter=query_filter,
+            search_params=self._search_params(),
+            with_payload=True,
+            limit=top_k
+        )
+
+    def search(
+        self, 
+        query_vector: List[float], 
+        top_k: int = 5,
+        area: Optional[str] = None,
+        doc_id: Optional[str] = None,
+        status: Optional[str] = "active",
+        category_ids: Optional[List[int]] = None,
+        query_text: Optional[str] = None
+    ) -> Dict:
+        """
+        Búsqueda vectorial con filtros opcionales (híbrida con BM25 si se pasa query_text)
+        """
+        query_filter = self._build_filter(area, doc_id, status, category_ids)
+        
+        # Realizar búsqueda
+        with timed(QDRANT_SECONDS, "search"):
+            results = self._run(lambda c: self._search(c, query_vector, query_filter, top_k, query_text))
+        
+        return self._format_results(getattr(results, "points", results))
+
+    async def asearch(
+        self, 
+        query_vector: List[float], 
+        top_k: int = 5,
+        area: Optional[str] = None,
+        doc_id: Optional[str] = None,
+        status: Optional[str] = "active",
+        category_ids: Optional[List[int]] = None,
+        query_text: Optional[str] = None
+    ) -> Dict:
+        """
+        Versión asíncrona de search(): no bloquea el event loop mientras espera a Qdrant
+        """
+        query_filter = self._build_filter(area, doc_id, status, category_ids)
+        
+        with timed(QDRANT_SECONDS, "search"):
+            results = await self._arun(lambda c: self._search(c, query_vector, query_filter, top_k, query_text))
+        
+        return self._format_results(getattr(results, "points", results))
+
+    async def asearch_batch(self, queries: List[Dict]) -> List[Dict]:
+        """
+        Varias búsquedas en un solo request a Qdrant (query_batch_points), para consultas en
+        lote. Cada consulta es un dict con los argumentos de asearch() (query_vector, top_k,
+        area, doc_id, status, category_ids, query_text); los resultados vienen en el mismo orden.
+        """
+        if not queries:
+            return []
+
+        def requests() -> List[QueryRequest]:
+            # se arman dentro de la operación: el modo híbrido se conoce al verificar la colección
+            return [
+                QueryRequest(
+                    **self._query(
+                        query["query_vector"],
+                        self._build_filter(
+                            query.get("area"), query.get("doc_id"), query.get("status", "active"),
+                            query.get("category_ids")
+                        ),
+                        query.get("top_k", 5),
+                        query.get("query_text"),
+                    ),
+                    with_payload=True,
+                )
+                for query in queries
+            ]
+
+        with timed(QDRANT_SECONDS, "search_batch"):
+            results = await self._arun(lambda c: c.query_batch_points(
+                collection_name=self.collection,
+                requests=requests()
+            ))
+        return [self._format_results(result.points) for result in results]
+
+    async def afetch_articles(
+        self,
+        articles: List[int],
+        limit: int,
+        area: Optional[str] = None,
+        doc_id: Optional[str] = None,
+        status: Optional[str] = "active",
+        category_ids: Optional[List[int]] = None
+    ) -> Dict:
+        """
+        Fragmentos de los artículos pedidos, por filtro sobre el payload indexado "article"
+        (sin embedding ni búsqueda vectorial). Los resultados vienen en el orden de `articles`
+        y, dentro de cada artículo, por documento y parte; score es None.
+
+        Además del resultado de _format_results devuelve:
+        - doc_ids: todos los documentos con esos artículos dentro del filtro; si el scroll llenó
+          `limit` se completan con un facet sobre doc_id (el límite pudo dejar afuera a otros).
+        - article_field_complete: False si algún fragmento del filtro no tiene el campo
+          "article" (ingestado antes de que existiera): esos documentos no aparecerían aquí.
+        """
+        base_filter = self._build_filter(area, doc_id, status, category_ids)
+        query_filter = Filter(
+            must=(base_filter.must or []) + [FieldCondition(key="article", match=MatchAny(any=articles))],
+            must_not=base_filter.must_not,
+        )
+        with timed(QDRANT_SECONDS, "fetch_articles"):
+            complete = await self._aarticle_field_complete(base_filter)
+            points, _ = await self._arun(lambda c: c.scroll(
+                collection_name=self.collection,
+                scroll_filter=query_filter,
+                limit=limit,
+                with_payload=True,
+                with_vectors=False
+            ))
+            doc_ids = None
+            if len(points) >= limit and not doc_id:
+                facet = await self._arun(lambda c: c.facet(
+                    collection_name=self.collection, key="doc_id", facet_filter=query_filter, limit=2
+                ))
+                doc_ids = [hit.value for hit in facet.hits]
+        order = {article: position for position, article in enumerate(articles)}
+        points.sort(key=lambda p: (
+            order[p.payload["article"]], p.payload.get("doc_id", ""), p.payload.get("article_part") or 0
+        ))
+        found = self._format_results(points)
+        if doc_ids is not None:
+            found["doc_ids"] = list(dict.fromkeys(found["doc_ids"] + doc_ids))
+        found["article_field_complete"] = complete
+        return found
+
+    async def _aarticle_field_complete(self, base_filter: Filter) -> bool:
+        """
+        True si todos los fragmentos del filtro tienen el campo "article" (con valor o null en
+        el preámbulo). Los que no lo tienen se ingestaron antes de que existiera y lo reciben
+        en su próxima re-ingesta. Se cuenta en toda la colección cada
+        ARTICLE_FIELD_RECHECK_SECONDS; solo si faltan se cuenta además dentro del filtro.
+        """
+        def missing_filter(base: Optional[Filter]) -> Filter:
+            return Filter(
+                must=((base.must or []) if base else []) + [IsEmptyCondition(is_empty=PayloadField(key="article"))],
+                must_not=((base.must_not or []) if base else []) + [IsNullCondition(is_null=PayloadField(key="article"))],
+            )
+
+        async def count_missing(base: Optional[Filter]) -> int:
+            result = await self._arun(lambda c: c.count(
+                collection_name=self.collection, count_filter=missing_filter(base), exact=True
+            ))
+            return result.count
+
+        checked_at, complete = self._article_field
+        if time.monotonic() - checked_at >= ARTICLE_FIELD_RECHECK_SECONDS:
+            complete = await count_missing(None) == 0
+            self._article_field = (time.monotonic(), complete)
+            if not complete:
+                logger.warning("Hay fragmentos sin el campo 'article': el camino rápido se omite para sus documentos")
+        if complete:
+            return True
+        return await count_missing(base_filter) == 0
+
+    # --------------------------------------------------------------------------
+    # Catálogo de documentos
+    # --------------------------------------------------------------------------
+    # Colección "<colección>_catalog" sin vectores, con un punto por doc_id. Se actualiza
+    # al ingestar y al borrar; listar y consultar un documento no recorre los fragmentos.
+
+    CATALOG_FIELDS = ("doc_id", "source", "name", "description", "author", "upload_date",
+                      "status", "category_ids", "area", "chunks", "updated_at")
+
+    @staticmethod
+    def _catalog_id(doc_id: str) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"catalog:{doc_id}"))
+
+    @staticmethod
+    def _record_from_payload(payload: Dict) -> Dict:
+        """Registro de catálogo a partir del payload de un fragmento"""
+        metadata = payload.get("metadata", {}) or {}
+        return {
+            "doc_id": payload.get("doc_id"),
+            "source": payload.get("source"),
+            "name": metadata.get("name"),
+            "description": metadata.get("description"),
+            "author": metadata.get("author"),
+            "upload_date": payload.get("upload_date"),
+            "status": payload.get("status", "active"),
+            "category_ids": payload.get("category_ids", []),
+            "area": payload.get("area"),
+        }
+
+    def catalog_upsert(self, record: Dict) -> None:
+        """Crea o reemplaza el registro de un documento en el catálogo"""
+        payload = {key: record.get(key) for key in self.CATALOG_FIELDS}
+        payload["updated_at"] = datetime.now().isoformat()
+        point = PointStruct(id=self._catalog_id(record["doc_id"]), vector={}, payload=payload)
+        self._run(lambda c: c.upsert(self.catalog_collection, points=[point]))
+
+    def catalog_delete(self, doc_id: str) -> None:
+        self._run(lambda c: c.delete(
+            collection_name=self.catalog_collection,
+            points_selector=PointIdsList(points=[self._catalog_id(doc_id)])
+        ))
+
     def get_document_info(self, doc_id: str) -> Optional[Dict]:
-        """Obtiene información de un documento"""
-        scroll_result = self.client.scroll(
+        """Obtiene información de un documento (desde el catálogo)"""
+        found = self._run(lambda c: c.retrieve(
+            collection_name=self.catalog_collection,
+            ids=[self._catalog_id(doc_id)],
+            with_payload=True
+        ))
+        if found:
+            return found[0].payload
+        
+        # Documento aún no catalogado (p. ej. antes de la primera reconciliación)
+        scroll_result = self._run(lambda c: c.scroll(
             collection_name=self.collection,
             scroll_filter=Filter(
-                must=[FieldCondition(key="doc_id", match=MatchValue(value=doc_id))]
+                must=self._doc_filter(doc_id).must,
+                must_not=[STAGING_CONDITION]
             ),
             limit=1,
             with_payload=True,
             with_vectors=False
-        )
+        ))
         
         if scroll_result[0]:
-            point = scroll_result[0][0]
-            payload = getattr(point, "payload", {})
-            metadata = payload.get("metadata", {}) or {}
-            return {
-                "doc_id": payload.get("doc_id"),
-                "source": payload.get("source"),
-                "name": metadata.get("name"),
-                "description": metadata.get("description"),
-                "upload_date": payload.get("upload_date"),
-                "status": payload.get("status", "active"),
-                "category_ids": payload.get("category_ids", [])
-            }
+            payload = getattr(scroll_result[0][0], "payload", {}) or {}
+            return {**self._record_from_payload(payload), "chunks": self.count_document(doc_id)}
         return None
     
-    def list_documents(self, area: Optional[str] = None) -> List[Dict]:
+    def list_documents(self, area: Optional[str] = None, page_size: int = 1000) -> List[Dict]:
         """
-        Lista todos los documentos únicos en la colección
+        Lista todos los documentos del catálogo (un registro por doc_id, con su cantidad de fragmentos)
         Opcionalmente filtrados por área
         """
-        filter_conditions = []
+        query_filter = None
         if area:
-            filter_conditions.append(
-                FieldCondition(key="area", match=MatchValue(value=area))
-            )
+            query_filter = Filter(must=[FieldCondition(key="area", match=MatchValue(value=area))])
         
-        query_filter = Filter(must=filter_conditions) if filter_conditions else None
+        documents = []
+        offset = None
+        while True:
+            points, offset = self._run(lambda c: c.scroll(
+                collection_name=self.catalog_collection,
+                scroll_filter=query_filter,
+                limit=page_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False
+            ))
+            documents.extend(point.payload for point in points)
+            if offset is None:
+                return documents
+
+    def _schedule_catalog_rebuild(self) -> None:
+        """
+        Reconstruye en segundo plano el catálogo recién creado (la colección de fragmentos
+        puede tener datos previos). catalog_created se limpia solo cuando termina bien.
+        """
+        if self._catalog_rebuild is not None and self._catalog_rebuild.is_alive():
+            return
+
+        def rebuild():
+            try:
+                self.reconcile_catalog()
+                self.catalog_created = False
+            except Exception as e:
+                logger.error(f"No se pudo reconstruir el catálogo '{self.catalog_collection}': {e}")
+
+        self._catalog_rebuild = threading.Thread(target=rebuild, name="catalog-rebuild", daemon=True)
+        self._catalog_rebuild.start()
+
+    def reconcile_catalog(self, page_size: int = 1000) -> Dict:
+        """
+        Reconstruye el catálogo a partir de los fragmentos: recorre la colección paginando
+        (sin vectores ni texto), cuenta los fragmentos de cada doc_id, reescribe sus registros
+        y borra los registros de documentos que ya no tienen fragmentos.
+        """
+        documents: Dict[str, Dict] = {}
+        offset = None
+        scanned = 0
+        while True:
+            points, offset = self._run(lambda c: c.scroll(
+                collection_name=self.collection,
+                scroll_filter=Filter(must_not=[STAGING_CONDITION]),
+                limit=page_size,
+                offset=offset,
+                with_payload=["doc_id", "source", "metadata", "upload_date", "status", "category_ids", "area"],
+                with_vectors=False
+            ))
+            scanned += len(points)
+            for point in points:
+                payload = point.payload or {}
+                doc_id = payload.get("doc_id")
+                if not doc_id:
+                    continue
+                if doc_id not in documents:
+                    documents[doc_id] = {**self._record_from_payload(payload), "chunks": 0}
+                documents[doc_id]["chunks"] += 1
+            if offset is None:
+                break
         
-        # Scroll para obtener todos los documentos
-        scroll_result = self.client.scroll(
-            collection_name=self.collection,
-            scroll_filter=query_filter,
-            limit=10000,
-            with_payload=True,
-            with_vectors=False
-        )
+        cataloged = {record["doc_id"] for record in self.list_documents(page_size=page_size)}
+        for record in documents.values():
+            self.catalog_upsert(record)
+        orphans = cataloged - set(documents)
+        for doc_id in orphans:
+            self.catalog_delete(doc_id)
         
-        # Agrupar por doc_id para obtener documentos únicos
-        docs_dict = {}
-        for point in scroll_result[0]:
-            payload = getattr(point, "payload", {})
-            metadata = payload.get("metadata", {}) or {}
-            doc_id = payload.get("doc_id")
-            
-            if doc_id and doc_id not in docs_dict:
-                docs_dict[doc_id] = {
-                    "doc_id": doc_id,
-                    "source": payload.get("source"),
-                    "name": metadata.get("name"),
-                    "description": metadata.get("description"),
-                    "upload_date": payload.get("upload_date")
-                }
-        
-        return list(docs_dict.values())
\ No newline at end of file
+        result = {
+            "points_scanned": scanned,
+            "documents": len(documents),
+            "added": len(set(documents) - cataloged),
+            "removed": len(orphans),
+        }
+        logger.info(f"Catálogo reconciliado: {result}")
+        return result
+
+
+# ------------------------------------------------------------------------------
+# Instancia compartida por proceso
+# ------------------------------------------------------------------------------
+# Gunicorn carga la app antes del fork (preload_app = True); el cliente HTTP no debe
+# cruzar el fork, por eso la instancia se crea de forma perezosa en cada worker y se
+# descarta si el PID cambió.
+
+_storage: Optional[QdrantStorage] = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> QdrantStorage:
+    """Devuelve el QdrantStorage del proceso actual, creándolo si hace falta."""
+    global _storage
+    storage = _storage
+    if storage is None or storage.pid != os.getpid():
+        with _storage_lock:
+            if _storage is None or _storage.pid != os.getpid():
+                _storage = QdrantStorage(bootstrap=False)
+            storage = _storage
+    return storage
+
+
+async def close_storage() -> None:
+    """Cierra los clientes compartidos (shutdown del worker)."""
+    global _storage
+    if _storage is not None and _storage.pid == os.getpid():
+        await _storage.aclose()
+    _storage = None
+
+
+def reset_storage() -> None:
+    """Olvida la instancia heredada del proceso padre sin cerrar sus sockets."""
+    global _storage
+    _storage = None